@@ -1,9 +1,14 @@
-import sys, os, json, time, html, platform, rawpy, io, shutil, uuid
+import sys, os, json, time, html, platform, rawpy, io, shutil, uuid, sqlite3
 import traceback
+import hashlib
+import errno
 import ctypes
 import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import multiprocessing.util
 from numpy import number
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from functools import partial
 from PyQt5.QtCore import Qt, QTimer, QSettings, QPropertyAnimation, QRect, QSize, pyqtSignal, QEvent
 from PyQt5.QtWidgets import (
@@ -19,12 +24,25 @@ from PIL.Image import Resampling
 from pillow_heif import register_heif_opener
 from build_info import VERSION, BUILD_TIME
 from datetime import datetime, timedelta
-from utils.config_manager import Config
+from utils.config_manager import Config, SIMILARITY_TOLERANCE_MAX
 from utils.settings_dialog import SettingsDialog
 from utils.i18n import I18n, UiTextBinder
 from utils.common import resource_path
-from utils.constraints_store import ConstraintsStore
-from collections import OrderedDict
+from utils.constraints_store import ConstraintsStore, CONSTRAINTS_FILE
+from utils.autoscaler import WorkerAutoscaler
+from utils.phash import phash_stack, phash_from_tiles, phash_variants_from_tiles, DIHEDRAL_VARIANTS
+from utils.image_hash import HASH_ALGOS, hash_algos_need_color, hash_tiles, hashes_from_tiles, verify_threshold
+from utils.hamming_index import MultiIndexHash, VariantIndex, min_pairs
+from utils.clustering import PairGraph, extend_groups
+from utils.tile_store import TileStore, SIMILARITY_METRICS, pair_similarity
+from utils.hash_cache import HashCache, HASH_CACHE_FILE
+from utils.root_index import RootIndex, ROOT_INDEX_FILE
+from utils.hash_table import HashTable, HashEntries, STATUS_HASHED, STATUS_DEFERRED, DECODE_PATHS
+from utils.hash_journal import HashJournal
+from utils.json_writer import JsonWriter, write_json, write_pending
+from utils.root_cache import RootCache, file_stamp
+from utils.jobs import Job, JobRunner
+from collections import OrderedDict, namedtuple
 from utils.verify_build_signature import verify_build_signature
 from typing import List, Dict, Tuple
 import sip
@@ -33,22 +51,48 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 EXCEPTIONS_FILE = ".exceptions.json"
 FILELIST_FILE = ".filelist.json"
 PROGRESS_FILE = ".progress.json"
+QUARANTINE_FILE = ".quarantine.json"
+PAIRS_FILE = ".pairs.npz"
+TILES_FILE = ".tiles.npz"
+HASH_TABLE_FILE = ".hashes.bin"
+
+# Settings a running stage job works with, changed ones apply once it is done
+STAGE_SETTINGS = ("behavior.compare_file_size", "behavior.similarity_tolerance")
 
 register_heif_opener()
 
-# Configure worker number
+# Default worker number, overridden by performance.max_workers ("auto" scales up to os.cpu_count())
 MAX_WORKERS = 4
 
+# Minimum edge kept when JPEG is decoded in draft mode for hashing
+HASH_DRAFT_EDGE = 256
+# Max number of tiles collected before the batched pHash DCT runs
+PHASH_BATCH = 4096
+# Bytes read from head and tail of a file for the exact duplicate partial digest
+EXACT_PARTIAL_BYTES = 64 * 1024
+# Attempts and first backoff delay (doubled per retry) for transient I/O errors while hashing
+HASH_RETRIES = 3
+HASH_RETRY_BACKOFF = 0.5
+# Errors of network shares which may succeed when tried again
+_TRANSIENT_ERRNOS = {getattr(errno, name) for name in (
+    "EIO", "EAGAIN", "EBUSY", "ETIMEDOUT", "ECONNRESET", "ECONNABORTED",
+    "ENETDOWN", "ENETUNREACH", "EHOSTDOWN", "EHOSTUNREACH", "ESTALE"
+) if hasattr(errno, name)}
+# ERROR_BAD_NETPATH, ERROR_UNEXP_NET_ERR, ERROR_NETNAME_DELETED, ERROR_SEM_TIMEOUT, ERROR_NETWORK_UNREACHABLE
+_TRANSIENT_WINERRORS = {53, 59, 64, 121, 1231}
+# Algorithm tag of hashes kept in the global hash cache, bump when the hash output changes
+HASH_CACHE_ALGO = "phash-1"
+# Below this many hashes the pair search runs in process, starting a pool costs more than it saves
+COMPARE_SHARD_MIN_ITEMS = 50000
+# Max rows of the pair search per pool task, every worker gets a few shards
+COMPARE_SHARD_ROWS = 4096
+
 # Supported image format
 EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".cr2", ".cr3", ".nef", ".nrw", ".arw", ".raf", ".orf", ".dng", ".rw2", ".heic")
 RAW_EXTS = {".nef", ".nrw", ".cr2", ".cr3", ".arw", ".raf", ".rw2", ".orf", ".dng"}
+# Files whose hash depends on performance.fast_decode, JPEG and the JPEG preview of RAW files
+DRAFT_EXTS = {".jpg", ".jpeg", *RAW_EXTS}
 
-# Try to use imagehash; if it fails, use the backup method
-try:
-    import imagehash
-    IMAGEHASH_AVAILABLE = True
-except ImportError:
-    IMAGEHASH_AVAILABLE = False
 try:
     import winreg
 except Exception:
@@ -63,27 +107,73 @@ def _system_excepthook(exc_type, exc_value, exc_tb):
 
 sys.excepthook = _system_excepthook
 
-# Hash image
-def _alg_hashing_phash(abs_path):
-    try:
-        img = Image.open(abs_path)
-        if IMAGEHASH_AVAILABLE:
-            return int(str(imagehash.phash(img)), 16)  # Transform to int
-        else:
-            # Alternate method: Using simple hash method
-            img = img.convert('RGB')
-            img = img.resize((64, 64))
-            pixels = list(img.getdata())
-            
-            # Calculate average color for hash
-            avg_r = sum(p[0] for p in pixels) // len(pixels)
-            avg_g = sum(p[1] for p in pixels) // len(pixels)
-            avg_b = sum(p[2] for p in pixels) // len(pixels)
-            return hash((avg_r, avg_g, avg_b)) & 0xFFFFFFFF
-    except Exception as e:
-        print(f"[Error] hashing {abs_path}: {e}")
-        # Return default value instead of error
-        return 0
+# Open image for hashing.
+# JPEG is decoded in draft mode (DCT-domain scaling, grayscale) at the smallest 1/2, 1/4, 1/8 scale
+# which still keeps HASH_DRAFT_EDGE pixels, the hash only needs a 32x32 tile.
+# RAW files are hashed from their embedded preview (see _image_open_raw).
+# A colour hash needs mode "RGB", grayscale hashes only "L".
+def _alg_hashing_open(abs_path, fast=True, fp=None, mode="L"):
+    if os.path.splitext(abs_path)[1].lower() in RAW_EXTS:
+        img, decode = _image_open_raw(fp or abs_path)
+    else:
+        img, decode = Image.open(fp or abs_path), "full"
+    if fast and img.format == "JPEG":
+        if img.draft(mode, (HASH_DRAFT_EDGE, HASH_DRAFT_EDGE)) is not None:
+            decode = "draft" if decode == "full" else f"{decode}_draft"
+    return img, decode
+
+# True if a hash entry of rel was decoded another way than it is now, performance.fast_decode is on (fast)
+# and was on (was_fast) when the root was hashed before. Fast decoded entries end in "draft", a JPEG or RAW
+# decoded in full may be decoded in draft mode once fast decode is on.
+def _alg_hashing_decode_stale(rel, entry, fast, was_fast):
+    if entry.get("decode", "").endswith("draft"):
+        return not fast
+    return fast != was_fast and os.path.splitext(rel)[1] in DRAFT_EXTS
+
+# Decode image once to the input tiles of the hash algorithms, return ({algo: tile bytes}, decode path,
+# stat of the decoded file). The hashes run batched in the main process (see utils.image_hash).
+def _alg_hashing_tiles(abs_path, fast=True, algos=("phash",)):
+    with open(abs_path, "rb") as f:
+        st = _path_file_stat(os.fstat(f.fileno()))
+        img, decode = _alg_hashing_open(abs_path, fast, f, "RGB" if hash_algos_need_color(algos) else "L")
+        return hash_tiles(img, algos), decode, st
+
+# Decode image to the 32x32 pHash input tile, return (tile bytes, decode path, stat of the decoded file).
+def _alg_hashing_phash(abs_path, fast=True):
+    tiles, decode, st = _alg_hashing_tiles(abs_path, fast)
+    return tiles["phash"], decode, st
+
+# True for I/O errors worth another try, False for unreadable content (truncated, unknown format, ...)
+def _alg_hashing_is_transient(e):
+    if not isinstance(e, OSError):
+        return False
+    return e.errno in _TRANSIENT_ERRNOS or getattr(e, "winerror", None) in _TRANSIENT_WINERRORS
+
+# Digest of the first and last EXACT_PARTIAL_BYTES of a file
+def _alg_exact_partial_digest(abs_path, size):
+    h = hashlib.blake2b(digest_size=16)
+    with open(abs_path, "rb") as f:
+        h.update(f.read(EXACT_PARTIAL_BYTES))
+        if size > 2 * EXACT_PARTIAL_BYTES:
+            f.seek(-EXACT_PARTIAL_BYTES, os.SEEK_END)
+            h.update(f.read(EXACT_PARTIAL_BYTES))
+    return h.hexdigest()
+
+# Streaming digest of the whole file
+def _alg_exact_full_digest(abs_path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(abs_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Hamming distance pairs are linked at. Groups are transitive, so without the diameter cap pairs link at
+# the reported similarity tolerance. With it, above the tolerance by t/2, max 3, as the cap keeps every
+# pair of a group within the tolerance.
+def _alg_link_distance(t_report, capped=False):
+    if not capped:
+        return int(t_report)
+    return int(t_report) + min(3, int(t_report) // 2)
 
 # Based on operation, src path, dst path to eveluate actions on db of each roots.
 def _plan_fs_sync_operations(old_abs: str | None, new_abs: str | None, op: str):
@@ -295,8 +385,210 @@ def _cfg_ui_apply_theme(theme: str):
         # system
         QApplication.setStyle(None)
 
-def _alg_hashing_api(path):
-    return _alg_hashing_phash(path)
+# Hashing worker entry. With verify, fast decoded files also return the tile of a full decode
+# so the main process can report how far both hashes are apart.
+# algos are hash algorithms besides pHash, their tiles come from the same decode in "tiles".
+# A failed file returns tile None with the error, whether it was transient and the number of attempts.
+def _alg_hashing_api(path, fast=True, verify=False, algos=()):
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            if algos:
+                tiles, decode, st = _alg_hashing_tiles(path, fast, ("phash", *algos))
+                tile = tiles.pop("phash")
+            else:
+                tile, decode, st = _alg_hashing_phash(path, fast)
+                tiles = None
+            break
+        except Exception as e:
+            transient = _alg_hashing_is_transient(e)
+            if transient and attempts < HASH_RETRIES:
+                time.sleep(HASH_RETRY_BACKOFF * 2 ** (attempts - 1))
+                continue
+            print(f"[Error] hashing {path}: {e}")
+            try:
+                st = _path_file_stat(os.stat(path))
+            except OSError:
+                st = None
+            return {"tile": None, "decode": "error", "stat": st, "error": str(e) or type(e).__name__,
+                    "transient": transient, "attempts": attempts}
+    result = {"tile": tile, "decode": decode, "stat": st}
+    if tiles:
+        result["tiles"] = tiles
+    if verify and decode.endswith("draft"):
+        try:
+            result["verify_tile"] = _alg_hashing_phash(path, fast=False)[0]
+        except Exception as e:
+            print(f"[Error] hashing {path}: {e}")
+    return result
+
+# Pair search worker. Hashes are shared by the main process, each worker builds its index once.
+_compare_shard_shm = None
+_compare_shard_index = None
+
+# The main process owns the segment and unlinks it. Workers only attach and close their mapping on exit.
+# A worker must not leave the segment on a resource tracker of its own, that one would unlink it (or warn
+# about a leak) when the worker exits. Workers sharing the main process tracker keep the registration,
+# unregistering there would drop the owner's entry.
+def _alg_comparing_shard_init(shm_name, shape):
+    global _compare_shard_shm, _compare_shard_index
+    if sys.version_info >= (3, 13):
+        _compare_shard_shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    else:
+        own_tracker = os.name == "posix" and resource_tracker._resource_tracker._fd is None
+        _compare_shard_shm = shared_memory.SharedMemory(name=shm_name)
+        if own_tracker:
+            resource_tracker.unregister(_compare_shard_shm._name, "shared_memory")
+    multiprocessing.util.Finalize(None, _alg_comparing_shard_exit, exitpriority=10)
+    _compare_shard_index = _alg_comparing_index(np.ndarray(shape, dtype=np.uint64, buffer=_compare_shard_shm.buf))
+
+def _alg_comparing_shard_exit():
+    global _compare_shard_shm, _compare_shard_index
+    shm, _compare_shard_shm, _compare_shard_index = _compare_shard_shm, None, None
+    if shm is not None:
+        try:
+            shm.close()
+        except BufferError:
+            # A result still views the segment, the mapping goes away with the process
+            pass
+
+# Pair search index of the compare hashes, (N, variants) hashes match in any rotation and mirror
+def _alg_comparing_index(hashes):
+    return VariantIndex(hashes) if hashes.ndim == 2 else MultiIndexHash(hashes)
+
+# Pairs (i, j, dist) of rows start_row..stop_row
+def _alg_comparing_shard(radius, start_row, stop_row):
+    return _compare_shard_index.pairs_rows(radius, start_row, stop_row)
+
+# Row ranges not searched yet, split into shards of at most shard_rows
+def _alg_comparing_shards(searched, shard_rows):
+    pending = np.flatnonzero(np.diff(np.concatenate([[1], searched.view(np.int8), [1]])))
+    shards = []
+    for start, stop in zip(pending[::2].tolist(), pending[1::2].tolist()):
+        shards.extend((r, min(stop, r + shard_rows)) for r in range(start, stop, shard_rows))
+    return shards
+
+# Resolve performance.max_workers to (pool size, autoscale)
+def _cfg_resolve_max_workers(value) -> tuple[int, bool]:
+    cpus = os.cpu_count() or MAX_WORKERS
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return cpus, True
+    try:
+        return max(1, int(value)), False
+    except (TypeError, ValueError):
+        return min(MAX_WORKERS, cpus), False
+
+# Resolve compare.hash and compare.verify_hashes to (compare hash, verification hashes).
+# Unknown algorithms are reported and left out, the compare hash falls back to pHash.
+def _cfg_resolve_compare_hashes(name, verify) -> tuple[str, tuple]:
+    if name not in HASH_ALGOS:
+        print(f"[Warning] Unknown compare.hash {name}, using phash")
+        name = "phash"
+    if isinstance(verify, str):
+        verify = [verify]
+    checks = []
+    for v in verify or ():
+        if v not in HASH_ALGOS:
+            print(f"[Warning] Unknown compare.verify_hashes entry {v}")
+        elif v != name and v not in checks:
+            checks.append(v)
+    return name, tuple(checks)
+
+# Resolve compare.verify_thresholds ({name: max distance}) for the verification hashes.
+# Hashes without a valid entry get the default of their algorithm, scaled to its bits.
+def _cfg_resolve_verify_thresholds(names, thresholds) -> dict:
+    if not isinstance(thresholds, dict):
+        thresholds = {}
+    resolved = {}
+    for name in names:
+        value = thresholds.get(name)
+        try:
+            resolved[name] = verify_threshold(name) if value is None else max(0, int(value))
+        except (TypeError, ValueError):
+            print(f"[Warning] Invalid compare.verify_thresholds entry {name}: {value}")
+            resolved[name] = verify_threshold(name)
+    return resolved
+
+# Pixel check of candidate pairs from compare.verify_similarity / compare.verify_metric, (0, metric) when off
+def _cfg_resolve_compare_similarity(minimum, metric) -> tuple[float, str]:
+    if metric not in SIMILARITY_METRICS:
+        print(f"[Warning] Unknown compare.verify_metric {metric}, using ssim")
+        metric = "ssim"
+    try:
+        minimum = float(minimum or 0)
+    except (TypeError, ValueError):
+        print(f"[Warning] Invalid compare.verify_similarity {minimum}, check disabled")
+        minimum = 0.0
+    return minimum, metric
+
+# Resolve performance.root_index to True for the SQLite index, "json" keeps the JSON files
+def _cfg_resolve_root_index(backend) -> bool:
+    if backend not in ("json", "sqlite"):
+        print(f"[Warning] Unknown performance.root_index {backend}, using json")
+        return False
+    return backend == "sqlite"
+
+# Hashes in the order of the progress file, by hash value
+def _db_sorted_hashes(phashes) -> dict:
+    if isinstance(phashes, HashEntries):
+        table = phashes.table()
+        order = np.argsort(np.where(table.status == STATUS_HASHED, table.hash, 0), kind="stable")
+        return {table.paths[k]: phashes[table.paths[k]] for k in order.tolist()}
+    return {k: phashes[k] for k in sorted(phashes, key=lambda k: phashes[k].get("hash") or 0)}
+
+# Write progress data on the writer thread: the JSON file with every entry, read by builds without the hash
+# table, then the hash table file with the columns of the entries (HashEntries), their sparse fields and the
+# rest of the data. The table keeps the stamp of the JSON file it was written with, see _db_load_progress_json.
+def _db_write_progress(file, data):
+    phashes = data["phashes"]
+    write_json(file, dict(data, phashes=_db_sorted_hashes(phashes)))
+    if not isinstance(phashes, HashEntries):
+        return
+    try:
+        progress = {k: v for k, v in data.items() if k != "phashes"}
+        meta = {"progress": progress, "sparse": phashes.sparse(), "progress_stamp": list(file_stamp(file))}
+        phashes.table(meta).save(os.path.join(os.path.dirname(file), HASH_TABLE_FILE))
+    except Exception as e:
+        print(f"[Error] saving hash table: {e}")
+
+# Remove file on the writer thread, after the writes queued before
+def _db_remove_file(file, data):
+    if os.path.exists(file):
+        os.remove(file)
+
+# Hashed files of a compare sorted by compare hash, as columns
+CompareItems = namedtuple("CompareItems", "paths hashes sizes")
+
+# Stat fields kept per file from the folder walk to hashing, one metadata round-trip per file and run
+FileStat = namedtuple("FileStat", "st_size st_mtime st_mtime_ns st_dev st_ino")
+
+def _path_file_stat(st) -> FileStat:
+    return FileStat(st.st_size, st.st_mtime, st.st_mtime_ns, st.st_dev, st.st_ino)
+
+# Top-down walk like os.walk (symlinked dirs are not followed) that yields the DirEntry of files,
+# their stat() comes with the directory listing on Windows. Dirs containing an exclude text are skipped.
+def _path_walk_files(top, exclude_dirs=()):
+    stack = [top]
+    while stack:
+        root = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        files, subdirs = [], []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink() and not any(ex in entry.name.lower() for ex in exclude_dirs):
+                        subdirs.append(entry.path)
+                else:
+                    files.append(entry)
+            except OSError:
+                continue
+        yield root, files
+        stack.extend(reversed(subdirs))
 
 # If abs_path is in progress file of some folders, return there rel_paths and roots abs_path
 def _path_abs_to_rels_and_roots(abs_path: str) -> tuple[list[str], list[str]]:
@@ -338,7 +630,8 @@ def _path_find_progress_root(start_path: str) -> str | None:
 
         while True:
             pf = os.path.join(d, PROGRESS_FILE)
-            if os.path.exists(pf):
+            # A root saved the first time has its progress file once the writer is done with it
+            if os.path.exists(pf) or write_pending(pf):
                 return d
             parent = os.path.dirname(d)
             if parent == d:
@@ -414,27 +707,32 @@ def _path_collect_files(abs_dir: str):
             print(f"[walk error] {abs_dir}: {e}")
         return results
 
+# Open RAW file from its embedded preview, fall back to a half size postprocess.
+# Shared by hashing and thumbnail, return (img, decode path)
+def _image_open_raw(path):
+    with rawpy.imread(path) as raw:
+        try:
+            thumb = raw.extract_thumb()
+            if thumb.format == rawpy.ThumbFormat.JPEG:
+                return Image.open(io.BytesIO(thumb.data)), "raw_preview"
+            else:
+                return Image.fromarray(thumb.data), "raw_bitmap"
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            rgb = raw.postprocess(
+                use_camera_wb=True,
+                no_auto_bright=True,
+                half_size=True,
+                gamma=(1, 1)
+            )
+            return Image.fromarray(rgb), "raw_half"
+
 # Load image for thumbnail
 def _image_load_for_thumb(path, want_min_edge=1400):
     ext = os.path.splitext(path)[1].lower()
     try:
         if ext in RAW_EXTS:
-            with rawpy.imread(path) as raw:
-                try:
-                    thumb = raw.extract_thumb()
-                    if thumb.format == rawpy.ThumbFormat.JPEG:
-                        img = Image.open(io.BytesIO(thumb.data))
-                        img.load()
-                    else:
-                        img = Image.fromarray(thumb.data)
-                except rawpy.LibRawNoThumbnailError as e:
-                    rgb = raw.postprocess(
-                        use_camera_wb=True,
-                        no_auto_bright=True,
-                        half_size=True,
-                        gamma=(1, 1)
-                    )
-                    img = Image.fromarray(rgb)
+            img, _ = _image_open_raw(path)
+            img.load()
         else:
             img = Image.open(path)
     except Exception as e:
@@ -469,6 +767,364 @@ def _resource_path(rel_path: str) -> str:
             return p
     return candidates[0]
 
+# Background jobs of the scan, hashing and compare stages, run by JobRunner off the GUI thread.
+# They only touch their own inputs, results reach the window through signals and job.result.
+
+# Walk a root for images over 50 KB. Result (rel paths, {rel path: FileStat}), None when cancelled.
+# Reports (files found, 0).
+# Walk a scan root for images, then check the hash entries the root had (table, HashTable columns) against
+# the files found: the result is (paths, stats, gone, changed), gone the entries of files not found anymore,
+# changed those whose mtime or size differs from the file's.
+class ScanJob(Job):
+    def __init__(self, top, exclude_dirs, status_text=None, table=None):
+        super().__init__(status_text=status_text)
+        self.top = top
+        self.exclude_dirs = exclude_dirs
+        self.table = table
+
+    def run(self, token):
+        paths, stats = [], {}
+        last_report = 0
+        for root, entries in _path_walk_files(self.top, self.exclude_dirs):
+            if token.cancelled:
+                return None
+            for entry in entries:
+                if os.path.splitext(entry.name.lower())[1] not in EXTS:
+                    continue
+                try:
+                    st = _path_file_stat(entry.stat())
+                except OSError as e:
+                    print(f"[Error] Stat: {entry.path} - {e}")
+                    continue
+                if st.st_size > 50000:
+                    rel_path = os.path.relpath(entry.path, self.top).replace("\\","/").lower()
+                    paths.append(rel_path)
+                    stats[rel_path] = st
+            if time.time() - last_report > 0.1:
+                last_report = time.time()
+                self.report(len(paths), 0)
+        if self.table is None or not len(self.table):
+            return paths, stats, [], []
+        gone, changed = self._stale(self.table, stats)
+        return paths, stats, gone, changed
+
+    @staticmethod
+    def _stale(table, stats):
+        found = [stats.get(p) for p in table.paths]
+        known = np.array([st is not None for st in found], dtype=bool)
+        size = np.array([st.st_size if st is not None else -1 for st in found], dtype=np.int64)
+        mtime = np.array([st.st_mtime if st is not None else np.nan for st in found], dtype=np.float64)
+        differ = known & ((size != table.size) | (mtime != table.mtime))
+        return [table.paths[k] for k in np.flatnonzero(~known).tolist()], [table.paths[k] for k in np.flatnonzero(differ).tolist()]
+
+# Hash files in a process pool. A bounded number of tasks is kept in flight and refilled as soon as
+# any finishes, so one slow RAW/HEIC file does not leave the other workers idle. In auto mode the pool
+# is sized to all CPUs and the autoscaler decides how many are fed. Finished files are sent through
+# `hashed` in batches of [(abs path, result)], a crashed worker gives a transient failure result.
+class HashJob(Job):
+    hashed = pyqtSignal(list)
+
+    def __init__(self, files, fast, verify, max_workers, inflight_per_worker, algos=()):
+        super().__init__()
+        self.files = files
+        self.fast = fast
+        self.verify = verify
+        self.max_workers = max_workers
+        self.inflight_per_worker = inflight_per_worker
+        self.algos = tuple(algos)
+
+    def run(self, token):
+        workers, auto = _cfg_resolve_max_workers(self.max_workers)
+        autoscaler = WorkerAutoscaler(workers, start_workers=min(MAX_WORKERS, workers)) if auto else None
+        active_workers = autoscaler.workers if autoscaler else workers
+        inflight_limit = max(1, active_workers * self.inflight_per_worker)
+        next_index = 0
+        batch = []
+        last_report = time.time()
+        exe = ProcessPoolExecutor(max_workers=workers)
+        futs = {}
+        try:
+            while not token.cancelled:
+                while next_index < len(self.files) and len(futs) < inflight_limit:
+                    p = self.files[next_index]
+                    futs[exe.submit(_alg_hashing_api, p, self.fast, self.verify, self.algos)] = p
+                    next_index += 1
+                if not futs:
+                    break
+
+                done, _ = wait(futs, timeout=0.1, return_when=FIRST_COMPLETED)
+                if token.cancelled:
+                    break
+                for f in done:
+                    p = futs.pop(f)
+                    try:
+                        batch.append((p, f.result()))
+                    except Exception as e:
+                        # Worker crashed, try again next run
+                        print(f"[Error] Hash: {p} - {e}")
+                        batch.append((p, {"tile": None, "decode": "error", "error": str(e), "transient": True}))
+
+                if autoscaler and done:
+                    active_workers = autoscaler.record(len(done))
+                    inflight_limit = max(1, active_workers * self.inflight_per_worker)
+
+                if batch and (len(batch) >= PHASH_BATCH or time.time() - last_report > 0.2):
+                    self.hashed.emit(batch)
+                    batch = []
+                    last_report = time.time()
+        finally:
+            # Don't wait for queued tasks when cancelled
+            exe.shutdown(wait=False, cancel_futures=True)
+            if batch:
+                self.hashed.emit(batch)
+        return not token.cancelled
+
+# Search pairs within radius of the rows not searched yet, marks them in searched and appends
+# (i, j, dist) to found. Shards of rows run in a process pool sharing the hashes when there are
+# enough of them, rows a failed shard left are searched in process. Result False when cancelled.
+# Reports (rows searched, rows) with pairs, the number of pairs found so far.
+# Hashes of shape (N, variants) are searched with VariantIndex.
+class PairSearchJob(Job):
+    def __init__(self, hashes, radius, searched, found, max_workers, status_text=None):
+        super().__init__(status_text=status_text)
+        self.hashes = hashes
+        self.radius = radius
+        self.searched = searched
+        self.found = found
+        self.max_workers = max_workers
+        self.pairs = sum(len(f[0]) for f in found)
+
+    def _add(self, start, stop, result):
+        self.found.append(result)
+        self.searched[start:stop] = True
+        self.pairs += len(result[0])
+
+    def run(self, token):
+        hashes = self.hashes
+        total = len(hashes)
+        workers, _ = _cfg_resolve_max_workers(self.max_workers)
+        shard_rows = max(256, min(COMPARE_SHARD_ROWS, total // (workers * 4) + 1))
+        shards = _alg_comparing_shards(self.searched, shard_rows)
+
+        if total >= COMPARE_SHARD_MIN_ITEMS and workers > 1 and len(shards) > 1:
+            shm = None
+            exe = None
+            try:
+                shm = shared_memory.SharedMemory(create=True, size=hashes.nbytes)
+                np.ndarray(hashes.shape, dtype=np.uint64, buffer=shm.buf)[:] = hashes
+                exe = ProcessPoolExecutor(max_workers=workers, initializer=_alg_comparing_shard_init,
+                                          initargs=(shm.name, hashes.shape))
+                futs = {exe.submit(_alg_comparing_shard, self.radius, start, stop): (start, stop) for start, stop in shards}
+                while futs:
+                    done, _ = wait(futs, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        start, stop = futs.pop(f)
+                        try:
+                            self._add(start, stop, f.result())
+                        except Exception as e:
+                            print(f"[Error] Compare shard {start}-{stop}: {e}")
+                    if done:
+                        self.report(int(self.searched.sum()), total, pairs=self.pairs)
+                    if token.cancelled:
+                        return False
+            except Exception as e:
+                print(f"[Error] Compare pool: {e}")
+            finally:
+                # Don't wait for queued shards when cancelled, otherwise let the workers detach before unlinking
+                if exe is not None:
+                    exe.shutdown(wait=not token.cancelled, cancel_futures=True)
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+            shards = _alg_comparing_shards(self.searched, shard_rows)
+
+        index = _alg_comparing_index(hashes) if shards else None
+        last_report = time.time()
+        for start, stop in shards:
+            for next_row, i, j, d in index.pairs(self.radius, start, stop_row=stop):
+                self._add(start, next_row, (i, j, d))
+                if time.time() - last_report > 0.3:
+                    last_report = time.time()
+                    self.report(int(self.searched.sum()), total, pairs=self.pairs)
+                if token.cancelled:
+                    return False
+        return True
+
+# Byte-identical files among files of the same size: a head/tail digest first, a full streaming digest
+# only for files sharing one. Files up to 2 * EXACT_PARTIAL_BYTES are digested in full right away.
+# candidates is [(size, [(rel path, abs path, stored partial, stored digest)])], stored digests are reused.
+# Result (exact groups, {rel path: digest}, {rel path: partial}) of every file read or reused, None when
+# cancelled. Reports (files checked, files) with path, the file checked last.
+class ExactDigestJob(Job):
+    def __init__(self, candidates, status_text=None):
+        super().__init__(status_text=status_text)
+        self.candidates = candidates
+
+    def run(self, token):
+        total = sum(len(files) for _, files in self.candidates)
+        checked = 0
+        last_report = 0
+        exact_groups, all_digests, all_partials = [], {}, {}
+        for size, files in self.candidates:
+            digests, partials, by_partial, abs_paths = {}, {}, {}, {}
+            for rel, abs_path, partial, digest in files:
+                if token.cancelled:
+                    return None
+                checked += 1
+                abs_paths[rel] = abs_path
+                try:
+                    if size <= 2 * EXACT_PARTIAL_BYTES:
+                        # The whole file costs no more than a partial digest
+                        key = digests[rel] = digest or _alg_exact_full_digest(abs_path)
+                    else:
+                        key = partials[rel] = partial or _alg_exact_partial_digest(abs_path, size)
+                        if digest:
+                            digests[rel] = digest
+                except OSError as e:
+                    print(f"[Error] Digest: {rel} - {e}")
+                    continue
+                by_partial.setdefault(key, []).append(rel)
+                if time.time() - last_report > 0.3:
+                    last_report = time.time()
+                    self.report(checked, total, path=rel)
+
+            # Confirm partial matches with a full digest
+            for partial_rels in by_partial.values():
+                if len(partial_rels) < 2:
+                    continue
+                for rel in partial_rels:
+                    if rel in digests:
+                        continue
+                    if token.cancelled:
+                        return None
+                    try:
+                        digests[rel] = _alg_exact_full_digest(abs_paths[rel])
+                    except OSError as e:
+                        print(f"[Error] Digest: {rel} - {e}")
+
+            by_digest = {}
+            for rel, digest in digests.items():
+                by_digest.setdefault(digest, []).append(rel)
+            exact_groups.extend(sorted(g) for g in by_digest.values() if len(g) > 1)
+            all_digests.update(digests)
+            all_partials.update(partials)
+        return sorted(exact_groups), all_digests, all_partials
+
+# Look files up in the global hash cache (HashCache), which is opened on the job thread.
+# files is [(rel path, abs path, FileStat or None, content digest or None)], a missing stat or one without
+# a file id (listings on Windows have none) is read here. Result ([(rel path, FileStat, (hash, decode))]
+# of the hits, [rel path] still to hash), None when cancelled. Reports (files checked, files) with
+# hits, the hits so far, and path, the file checked last.
+class CacheLookupJob(Job):
+    def __init__(self, algo, path, max_entries, files, status_text=None):
+        super().__init__(status_text=status_text)
+        self.algo = algo
+        self.path = path
+        self.max_entries = max_entries
+        self.files = files
+
+    def run(self, token):
+        try:
+            cache = HashCache(self.algo, self.path, max_entries=self.max_entries)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[Warning] Hash cache disabled: {e}")
+            return [], [rel for rel, _, _, _ in self.files]
+        found, remaining = [], []
+        last_report = 0
+        try:
+            for k, (rel, abs_path, st, digest) in enumerate(self.files):
+                if token.cancelled:
+                    return None
+                try:
+                    if st is None or not st.st_ino:
+                        st = _path_file_stat(os.stat(abs_path))
+                    cached = cache.get(HashCache.key(st), digest)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"[Error] Hash cache: {rel} - {e}")
+                    cached = None
+                if cached is None:
+                    remaining.append(rel)
+                else:
+                    found.append((rel, st, cached))
+                if time.time() - last_report > 0.3:
+                    last_report = time.time()
+                    self.report(k + 1, len(self.files), hits=len(found), path=rel)
+        finally:
+            try:
+                cache.close()
+            except sqlite3.Error as e:
+                print(f"[Warning] Hash cache: {e}")
+        return found, remaining
+
+# Search pairs within radius of the given rows against every row, for files the stored pair graph
+# doesn't know. Pairs of two of these rows are found from the lower one, added masks them.
+# Result (i, j, d) with i < j, None when cancelled. Reports (rows searched, rows) with pairs, the
+# number of pairs found so far. Hashes of shape (N, variants) are searched with VariantIndex.
+class RowSearchJob(Job):
+    def __init__(self, hashes, rows, added, radius, status_text=None):
+        super().__init__(status_text=status_text)
+        self.hashes = hashes
+        self.rows = rows
+        self.added = added
+        self.radius = radius
+
+    def run(self, token):
+        index = _alg_comparing_index(self.hashes) if self.rows else None
+        found_i, found_j, found_d = [], [], []
+        pairs = 0
+        last_report = time.time()
+        for n, k in enumerate(self.rows):
+            if token.cancelled:
+                return None
+            ids, dists = index.query_row(k, self.radius)
+            keep = (ids != k) & ~(self.added[ids] & (ids < k))
+            ids, dists = ids[keep], dists[keep]
+            found_i.append(np.minimum(ids, k))
+            found_j.append(np.maximum(ids, k))
+            found_d.append(dists)
+            pairs += len(ids)
+            if time.time() - last_report > 0.3:
+                last_report = time.time()
+                self.report(n + 1, len(self.rows), pairs=pairs)
+        if not found_i:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d).astype(np.uint8)
+
+# Emit the groups of clusters (lists of rows of paths) in row order from row start on. Files in grouped
+# are left out, every group of 2+ files left is sent through group_found. With stop_at_group the job
+# ends after the first group. Result (row to go on from, stopped at a group), the row is also set
+# when cancelled. Reports (rows done, rows) with path, the path of the row done last, and groups,
+# the number of groups sent so far.
+class GroupJob(Job):
+    def __init__(self, paths, clusters, grouped, start, stop_at_group, status_text=None):
+        super().__init__(status_text=status_text)
+        self.paths = paths
+        self.clusters = clusters
+        self.grouped = set(grouped)
+        self.start = start
+        self.stop_at_group = stop_at_group
+
+    def run(self, token):
+        cluster_at = {c[0]: c for c in self.clusters}
+        total = len(self.paths)
+        groups = 0
+        last_report = 0
+        for i in range(self.start, total):
+            if token.cancelled:
+                return i, False
+            cluster = cluster_at.get(i)
+            new_grp = [self.paths[k] for k in cluster if self.paths[k] not in self.grouped] if cluster else []
+            if len(new_grp) > 1:
+                groups += 1
+                self.grouped.update(new_grp)
+                self.group_found.emit(new_grp)
+                if self.stop_at_group:
+                    return i + 1, True
+            if time.time() - last_report > 0.5:
+                last_report = time.time()
+                self.report(i + 1, total, path=self.paths[i], groups=groups)
+        return total, False
+
 # Class for Browser
 class BrowserListWidget(QListWidget):
     operationRequested = pyqtSignal(str, list, str)
@@ -1003,7 +1659,7 @@ class MatchImageFinder(QMainWindow):
         self.work_folder = None
         self.stage = "init"
         self.image_paths = []
-        self.phashes = {}
+        self.phashes = HashEntries()
         self.groups = []
         self.current = 0
         self.dialogs = []
@@ -1013,6 +1669,7 @@ class MatchImageFinder(QMainWindow):
         self.duplicate_size = 0
         self.hash_format = "v2"
         self.compare_index = 0
+        self.compare_incremental = False
         self.forward = True
         self.progress_file = None
         self.exceptions_file = None
@@ -1031,7 +1688,22 @@ class MatchImageFinder(QMainWindow):
         self.display_same_images = True
         self.show_original_groups = False
         self.show_processing_image = False
-        self.visited = set()
+        self.image_stats = {}
+        self.hash_quarantine = []
+        self.hash_verify_stats = None
+        self.compare_clusters_cache = None
+        self.compare_graph = None
+        self.compare_similarity = None
+        self.tile_store = None
+        self.hash_table = None
+        self.hash_table_source = None
+        self.hash_journal = None
+        self.hash_checkpoint = None
+        self.progress_journal = None
+        self.exact_groups = []
+        self.exact_alias = {}
+        self.exact_digests = {}
+        self.exact_partials = {}
         self.related_files_mode = False
         # Fixed issue: APP will not compare if only progress file is not exist.
         # Root cause: `progress_compare_file_size` and 'progress_similarity_tolerance' are not defined,
@@ -1039,6 +1711,7 @@ class MatchImageFinder(QMainWindow):
         # Solution: Init these variables.
         self.progress_compare_file_size = 0
         self.progress_similarity_tolerance = 0
+        self.progress_compare_cascade = None
         
         self.exception_folder = None
         self.last_group_index = 0
@@ -1055,6 +1728,51 @@ class MatchImageFinder(QMainWindow):
         self.auto_next_cb.setChecked(self.cfg.get("behavior.auto_next_group", True))
         self.compare_file_size = (bool(self.cfg.get("behavior.compare_file_size", True)))
         self.similarity_tolerance = int(self.cfg.get("behavior.similarity_tolerance", 5))
+        self.hash_max_workers = self.cfg.get("performance.max_workers", MAX_WORKERS)
+        self.hash_inflight_per_worker = max(1, int(self.cfg.get("performance.inflight_per_worker", 2)))
+        self.hash_fast_decode = bool(self.cfg.get("performance.fast_decode", True))
+        self.hash_verify_fast_decode = bool(self.cfg.get("performance.verify_fast_decode", False))
+        self.compare_cap_group_diameter = bool(self.cfg.get("compare.cap_group_diameter", False))
+        self.compare_graph_max_tolerance = int(self.cfg.get("compare.graph_max_tolerance", SIMILARITY_TOLERANCE_MAX))
+        self.compare_workers = self.cfg.get("performance.compare_workers", "auto")
+        self.compare_hash, self.compare_verify_hashes = _cfg_resolve_compare_hashes(
+            self.cfg.get("compare.hash", "phash"), self.cfg.get("compare.verify_hashes", []))
+        self.compare_verify_thresholds = _cfg_resolve_verify_thresholds(
+            self.compare_verify_hashes, self.cfg.get("compare.verify_thresholds", {}))
+        # Match files in any rotation or mirror, only pHash has the variants
+        self.compare_rotation = bool(self.cfg.get("compare.rotation_invariant", False))
+        if self.compare_rotation and self.compare_hash != "phash":
+            print("[Warning] compare.rotation_invariant needs compare.hash phash, ignored")
+            self.compare_rotation = False
+        elif self.compare_rotation and self.compare_verify_hashes:
+            print("[Warning] compare.verify_hashes are not rotation invariant, rotated copies won't pass them")
+        # Candidate pairs below this tile similarity are dropped, 0 is off
+        self.compare_similarity_min, self.compare_similarity_metric = _cfg_resolve_compare_similarity(
+            self.cfg.get("compare.verify_similarity", 0), self.cfg.get("compare.verify_metric", "ssim"))
+        # Hashes computed besides pHash, all from the same decode
+        self.hash_algos = tuple(n for n in HASH_ALGOS if n != "phash" and n in (self.compare_hash, *self.compare_verify_hashes))
+        self.hash_cache_enabled = bool(self.cfg.get("performance.hash_cache", True))
+        self.hash_cache_max_entries = int(self.cfg.get("performance.hash_cache_max_entries", 2000000))
+        self.hash_cache = None
+        # Hashes are logged while hashing and folded into the progress data on a time or size budget
+        self.journal_fsync_interval = float(self.cfg.get("performance.journal_fsync_seconds", 1.0))
+        self.journal_checkpoint_seconds = float(self.cfg.get("performance.journal_checkpoint_seconds", 300))
+        self.journal_checkpoint_bytes = int(float(self.cfg.get("performance.journal_checkpoint_mb", 64)) * 1024 * 1024)
+        # Progress, file list, exceptions and constraints of a root in a SQLite index instead of the JSON files
+        self.root_index_enabled = _cfg_resolve_root_index(self.cfg.get("performance.root_index", "json"))
+        self.root_indexes = {}
+        # Scan, hashing and compare stages run here, off the GUI thread. The stage goes on from the job
+        # it waits for (stage_job), file operations, a continue click and settings the stage works with
+        # meanwhile are handled once it is done.
+        self.jobs = JobRunner(self)
+        self.stage_job = None
+        self.sync_deferred = []
+        self.continue_deferred = False
+        self.settings_deferred = []
+        # Progress, file list and exceptions JSON files are written here, off the GUI thread
+        self.json_writer = JsonWriter()
+        # Parsed JSON files of the roots used lately, a root loaded again or updated by file operations isn't parsed again
+        self.root_cache = RootCache(self.cfg.get("performance.root_cache_roots", 4))
         self._browser_view_style_key = self.cfg.get("ui.browser_view_style_key", "medium") # list | small | medium | large
         self._browser_sort_key = (self.cfg.get("ui.browser_sort_key", "name"))
         self._browser_sort_asc = (bool(self.cfg.get("ui.browser_order_asc", True)))
@@ -1369,12 +2087,17 @@ class MatchImageFinder(QMainWindow):
     
     # Open perferences dialog
     def _cfg_open_preferences(self):
-        dlg = SettingsDialog(self.cfg, self.i18n, self.i18n_binder, parent=self)
+        dlg = SettingsDialog(self.cfg, self.i18n, self.i18n_binder, parent=self, group_count_preview=self._alg_comparing_preview_groups)
         dlg.settings_applied.connect(self._cfg_apply_settings)
         dlg.exec_()
     
     # Apply setting
     def _cfg_apply_settings(self, changed_keys: list):
+        # Settings the stage works with aren't changed under a running stage job, they apply once it is done
+        if self.stage_job is not None:
+            held = [k for k in changed_keys if k in STAGE_SETTINGS]
+            self.settings_deferred.extend(k for k in held if k not in self.settings_deferred)
+            changed_keys = [k for k in changed_keys if k not in STAGE_SETTINGS]
         # Have to press hot-apply
         if "ui.font_size" in changed_keys:
             self.fontsize = int(self.cfg.get("ui.font_size", 12))
@@ -1428,7 +2151,9 @@ class MatchImageFinder(QMainWindow):
             self.compare_file_size = int(self.cfg.get("behavior.compare_file_size"))
             self.similarity_tolerance = self.cfg.get("behavior.similarity_tolerance")
             if (self.action == "show_group" or self.action == "show_overview") and (self.stage=="done" or self.stage=="comparing"):
+                # Regrouped from the stored pair graph, no new search within its radius
                 self.compare_index = 0
+                self.compare_incremental = False
                 self.groups = []
                 self.duplicate_size = 0
                 self._alg_comparing_api()
@@ -1977,6 +2702,7 @@ class MatchImageFinder(QMainWindow):
                     else:
                         ops.append((old_abs,new_abs,"move"))
                     os.rename(old_abs, new_abs)
+                    self.root_cache.discard(os.path.abspath(old_abs))
                     if ops:
                         self._browser_sync_batch(ops)
             self._status_refresh_text()
@@ -2027,7 +2753,8 @@ class MatchImageFinder(QMainWindow):
                             ext = os.path.splitext(old_abs)[1].lower()
                             if ext in EXTS:
                                 ops.append((old_abs,None,"delete"))
-                        shutil.rmtree(p)                    
+                        shutil.rmtree(p)
+                        self.root_cache.discard(os.path.abspath(p))
                 except Exception as e:
                     self._popup_information(self.i18n.t("err.fail_to_op_files", default="File operation failed: ") + str(e))
             if ops:
@@ -2073,6 +2800,7 @@ class MatchImageFinder(QMainWindow):
         abs_path = item.data(Qt.UserRole)
         if self.stage == "collecting":
             self.paused = True
+            self.jobs.cancel()
         if not abs_path:
             return
 
@@ -2127,7 +2855,7 @@ class MatchImageFinder(QMainWindow):
                     self._db_unlock(self.work_folder)
                     self._work_folder_clear_variable()
                     continue
-                self.constraints = ConstraintsStore(self.work_folder)
+                self.constraints = ConstraintsStore(self.work_folder, index=self._db_index(self.work_folder))
                 self.view_groups, self.view_summary = self.constraints.apply_to_all_groups(self.groups)
                 idx = next((i for i, grp in enumerate(self.view_groups) if rels[ridx] in grp), None)
                 if idx is not None:
@@ -2205,6 +2933,7 @@ class MatchImageFinder(QMainWindow):
         if op == "move":
             for path in sorted(dirs, key=lambda p: len(p), reverse=True):
                 os.rmdir(path)
+            self.root_cache.discard(os.path.abspath(src_dir_abs))
         
         self._browser_sync_batch(ops)
         self._status_refresh_text()
@@ -2254,142 +2983,149 @@ class MatchImageFinder(QMainWindow):
                 cache[new_abs] = cache.pop(old_abs)
                 cache.move_to_end(new_abs)
 
-    # Update constraints
-    def _browser_constraints_rename(self, old_rel: str, new_rel: str):
+    # Update constraints, renames maps a path to its new path or to None if it was deleted. Saved by the caller.
+    def _browser_constraints_rename(self, renames: dict):
+        if not renames:
+            return
         try:
-            changed = False
-            if hasattr(self.constraints, "must_pairs"):
-                mp = []
-                for a, b in self.constraints.must_pairs:
-                    na = new_rel if a == old_rel else a
-                    nb = new_rel if b == old_rel else b
-                    mp.append((na, nb))
-                self.constraints.must_pairs = mp
-                changed = True
-            if hasattr(self.constraints, "cannot_pairs"):
-                cp = []
-                for a, b in self.constraints.cannot_pairs:
-                    na = new_rel if a == old_rel else a
-                    nb = new_rel if b == old_rel else b
-                    cp.append((na, nb))
-                self.constraints.cannot_pairs = cp
-                changed = True
-            if hasattr(self.constraints, "ignored_files"):
-                ig = set(self.constraints.ignored_files) if not isinstance(self.constraints.ignored_files, set) else self.constraints.ignored_files
-                if old_rel in ig:
-                    ig.discard(old_rel)
-                    if new_rel:
-                        ig.add(new_rel)
-                    self.constraints.ignored_files = ig
-                    changed = True
-            if changed:
-                self.constraints.save_constraints()
+            def _rename_pairs(pairs):
+                out = set()
+                for a, b in pairs:
+                    na, nb = renames.get(a, a), renames.get(b, b)
+                    if na and nb:
+                        out.add(tuple(sorted((na, nb))))
+                return out
+            self.constraints.must_pairs = _rename_pairs(self.constraints.must_pairs)
+            self.constraints.cannot_pairs = _rename_pairs(self.constraints.cannot_pairs)
+            self.constraints.ignored_files = {renames.get(p, p) for p in self.constraints.ignored_files} - {None}
         except Exception as e:
             print(f"[Constraints rename error] {e}")
 
-    # Update groups data
-    def _group_replace_path(self, old_rel: str, new_rel: str | None):
+    # Update groups data, renames maps a path to its new path or to None if it was deleted
+    def _group_replace_paths(self, renames: dict):
+        if not renames:
+            return
+        # Exact groups follow renames and deletes too
+        new_exact = []
+        for grp in self.exact_groups:
+            repl = [q for q in (renames.get(p, p) for p in grp) if q]
+            if len(repl) > 1:
+                new_exact.append(repl)
+        self.exact_groups = new_exact
         if not hasattr(self, "groups") or not self.groups:
             return
         new_groups = []
         for grp in self.groups:
-            changed = False
-            repl = []
-            for p in grp:
-                if p == old_rel:
-                    if new_rel:
-                        repl.append(new_rel)
-                    changed = True
-                else:
-                    repl.append(p)
-
-            if len(repl) > 1:
-                new_groups.append(repl)
-            elif not changed:
+            repl = [q for q in (renames.get(p, p) for p in grp) if q]
+            if len(repl) > 1 or len(repl) == len(grp):
                 new_groups.append(repl)
         self.groups = new_groups
 
-    # Update db with add/delete/replace within a root
+    # Update db with add/delete/replace within a root, the caller holds the lock of the root
     def _db_update(self, root: str, batch_ops: list):
-        if not self._db_lock_check_and_create(root):
-            return
-        try:
-            # Load db
-            self._db_load_filelist(root)
-            self._db_load_progress(root)
-            self.constraints = ConstraintsStore(scan_folder=root)
-
-            for a in batch_ops:
-                act   = a.get("act")
-                orel  = a.get("old_rel")
-                nrel  = a.get("new_rel")
-                nabs  = a.get("new_abs")
-
-                if act == "add" and nrel:
-                    if isinstance(self.image_paths, list) and nrel not in self.image_paths:
-                        self.image_paths.append(nrel)
-                    # New file, keep hashing empty
-                    self.stage = "hashing"
+        # Load db
+        self._db_load_filelist(root)
+        self._db_load_progress(root)
+        self.constraints = ConstraintsStore(scan_folder=root, index=self._db_index(root))
+        tiles = self._db_load_tiles(root)
+
+        # Path at the start of the batch -> path at its end, None if deleted. The file list, groups and
+        # constraints are updated once for the whole batch.
+        renames = {}
+        origin = {}
+        added = []
+
+        def _rename(orel, nrel):
+            first = origin.pop(orel, orel)
+            renames[first] = nrel
+            if nrel:
+                origin[nrel] = first
+
+        for a in batch_ops:
+            act   = a.get("act")
+            orel  = a.get("old_rel")
+            nrel  = a.get("new_rel")
+            nabs  = a.get("new_abs")
+
+            if act == "add" and nrel:
+                added.append(nrel)
+                # New file, keep hashing empty. A compared root keeps its groups and only compares new files.
+                if self.stage == "done" or self.compare_incremental:
+                    self.compare_incremental = True
+                else:
                     self.compare_index = 0
                     self.groups = []
-                    self.visited = set()
-
-                elif act == "delete" and orel:
-                    if orel in self.image_paths:
-                        self.image_paths.remove(orel)
-                    if orel in self.phashes:
-                        del self.phashes[orel]
-                        self.compare_index -= 1
-                    # groups / constraints
-                    self._group_replace_path(orel, None)
-                    try:
-                        self.constraints.remove_paths([orel])
-                    except Exception:
-                        pass
+                self.stage = "hashing"
 
-                elif act == "replace" and orel and nrel:
-                    # filelist
-                    self.image_paths = [nrel if p == orel else p for p in self.image_paths]
-                    # progress use same mtime/hash when move or rename files
-                    try:
-                        st = os.stat(nabs) if nabs else None
-                    except Exception:
-                        st = None
-                    if orel in self.phashes:
-                        h = self.phashes.pop(orel)
-                        if isinstance(h, dict):
-                            if st:
-                                h["mtime"] = st.st_mtime
-                                h["size"]  = st.st_size
-                            self.phashes[nrel] = h
-                        else:
-                            self.phashes[nrel] = {
-                                "hash": h,
-                                "mtime": (st.st_mtime if st else self.phashes.get(orel, {}).get("mtime", 0)),
-                                "size":  (st.st_size  if st else self.phashes.get(orel, {}).get("size",  0)),
-                            }
-                    # groups / constraints
-                    self._group_replace_path(orel, nrel)
-                    self._browser_constraints_rename(orel, nrel)
-
-            # Update counter
-            self.previous_file_counter = len(self.image_paths)
-            self.view_groups_update = True
-            if self.stage == "done":
-                self.duplicate_size = self._wokr_folder_count_duplicate_size(self.groups)
+            elif act == "delete" and orel:
+                _rename(orel, None)
+                if orel in self.phashes:
+                    del self.phashes[orel]
+                    self.compare_index -= 1
 
-            # Save db
-            self._db_save_filelist(root)
-            self._db_save_progress(root)
-            try:
-                self.constraints.save_constraints()
-            except Exception:
-                pass
-        finally:
-            self._db_unlock(root)
+            elif act == "replace" and orel and nrel:
+                _rename(orel, nrel)
+                # progress use same mtime/hash when move or rename files
+                try:
+                    st = os.stat(nabs) if nabs else None
+                except Exception:
+                    st = None
+                if orel in self.phashes:
+                    h = self.phashes.pop(orel)
+                    if isinstance(h, dict):
+                        # A copy, saved data keeps the entry it has
+                        h = dict(h)
+                        if st:
+                            h["mtime"] = st.st_mtime
+                            h["size"]  = st.st_size
+                        self.phashes[nrel] = h
+                    else:
+                        self.phashes[nrel] = {
+                            "hash": h,
+                            "mtime": (st.st_mtime if st else self.phashes.get(orel, {}).get("mtime", 0)),
+                            "size":  (st.st_size  if st else self.phashes.get(orel, {}).get("size",  0)),
+                        }
+                if tiles is not None:
+                    tiles.rename(orel, nrel)
+
+        # filelist / groups / constraints
+        if renames or added:
+            paths = [q for q in (renames.get(p, p) for p in self.image_paths) if q]
+            known = set(paths)
+            for p in added:
+                p = renames.get(p, p)
+                if p and p not in known:
+                    paths.append(p)
+                    known.add(p)
+            self.image_paths = paths
+        self._group_replace_paths(renames)
+        self._browser_constraints_rename(renames)
+
+        # Update counter
+        self.previous_file_counter = len(self.image_paths)
+        self.view_groups_update = True
+        if self.stage == "done":
+            self.duplicate_size = self._wokr_folder_count_duplicate_size(self.groups)
+
+        # Save db
+        self._db_save_filelist(root)
+        self._db_save_progress(root)
+        if tiles is not None:
+            tiles.prune(self.phashes)
+            if tiles.dirty:
+                self._db_save_tiles(root, tiles)
+        try:
+            self.constraints.save_constraints()
+        except Exception:
+            pass
 
     # Sync db in each root
     def _browser_sync_batch(self, ops: list[tuple[str|None, str|None, str]]):
+        # A stage job works on the db data of its root, the files are updated once it is done (_job_done)
+        if self.stage_job is not None:
+            self.sync_deferred.extend(ops)
+            return
+
         # backup current folder
         if self.work_folder:
             cur_folder = self.work_folder 
@@ -2420,20 +3156,32 @@ class MatchImageFinder(QMainWindow):
                 "new_abs": nabs,
             })
 
-        # For each root update db
-        for root, batch_ops in grouped.items():
-            try:
-                self.status.setText(self.i18n.t("status.updating_db",db = root))
-                self._db_update(root, batch_ops)
-            except Exception as e:
-                print(f"[Warn] batch exec failed on {root}: {e}")
-        
-        # Restore self data
+        # For each root update db. Saves only go to the root cache, each root is written once at the end
+        # and stays locked until then.
+        locked = []
+        try:
+            with self.root_cache.defer():
+                for root, batch_ops in grouped.items():
+                    if not self._db_lock_check_and_create(root):
+                        continue
+                    locked.append(root)
+                    try:
+                        self.status.setText(self.i18n.t("status.updating_db",db = root))
+                        self._db_update(root, batch_ops)
+                    except Exception as e:
+                        print(f"[Warn] batch exec failed on {root}: {e}")
+        finally:
+            for root in locked:
+                self._db_flush(root)
+            for root in locked:
+                self._db_unlock(root)
+
+        # Restore self data, from the root cache
         self._work_folder_clear_variable()
         self._db_load_filelist(cur_folder)
         self._db_load_progress(cur_folder)
         self._db_load_exceptions(cur_folder)
-        self.constraints = ConstraintsStore(scan_folder = cur_folder)
+        self.constraints = ConstraintsStore(scan_folder = cur_folder, index=self._db_index(cur_folder))
 
     # Mark selected images same
     def _btn_action_mark_images_same(self):
@@ -2683,6 +3431,8 @@ class MatchImageFinder(QMainWindow):
     # Unlock db
     def _db_unlock(self, root):
         if self._db_is_lock_by_self(root):
+            # Another instance may take the root once the lock is gone
+            self.json_writer.flush()
             try:
                 if hasattr(self, "lock_file") and os.path.exists(self.lock_file):
                     os.remove(self.lock_file)
@@ -2770,23 +3520,50 @@ class MatchImageFinder(QMainWindow):
 
     # Clear work folder variable
     def _work_folder_clear_variable(self):
+        if self.hash_journal is not None:
+            # The log stays for the next load to replay
+            self._alg_hashing_checkpoint_wait()
+            try:
+                self.hash_journal.close()
+            except OSError as e:
+                print(f"[Error] Hashing journal: {e}")
         self.stage = None
         self.work_folder = None
-        self.phashes = {}
+        self.phashes = HashEntries()
         self.groups = []
         self.image_paths = []
         self.overview_page = 0
         self.progress_file = None
         self.exceptions_file = None
         self.compare_index = 0
-        self.visited = set()
+        self.compare_incremental = False
+        self.image_stats = {}
+        self.hash_quarantine = []
+        self.hash_verify_stats = None
+        self.compare_clusters_cache = None
+        self.compare_graph = None
+        self.compare_similarity = None
+        self.tile_store = None
+        self.hash_table = None
+        self.hash_table_source = None
+        self.hash_journal = None
+        self.hash_checkpoint = None
+        self.progress_journal = None
+        self.exact_groups = []
+        self.exact_alias = {}
+        self.exact_digests = {}
+        self.exact_partials = {}
         self.constraints = None
         self.view_groups_update = False
         self.exception_folder = None
 
-    def _btn_action_scan(self):        
+    def _btn_action_scan(self):
         QApplication.processEvents()
 
+        # A cancelled stage job still has to return and release its root
+        if self.stage_job is not None:
+            return
+
         #self._work_folder_clear_variable()
         
         # Update root
@@ -2799,7 +3576,7 @@ class MatchImageFinder(QMainWindow):
         
         # reset states
         self.action = "collecting"
-        self.constraints = ConstraintsStore(scan_folder=self.work_folder)
+        self.constraints = ConstraintsStore(scan_folder=self.work_folder, index=self._db_index(self.work_folder))
         self.view_groups_update = True
         self.current = self.last_group_index
 
@@ -2823,9 +3600,11 @@ class MatchImageFinder(QMainWindow):
                 )
                 # Settings of "compare file size" or "similarity tolerance" is different.
                 # Force to collecting stage
-                if self.progress_compare_file_size!=self.compare_file_size or self.progress_similarity_tolerance!=self.similarity_tolerance:
+                if self.progress_compare_file_size!=self.compare_file_size or self.progress_similarity_tolerance!=self.similarity_tolerance \
+                        or self.progress_compare_cascade!=self._alg_comparing_cascade():
                     self.stage = "collecting"
                     self.compare_index = 0
+                    self.compare_incremental = False
                     self.groups = []
                     self.duplicate_size = 0
                     self.current = 0
@@ -2845,42 +3624,40 @@ class MatchImageFinder(QMainWindow):
         self._btn_controller()
         self._chkbox_controller()
 
-        new_image_paths = []
         self.progress.setVisible(True)
         self.progress.setMaximum(0)
         exclude_dirs = {d.strip().lower() for d in self.exclude_input.text().split(",") if d.strip()}
-        for root, dirs, files in os.walk(self.work_folder):
-            dirs[:] = [d for d in dirs if not any(ex in d.lower() for ex in exclude_dirs)]
-            for f in files:
-                if self._system_pertimes_processevent(0.1):
-                    QApplication.processEvents()
-                if self.paused:
-                    self._db_unlock(self.work_folder)
-                    self.progress.setVisible(False)
-                    self.work_folder = None
-                    self.paused = False
-                    self._browser_show(self.browser_folder)
-                    return
-                abs_path = os.path.join(root,f)
-                rel_path = os.path.relpath(abs_path, self.work_folder).replace("\\","/").lower()
-                if os.path.splitext(f.lower())[1] in EXTS:
-                    if(os.path.getsize(abs_path)>50000):
-                        new_image_paths.append(rel_path)
-                        self.status.setText(self.i18n.t("status.found_new_images",new_image=len(new_image_paths),root=self.work_folder))
-                    if self.exit == True:
-                        return
+        work_folder = self.work_folder
+        # The hash entries are checked against the files found on the job thread as well
+        job = ScanJob(work_folder, exclude_dirs,
+                      lambda found, _: self.i18n.t("status.found_new_images", new_image=found, root=work_folder),
+                      self._alg_comparing_table() if self.phashes else None)
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: self._btn_action_scan_done(job, original_stage))
+
+    # Compare the scan result with the hashes of the progress file, then go on with the next stage
+    def _btn_action_scan_done(self, job, original_stage):
+        work_folder = self.work_folder
+        if self.paused or job.result is None:
+            self._db_unlock(work_folder)
+            self.progress.setVisible(False)
+            self.work_folder = None
+            self.paused = False
+            self._browser_show(self.browser_folder)
+            return
+        new_image_paths, new_image_stats, gone, changed = job.result
+        self.status.setText(self.i18n.t("status.found_new_images",new_image=len(new_image_paths),root=work_folder))
 
         self.progress.setVisible(False)
         
         # Open progress file and compare with result of scan folder
         self.image_paths = new_image_paths
+        self.image_stats = new_image_stats
 
-        image_paths_set = set(self.image_paths)
         if len(self.phashes)>0:
             # Remove entries from hashes, if files are not exist in file list
-            removed = [path for path in self.phashes if path not in image_paths_set]
-            for path in removed:
-                del self.phashes[path]
+            for path in gone:
+                self.phashes.pop(path, None)
 
             # Remove entries from groups, if files are not exist in file list
             self.duplicate_size = 0
@@ -2918,55 +3695,28 @@ class MatchImageFinder(QMainWindow):
                     elif isinstance(h,dict):
                         new_hashes[path] = h
 
-                self.phashes = new_hashes
+                self.phashes = HashEntries(new_hashes)
                 self.hash_format = "v2"                    
             elif self.hash_format=="v2":
-                # If PROGRESS file is v2, compare entry of date is last and size is same in hashes
-                if len(self.phashes)>0:
-                    self.progress.setVisible(True)
-                    self.progress.setMaximum(len(self.phashes))
-                    self.progress.setValue(completed)
-                else:
-                    self.progress.setMaximum(100)
-                    self.progress.setValue(100)
-                
-                for path in list(self.phashes.keys()):
-                    if self._system_pertimes_processevent(0.3):
-                        QApplication.processEvents()
-                    if self.paused:
-                        self._db_unlock(self.work_folder)
-                        self.progress.setVisible(False)
-                        self.work_folder = None
-                        self.paused = False
-                        self._browser_show(self.browser_folder)
-                        return
-                    completed += 1
-                    self.progress.setValue(completed)
-                    self.status.setText(self.i18n.t("status.checked",completed=completed,total=len(self.phashes),path=path))
-                    if self.exit == True:
-                        return
-                    h = self.phashes[path]
-                    if not isinstance(h,dict) or "hash" not in h:
-                        continue
-                    try:
-                        abs_path = self._path_get_abs_path(path)
-                        current_mtime = os.path.getmtime(abs_path)
-                        current_size = os.path.getsize(abs_path)
-                        if h.get("mtime") != current_mtime or \
-                            h.get("size") != current_size:
-                            del self.phashes[path]
-                    except:
-                        print(f"[Error] {__file__} except error del hashes {path}")
-                        del self.phashes[path]
+                # If PROGRESS file is v2, entries whose file changed since it was hashed (checked by the ScanJob) are hashed again
+                completed = len(self.phashes)
+                for path in changed:
+                    self.phashes.pop(path, None)
             
             # There are some entries in Hashes are removed or out of date, these entry should re-hashing
-            if self.previous_file_counter!=len(self.phashes) or self.previous_file_counter!=len(self.image_paths) or self.progress_compare_file_size!=self.compare_file_size or \
-                self.progress_similarity_tolerance!=self.similarity_tolerance:
+            settings_changed = self.progress_compare_file_size!=self.compare_file_size or self.progress_similarity_tolerance!=self.similarity_tolerance \
+                or self.progress_compare_cascade!=self._alg_comparing_cascade()
+            if self.previous_file_counter!=len(self.phashes) or self.previous_file_counter!=len(self.image_paths) or settings_changed:
                 self.status.setText(self.i18n.t("status.checked_to_hash", completed=completed))
-                self.compare_index = 0
-                self.groups = []
-                self.duplicate_size = 0
-                self.current = 0
+                if not settings_changed and (original_stage == "done" or self.compare_incremental):
+                    # Groups stay, only added or changed files are compared
+                    self.compare_incremental = True
+                else:
+                    self.compare_index = 0
+                    self.compare_incremental = False
+                    self.groups = []
+                    self.duplicate_size = 0
+                    self.current = 0
             else:
                 self.stage = original_stage
                 self.status.setText(self.i18n.t("status.checked_uptodate",completed=completed))
@@ -2993,80 +3743,518 @@ class MatchImageFinder(QMainWindow):
         self.scroll.verticalScrollBar().setValue(self.scroll.verticalScrollBar().maximum())
         QApplication.processEvents()        
 
+        self._alg_hashing_quarantine_known()
+
+        # Byte-identical files are found first, only one file of each exact group is decoded
+        buckets = self._alg_size_buckets()
+        self._alg_exact_duplicates(buckets, lambda: self._alg_hashing_lookup(buckets))
+
+    # Files to hash once the exact groups are known. Files hashed before under any root are taken from
+    # the global cache, only a stat per file.
+    def _alg_hashing_lookup(self, buckets):
+        self._alg_hashing_defer_unique_sizes(buckets)
+        aliases = {a for members in self.exact_alias.values() for a in members}
+        todo = [p for p in self.image_paths if self._alg_hashing_needed(p) and p not in aliases]
+        self._alg_hashing_journal_open()
+        self._alg_hashing_from_cache(todo, self._alg_hashing_files)
+
+    # Decode and hash the files of todo
+    def _alg_hashing_files(self, todo):
         n = len(self.image_paths)
-        remaining_hash_index = len(self.phashes)
+        self.hash_cache = self._alg_hashing_cache_open()
+        remaining_hash_index = n - len(todo)
         if n:
             self.progress.setMaximum(n)
             self.progress.setValue(remaining_hash_index)
             self.progress.setVisible(True)
         
-        BATCH = 10
         start_time = time.time()
+        # Hashing stage, using multi process in a background job. Finished files are stored as their
+        # batches arrive, so handlers run meanwhile (pause, exit) see every finished hash.
+        completed = 0
+        self.hash_verify_stats = {"checked": 0, "differ": 0, "max_distance": 0}
+        tile_batch = []
+        work_folder = self.work_folder
+
+        def _on_hashed(batch):
+            nonlocal completed, remaining_hash_index
+            for p, res in batch:
+                tile_batch.append((os.path.relpath(p, work_folder).replace("\\","/").lower(), p, res))
+            rel_path = tile_batch[-1][0]
+            remaining_hash_index += len(batch)
+            completed += len(batch)
+            self._alg_hashing_store_batch(tile_batch)
+            self._alg_hashing_journal_step()
+            self.progress.setValue(remaining_hash_index)
+            elapsed = time.time() - start_time
+            eta = max(0,(elapsed / completed) * (n - remaining_hash_index))
+            eta_str = time.strftime('%H:%M:%S', time.gmtime(eta))
+            self.status.setText(self.i18n.t("status.hashing_eta", eta = eta_str, remaining = remaining_hash_index, total=n, path=os.path.basename(batch[-1][0])))
+            if self._system_pertimes_processevent(0.5):
+                if self.display_img_dynamic_cb.isChecked():
+                    self._alg_hashing_show_current_image(f"{self.i18n.t('msg.hashing')}", rel_path)
+                else:
+                    self._host_set_head('show_browser')
+                    self._host_set_body_normal(QWidget())
+
+        job = HashJob([self._path_get_abs_path(p) for p in todo], self.hash_fast_decode, self.hash_verify_fast_decode,
+                      self.hash_max_workers, self.hash_inflight_per_worker, self.hash_algos)
+        job.hashed.connect(_on_hashed)
+        self._job_start(job, self._alg_hashing_done)
+
+    # Every batch of the job is stored by now
+    def _alg_hashing_done(self, job):
+        self._alg_hashing_cache_close()
+        if self.paused:
+            self._alg_hashing_pause()
+            return
 
-        # Hashing stage,using multi process
-        completed = 0;
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as exe:
-            for i in range(0, len(self.image_paths), BATCH):
-                if self.paused:
-                    self.status.setText(self.i18n.t("status.hashing_pause"))
-                    self._db_save_progress(self.work_folder, stage="hashing")
-                    self.constraints.save_constraints()
-                    self._db_unlock(self.work_folder)
-                    self._work_folder_clear_variable()
-                    self._browser_show(self.browser_folder)
-                    return
+        self._db_save_progress(self.work_folder, self.stage)
+        self._alg_hashing_journal_close()
+        self._db_save_quarantine(self.work_folder)
+        self._alg_comparing_api()
 
-                batch = [
-                    self._path_get_abs_path(p)
-                    for p in self.image_paths[i:i+BATCH]
-                    if p not in self.phashes
-                ]
-
-                futs = {exe.submit(_alg_hashing_api, p): p for p in batch}
-
-                for f in as_completed(futs):
-                    if self.paused:
-                        self.status.setText(self.i18n.t("status.hashing_pause"))
-                        self._db_save_progress(self.work_folder, stage="hashing")
-                        self.constraints.save_constraints()
-                        self._db_unlock(self.work_folder)
-                        self._work_folder_clear_variable()
-                        self._browser_show(self.browser_folder)
-                        return
-                    p = futs[f]
-                    rel_path = os.path.relpath(p, self.work_folder).replace("\\","/").lower()
-                    try:
-                        h = f.result()
-                        self.phashes[rel_path] = {
-                            "hash": h,
-                            "mtime": os.path.getmtime(p),
-                            "size": os.path.getsize(p)
-                        }
-                    except Exception as e:
-                        err_msg = str(e)
-                        self.phashes[rel_path] = {"error": err_msg}
-                        print(f"[Error] Hash: {p} - {err_msg}")
-                    if self._system_pertimes_processevent(0.5):
-                        if self.display_img_dynamic_cb.isChecked():
-                            self._alg_hashing_show_current_image(f"{self.i18n.t('msg.hashing')}",rel_path)
-                        else:
-                            self._host_set_head('show_browser')
-                            self._host_set_body_normal(QWidget())
-                        QApplication.processEvents()
+    # Run the DCT for all collected tiles at once and store the hashes, batch is emptied.
+    # Tiles of the other hash algorithms are hashed per algorithm the same way.
+    def _alg_hashing_store_batch(self, batch):
+        if not batch:
+            return
+        tiles = [res["tile"] for _, _, res in batch if res["tile"] is not None]
+        if self.compare_rotation:
+            variants = phash_variants_from_tiles(phash_stack(tiles))
+            hashes = iter([int(v) for v in variants[:, 0]])
+            rotations = iter(variants[:, 1:].tolist())
+        else:
+            hashes = iter(phash_from_tiles(phash_stack(tiles)))
+        algo_tiles = {}
+        for _, _, res in batch:
+            if res["tile"] is not None:
+                for name, tile in res.get("tiles", {}).items():
+                    algo_tiles.setdefault(name, []).append(tile)
+        algo_hashes = {name: iter(hashes_from_tiles(name, t)) for name, t in algo_tiles.items()}
+        verify_tiles = [res["verify_tile"] for _, _, res in batch if res["tile"] is not None and res.get("verify_tile") is not None]
+        full_hashes = iter(phash_from_tiles(phash_stack(verify_tiles)))
+        cache_rows = []
+        for rel_path, p, res in batch:
+            if res["tile"] is None:
+                self._alg_hashing_record_failure(rel_path, res)
+                continue
+            h = next(hashes)
+            rotation = next(rotations) if self.compare_rotation else None
+            extra = {name: next(algo_hashes[name]) for name in res.get("tiles", {})}
+            if res.get("verify_tile") is not None:
+                dist = (h ^ next(full_hashes)).bit_count()
+                stats = self.hash_verify_stats
+                stats["checked"] += 1
+                if dist:
+                    stats["differ"] += 1
+                    stats["max_distance"] = max(stats["max_distance"], dist)
+            try:
+                st = res.get("stat") or self._path_stat(rel_path)
+                self.image_stats[rel_path] = st
+                entry = {
+                    "hash": h,
+                    "mtime": st.st_mtime,
+                    "size": st.st_size,
+                    "decode": res["decode"]
+                }
+                if extra:
+                    entry["hashes"] = extra
+                if rotation is not None:
+                    entry["variants"] = rotation
+                if self.compare_similarity_min:
+                    self._alg_similarity_tiles().put(rel_path, res["tile"])
+                entry.update(self._alg_exact_digest_fields(rel_path))
+                self.phashes[rel_path] = entry
+                cache_rows.append((HashCache.key(st), self.exact_digests.get(rel_path), h, res["decode"]))
+                for alias in self.exact_alias.get(rel_path, []):
+                    self._alg_exact_copy_hash(rel_path, alias)
+            except Exception as e:
+                print(f"[Error] Hash: {p} - {e}")
+                self._alg_hashing_record_failure(rel_path, {"error": str(e), "transient": True})
+        batch.clear()
+        if self.hash_cache and cache_rows:
+            try:
+                self.hash_cache.put_many(cache_rows)
+            except sqlite3.Error as e:
+                print(f"[Warning] Hash cache: {e}")
 
-                    remaining_hash_index += 1
-                    completed = completed + 1;
-                    self.progress.setValue(remaining_hash_index)
-                    elapsed = time.time() - start_time
-                    eta = max(0,(elapsed / completed) * (n - remaining_hash_index))
-                    eta_str = time.strftime('%H:%M:%S', time.gmtime(eta))
-                    self.status.setText(self.i18n.t("status.hashing_eta", eta = eta_str, remaining = remaining_hash_index, total=n, path=os.path.basename(p)))
+    # Hashes set from now on are logged to the journal of the work folder (HashJournal)
+    def _alg_hashing_journal_open(self):
+        if self.hash_journal is not None:
+            return
+        if not isinstance(self.phashes, HashEntries):
+            self.phashes = HashEntries(self.phashes)
+        journal = HashJournal(self.work_folder, self.journal_fsync_interval)
+        try:
+            journal.open(self.progress_journal or 0)
+        except OSError as e:
+            print(f"[Warning] Hashing journal disabled: {e}")
+            return
+        self.hash_journal = journal
+        self.phashes.journal = journal
+        # Without progress data the log can't be replayed, a checkpoint writes the first
+        if self.progress_journal is None:
+            self._alg_hashing_checkpoint()
+
+    # Log the hashes of the last batch, start a checkpoint when the journal is over its time or size budget.
+    # sync puts the log on disk now instead of within journal_fsync_seconds.
+    def _alg_hashing_journal_step(self, checkpoint=True, sync=False):
+        journal = self.hash_journal
+        if journal is None:
+            return
+        try:
+            journal.write(self.phashes, sync=sync)
+        except OSError as e:
+            print(f"[Error] Hashing journal: {e}")
+            return
+        if self.hash_checkpoint is not None and self.hash_checkpoint.done():
+            self._alg_hashing_checkpoint_wait()
+        if checkpoint and self.hash_checkpoint is None and (
+                journal.size >= self.journal_checkpoint_bytes
+                or time.monotonic() - journal.last_checkpoint >= self.journal_checkpoint_seconds):
+            self._alg_hashing_checkpoint()
+
+    # Next journal generation for progress data of the work folder about to be saved, None if there is no journal
+    def _alg_hashing_journal_rotate(self, path):
+        journal = self.hash_journal
+        if journal is None or path != self.work_folder:
+            return None
+        self._alg_hashing_checkpoint_wait()
+        try:
+            self.progress_journal = journal.rotate()
+        except OSError as e:
+            print(f"[Error] Hashing journal: {e}")
+            return None
+        return journal
 
-        QApplication.processEvents()
-        self._db_save_progress(self.work_folder, self.stage)
-        self._alg_comparing_api()
+    # Fold the journal into the progress data. The JSON file is written by the JSON writer while hashing
+    # goes on, the SQLite index only writes the changed rows and is saved right away.
+    def _alg_hashing_checkpoint(self):
+        self._db_save_progress(self.work_folder, stage=self.stage)
+
+    # Wait for the progress data of a checkpoint, the log it folded is dropped once it is written
+    def _alg_hashing_checkpoint_wait(self):
+        future = self.hash_checkpoint
+        if future is None:
+            return
+        self.hash_checkpoint = None
+        if future.result() and self.hash_journal is not None:
+            try:
+                self.hash_journal.drop_prev()
+            except OSError as e:
+                print(f"[Error] Hashing journal: {e}")
+
+    # Stop logging, called after the progress data was saved. The log stays if the save failed.
+    def _alg_hashing_journal_close(self):
+        journal = self.hash_journal
+        if journal is None:
+            return
+        self._alg_hashing_checkpoint_wait()
+        if isinstance(self.phashes, HashEntries):
+            self.phashes.journal = None
+        try:
+            journal.close(remove=not os.path.exists(journal.prev_path))
+        except OSError as e:
+            print(f"[Error] Hashing journal: {e}")
+        self.hash_journal = None
+
+    # Undecodable file gets a failure record instead of a hash and is skipped until its size or mtime change.
+    # Transient errors are only reported, the file is tried again next run.
+    def _alg_hashing_record_failure(self, rel_path, res):
+        transient = res.get("transient", False)
+        self.hash_quarantine.append({
+            "path": rel_path,
+            "reason": "transient" if transient else "failed",
+            "error": res.get("error", "")
+        })
+        # Exact copies of the file fail the same way
+        self.exact_groups = [g for g in self.exact_groups if rel_path not in g]
+        st = res.get("stat")
+        if transient or st is None:
+            return
+        self.image_stats[rel_path] = st
+        self.phashes[rel_path] = {
+            "hash": None,
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "failed": res.get("error", ""),
+            "attempts": res.get("attempts", 1)
+        }
+        for alias in self.exact_alias.get(rel_path, []):
+            self._alg_exact_copy_hash(rel_path, alias)
+            self.hash_quarantine.append({"path": alias, "reason": "failed", "error": res.get("error", "")})
+
+    # Start the quarantine report of this run with files which failed before.
+    # Error entries of older versions and failed decodes stored as hash 0 are hashed again.
+    def _alg_hashing_quarantine_known(self):
+        self.hash_quarantine = []
+        # Failures are rows without a hash or with a failed decode
+        table = self._alg_comparing_table()
+        rows = (table.status != STATUS_HASHED) | (table.decode == DECODE_PATHS.index("error"))
+        for rel in [table.paths[k] for k in np.flatnonzero(rows).tolist()]:
+            entry = self.phashes[rel]
+            if "error" in entry or entry.get("decode") == "error":
+                del self.phashes[rel]
+            elif entry.get("failed"):
+                self.hash_quarantine.append({"path": rel, "reason": "known", "error": entry["failed"]})
+
+    # (algo, path, max entries) of the global hash cache, None when disabled.
+    # The cache holds pHash only, with other hash algorithms, the tile check or rotation variants configured
+    # every file is decoded.
+    def _alg_hashing_cache_args(self):
+        if not self.hash_cache_enabled or self.hash_algos or self.compare_similarity_min or self.compare_rotation:
+            return None
+        algo = HASH_CACHE_ALGO + ("-fast" if self.hash_fast_decode else "")
+        return algo, os.path.join(os.path.dirname(self.cfg.path), HASH_CACHE_FILE), self.hash_cache_max_entries
+
+    # Open the global hash cache on the GUI thread to store new hashes, None when disabled or not usable
+    def _alg_hashing_cache_open(self):
+        args = self._alg_hashing_cache_args()
+        if args is None:
+            return None
+        algo, path, max_entries = args
+        try:
+            return HashCache(algo, path, max_entries=max_entries)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[Warning] Hash cache disabled: {e}")
+            return None
+
+    def _alg_hashing_cache_close(self):
+        if self.hash_cache is None:
+            return
+        try:
+            self.hash_cache.close()
+        except sqlite3.Error as e:
+            print(f"[Warning] Hash cache: {e}")
+        self.hash_cache = None
+
+    # Take hashes of unchanged files from the global cache in a CacheLookupJob, then(todo) goes on with
+    # the files still to hash. Hashing is paused instead when the job was cancelled.
+    def _alg_hashing_from_cache(self, todo, then):
+        args = self._alg_hashing_cache_args()
+        if args is None or not todo:
+            then(todo)
+            return
+        files = [(rel, self._path_get_abs_path(rel), self.image_stats.get(rel), self.exact_digests.get(rel)) for rel in todo]
+        job = CacheLookupJob(*args, files, lambda checked, total, hits, path: self.i18n.t(
+            "status.hash_cache_checking", completed=checked, total=total, hits=hits, path=os.path.basename(path)))
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: self._alg_hashing_from_cache_done(job, then))
+
+    def _alg_hashing_from_cache_done(self, job, then):
+        if self.paused or job.result is None:
+            self._alg_hashing_pause()
+            return
+        found, remaining = job.result
+        for rel, st, cached in found:
+            self.image_stats[rel] = st
+            self.phashes[rel] = dict({"hash": cached[0], "mtime": st.st_mtime, "size": st.st_size, "decode": cached[1]},
+                                     **self._alg_exact_digest_fields(rel))
+            for alias in self.exact_alias.get(rel, []):
+                self._alg_exact_copy_hash(rel, alias)
+        if found:
+            print(f"[Info] Hash cache: reused {len(found)}/{len(job.files)} hashes")
+        then(remaining)
+
+    # Group image paths by file size, sizes come from the scan or the progress file.
+    # Files known to be undecodable are left out.
+    def _alg_size_buckets(self):
+        buckets = {}
+        for rel in self.image_paths:
+            entry = self.phashes.get(rel)
+            if isinstance(entry, dict) and entry.get("failed"):
+                continue
+            st = self.image_stats.get(rel)
+            size = st.st_size if st else None
+            if size is None and isinstance(entry, dict):
+                size = entry.get("size")
+            if size is None:
+                try:
+                    size = self._path_stat(rel).st_size
+                except OSError:
+                    continue
+            buckets.setdefault(size, []).append(rel)
+        return buckets
+
+    # With compare_file_size a file of unique size can never join a group. Its hash is deferred:
+    # the entry keeps mtime/size with hash None, and is hashed once the setting is turned off.
+    def _alg_hashing_defer_unique_sizes(self, buckets):
+        deferred = set()
+        if self.compare_file_size:
+            deferred = {rels[0] for rels in buckets.values() if len(rels) == 1}
+        table = self._alg_comparing_table()
+        for rel in [table.paths[k] for k in np.flatnonzero(table.status == STATUS_DEFERRED).tolist()]:
+            if rel not in deferred:
+                del self.phashes[rel]
+        for rel in deferred:
+            if rel in self.phashes:
+                continue
+            try:
+                st = self._path_stat(rel)
+            except OSError as e:
+                print(f"[Error] Stat: {rel} - {e}")
+                continue
+            self.phashes[rel] = {"hash": None, "mtime": st.st_mtime, "size": st.st_size, "deferred": True}
+
+    # Find byte-identical files: bucket by size, then head/tail digest, then full streaming digest (ExactDigestJob).
+    # Only buckets with more than one entry are read, and only files sharing a partial digest are read in full.
+    # Digests are kept with the hashes, a rescan reads only files without them. then() goes on once the
+    # exact groups are known, hashing is paused instead when the job was cancelled.
+    def _alg_exact_duplicates(self, buckets, then):
+        candidates = []
+        for size, rels in buckets.items():
+            if len(rels) < 2:
+                continue
+            files = []
+            for rel in rels:
+                entry = self.phashes.get(rel)
+                entry = entry if isinstance(entry, dict) else {}
+                files.append((rel, self._path_get_abs_path(rel), entry.get("partial"), entry.get("digest")))
+            candidates.append((size, files))
+        job = ExactDigestJob(candidates, lambda checked, total, path: self.i18n.t(
+            "status.exact_checking", completed=checked, total=total, path=os.path.basename(path)))
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: self._alg_exact_duplicates_done(job, then))
+
+    def _alg_exact_duplicates_done(self, job, then):
+        if self.paused or job.result is None:
+            self._alg_hashing_pause()
+            return
+        exact_groups, digests, partials = job.result
+        self._alg_exact_keep_digests(digests, partials)
+
+        # One representative per group is hashed, prefer a file that already has a hash
+        self.exact_groups = exact_groups
+        self.exact_alias = {}
+        for grp in self.exact_groups:
+            hashed = [p for p in grp if self.phashes.get(p, {}).get("hash") is not None]
+            rep = hashed[0] if hashed else grp[0]
+            self.exact_alias[rep] = [p for p in grp if p != rep]
+            for alias in self.exact_alias[rep]:
+                if self._alg_hashing_needed(alias):
+                    self._alg_exact_copy_hash(rep, alias)
+        then()
+
+    # Digests of files not hashed yet go to their entry once they are, hashed files get them now.
+    # Entries are replaced rather than changed, the loaded ones may be kept by the root cache.
+    def _alg_exact_keep_digests(self, digests, partials):
+        for rel in set(digests) | set(partials):
+            entry = self.phashes.get(rel)
+            if not isinstance(entry, dict) or entry.get("hash") is None:
+                if rel in digests:
+                    self.exact_digests[rel] = digests[rel]
+                if rel in partials:
+                    self.exact_partials[rel] = partials[rel]
+            else:
+                fields = {}
+                if rel in digests:
+                    fields["digest"] = digests[rel]
+                if rel in partials:
+                    fields["partial"] = partials[rel]
+                if any(entry.get(k) != v for k, v in fields.items()):
+                    self.phashes[rel] = dict(entry, **fields)
+
+    # Digests the exact duplicate pass found for a file which had no entry, for its new entry
+    def _alg_exact_digest_fields(self, rel):
+        fields = {}
+        if rel in self.exact_digests:
+            fields["digest"] = self.exact_digests[rel]
+        if rel in self.exact_partials:
+            fields["partial"] = self.exact_partials[rel]
+        return fields
+
+    # True if a group holds byte-identical files only, found by the exact duplicate pass
+    def _group_is_exact(self, grp):
+        members = set(grp)
+        return len(members) > 1 and any(members.issubset(g) for g in self.exact_groups)
+
+    # Byte-identical file shares the hash of its group representative
+    def _alg_exact_copy_hash(self, rep, alias):
+        src = self.phashes.get(rep)
+        if not isinstance(src, dict) or (src.get("hash") is None and not src.get("failed")):
+            return
+        try:
+            st = self._path_stat(alias)
+        except OSError as e:
+            print(f"[Error] Hash: {alias} - {e}")
+            return
+        entry = {
+            "hash": src["hash"],
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "decode": "exact",
+            "digest": src.get("digest", self.exact_digests.get(rep))
+        }
+        partial = src.get("partial", self.exact_partials.get(rep))
+        if partial:
+            entry["partial"] = partial
+        if src.get("hashes"):
+            entry["hashes"] = dict(src["hashes"])
+        if src.get("variants"):
+            entry["variants"] = list(src["variants"])
+        if self.compare_similarity_min:
+            self._alg_similarity_tiles().copy(rep, alias)
+        if src.get("failed"):
+            entry["failed"] = src["failed"]
+            entry["attempts"] = src.get("attempts", 1)
+        self.phashes[alias] = entry
+
+    # True if the file has to be decoded: no entry yet, or a hash of a configured algorithm, the rotation
+    # variants or the tile of the similarity check are missing. Entries without hash (deferred, failed) are
+    # handled by their own rules.
+    def _alg_hashing_needed(self, rel):
+        entry = self.phashes.get(rel)
+        if entry is None:
+            return True
+        if not isinstance(entry, dict) or entry.get("hash") is None:
+            return False
+        if self.compare_rotation and "variants" not in entry:
+            return True
+        if self.compare_similarity_min and rel not in self._alg_similarity_tiles():
+            return True
+        stored = entry.get("hashes", {})
+        return any(name not in stored for name in self.hash_algos)
+
+    # Tiles of the work folder kept for the similarity check, loaded on first use.
+    # A tile whose pHash isn't the stored hash any more belongs to an older version of the file and is dropped.
+    def _alg_similarity_tiles(self):
+        if self.tile_store is None:
+            store = self._db_load_tiles(self.work_folder) or TileStore()
+            paths = [p for p in store.tiles if isinstance(self.phashes.get(p), dict) and self.phashes[p].get("hash") is not None]
+            stack, _ = store.stack(paths)
+            store.prune({p for p, h in zip(paths, phash_from_tiles(stack)) if h == self.phashes[p]["hash"]})
+            self.tile_store = store
+        return self.tile_store
+
+    # Stat of an image file, taken from the folder walk when available
+    def _path_stat(self, rel):
+        st = self.image_stats.get(rel)
+        if st is None:
+            st = self.image_stats[rel] = _path_file_stat(os.stat(self._path_get_abs_path(rel)))
+        return st
+
+    # Save hashing progress and return to browser when paused
+    def _alg_hashing_pause(self):
+        self._alg_hashing_cache_close()
+        self.status.setText(self.i18n.t("status.hashing_pause"))
+        self._db_save_progress(self.work_folder, stage="hashing")
+        self._alg_hashing_journal_close()
+        self._db_save_quarantine(self.work_folder)
+        self.constraints.save_constraints()
+        self._db_unlock(self.work_folder)
+        self._work_folder_clear_variable()
+        self._browser_show(self.browser_folder)
 
     def _alg_comparing_api(self):
+        # Deferred hashes are needed as soon as files of different size may match
+        if not self.compare_file_size and (self._alg_comparing_table().status == STATUS_DEFERRED).any():
+            self.compare_index = 0
+            self.compare_incremental = False
+            self.groups = []
+            self.duplicate_size = 0
+            self._alg_hashing()
+            return
         self.action = "comparing"
         self.stage = "comparing"
         self.paused = False
@@ -3077,118 +4265,433 @@ class MatchImageFinder(QMainWindow):
         self._alg_comparing_pairwise()
     
     def _alg_comparing_pairwise(self):
-        items = [
-            (p, h["hash"])
-            for p, h in self.phashes.items()
-            if isinstance(h, dict) and "hash" in h and "error" not in h
-        ]
-        items.sort(key=lambda x:x[1])
+        items = self._alg_comparing_items()
         
         self.status.setText(self.i18n.t("status.comparing"))
 
         new_grps = self.groups[:] if self.groups else []
-        total = len(items)
-        start_compare = time.time()
+        # Exact groups come with the clusters of their first file, those of files without hash are emitted as they are
+        if self.compare_index == 0 and not new_grps:
+            for members in self._alg_comparing_exact_unhashed(items.paths):
+                new_grps.append(members)
+                self.duplicate_size += sum(self.phashes[p].get("size", 0) for p in members[1:]) / (1024 * 1024)
+            self.groups = new_grps[:]
+        total = len(items.paths)
         if total:
             self.progress.setVisible(True)
             self.progress.setMaximum(total)
             self.progress.setValue(self.compare_index)
 
-        MAX_LOOKAHEAD = _math_clamp(8*(self.similarity_tolerance+1) ** 2, 64, 384)
-        completed = 0
-        
         t_report = int(self.similarity_tolerance)     # UI threshold
-        delta    = min(3, t_report // 2)              # t/2，max 3
-        t_link   = t_report + delta                   # edge
-        
-        for i, (p1, h1) in enumerate(items[self.compare_index:], start=self.compare_index):
-            completed += 1            
-            self.compare_index = i
-            self.progress.setValue(self.compare_index)
-            if p1 in self.visited:
-                continue
-            elapsed = time.time() - start_compare
-            eta = (elapsed / (completed)) * (total - (i+1))
-            eta_str = time.strftime('%H:%M:%S', time.gmtime(eta))
-            self.status.setText(self.i18n.t("status.compare_eta", eta=eta_str, cur = i+1, total = total, remaining = self.compare_index, groups = len(new_grps), cur_file = os.path.basename(p1)))
-            if self.paused:
-                self.status.setText(self.i18n.t("status.comparison_pause"))
-                self.groups = new_grps
-                self._db_save_progress(self.work_folder, stage="comparing", extra={"compare_index": self.compare_index})
-                self._db_unlock(self.work_folder)
-                self._work_folder_clear_variable()
-                self._browser_show(self.browser_folder)
+        t_link   = _alg_link_distance(t_report, self.compare_cap_group_diameter)   # edge
+
+        if self.compare_incremental:
+            if self._alg_comparing_incremental(items, t_link):
                 return
+            # No stored pair graph to build on, compare everything
+            self.compare_incremental = False
+            self.compare_index = 0
+            self.duplicate_size = 0
+            self.groups = []
+            self._alg_comparing_pairwise()
+            return
 
-            new_grp = [p1]
-            # Fixed issue: An image was added into multiple groups
-            # Root cause: `visited` was defined as a local variable; after function return it was cleared,
-            #             causing the same images to be re-compared and re-added into groups.
-            # Solution: Use a persistent `self.visited` set at instance level and serialize it
-            #           into the progress file so that state is preserved across resumes.
-            self.visited.add(p1)
-
-            size1 = self.phashes[p1]["size"]
-
-            for j in range(i+1, min(i + 1 + MAX_LOOKAHEAD, len(items))):
-                p2, h2 = items[j]
-                if self.paused:
-                    self.status.setText(self.i18n.t("status.comparison_pause"))
-                    self.groups = new_grps
-                    self.visited.remove(p1)
-                    self._db_save_progress(self.work_folder, stage="comparing", extra={"compare_index": self.compare_index})
-                    self.constraints.save_constraints()
-                    self._db_unlock(self.work_folder)
-                    self._work_folder_clear_variable()
-                    self._browser_show(self.browser_folder)
-                    return
-                if self._system_pertimes_processevent(0.5):
-                    if self.display_img_dynamic_cb.isChecked():
-                        self._alg_comparing_show_pair_images(p1,p2)
-                    else:
-                        self._host_set_head('show_browser')
-                        self._host_set_body_normal(QWidget())
-                    QApplication.processEvents()
-                if p2 not in self.visited and (h1 ^ h2).bit_count() <= t_link:
-                    if size1 != self.phashes[p2]["size"] and self.compare_file_size:
-                        continue
-                    
-                    new_grp.append(p2)
-                    self.duplicate_size += self.phashes[p2]["size"]/(1024*1024)
-                    # Fixed issue: An image was added into multiple groups
-                    # Root cause: `visited` was defined as a local variable; after function return it was cleared,
-                    #             causing the same images to be re-compared and re-added into groups.
-                    # Solution: Use a persistent `self.visited` set at instance level and serialize it
-                    #           into the progress file so that state is preserved across resumes.
-                    self.visited.add(p2)
+        # Groups are clusters of the pair graph, keyed by their first member in sort order
+        self._alg_comparing_clusters(items, t_link, t_report, lambda clusters: self._alg_comparing_groups(items, clusters, new_grps))
 
-            if len(new_grp) > 1:
-                new_grps.append(new_grp)
-                self.current = len(new_grps) - 1
-                self.groups = new_grps
-                self.status.setText(self.i18n.t("status.comparing_found", group=len(new_grps)))
+    # Emit the groups of clusters from compare_index on in a GroupJob. Without auto next group the job
+    # stops at the first group and it is shown, comparing goes on after it when the user continues.
+    def _alg_comparing_groups(self, items, clusters, new_grps):
+        # Files already in a group (exact groups without hash, groups shown before a resume) are not grouped again
+        grouped = {p for g in new_grps for p in g}
+        total = len(items.paths)
+        start_index = self.compare_index
+        start_compare = time.time()
+        shown = []
+        groups_before = len(new_grps)
 
-                if self.compare_index < len(items):
-                    if self.auto_next_cb.isChecked():
-                        continue
-                    else:
-                        self._db_save_progress(self.work_folder, stage="comparing", extra={"compare_index": self.compare_index})
-                        self.view_groups_update = True
-                        self.paused = True
-                        self._group_show_api()
-                        return
+        def _status_text(cur, total, path, groups):
+            elapsed = time.time() - start_compare
+            eta = (elapsed / max(1, cur - start_index)) * (total - cur)
+            eta_str = time.strftime('%H:%M:%S', time.gmtime(eta))
+            return self.i18n.t("status.compare_eta", eta=eta_str, cur=cur, total=total, remaining=cur,
+                               groups=groups_before + groups, cur_file=os.path.basename(path))
+
+        job = GroupJob(items.paths, clusters, grouped, start_index, not self.auto_next_cb.isChecked(), _status_text)
+
+        def _on_group(new_grp):
+            self.duplicate_size += sum(self.phashes[p].get("size", 0) for p in new_grp[1:]) / (1024 * 1024)
+            new_grps.append(new_grp)
+            self.current = len(new_grps) - 1
+            self.groups = new_grps
+            shown[:] = new_grp[:2]
+            self.status.setText(self.i18n.t("status.comparing_found", group=len(new_grps)))
+
+        def _on_progress(cur, total):
+            self.progress.setValue(cur)
+            if self.display_img_dynamic_cb.isChecked() and shown:
+                self._alg_comparing_show_pair_images(shown[0], shown[1])
+                shown.clear()
+            elif not self.display_img_dynamic_cb.isChecked():
+                self._host_set_head('show_browser')
+                self._host_set_body_normal(QWidget())
+
+        job.group_found.connect(_on_group)
+        job.progress.connect(_on_progress)
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: self._alg_comparing_groups_done(job, items, new_grps))
+
+    # Every group of the job is in new_grps by now
+    def _alg_comparing_groups_done(self, job, items, new_grps):
+        row, stopped = job.result if job.result else (self.compare_index, False)
+        self.compare_index = row
+        if stopped:
+            # Continue after this group
+            self._db_save_progress(self.work_folder, stage="comparing", extra={"compare_index": self.compare_index})
+            self.view_groups_update = True
+            self.paused = True
+            self._group_show_api()
+            return
+        if self.paused or job.result is None:
+            self.groups = new_grps
+            self._alg_comparing_pause()
+            return
 
         self._group_sort_then_copy(new_grps)
         self.compare_index = len(self.phashes)
-        self.progress.setValue(total)
-        QApplication.processEvents()
+        self.progress.setValue(len(items.paths))
         self.stage = "done"
-        self.visited = set()
         self._db_save_progress(self.work_folder, stage="done")
         self.view_groups_update = True        
         self._overview_show_api()
 
+    # Cluster items (CompareItems, sorted by hash) into groups of item indexes and go on with then(clusters),
+    # not called when paused/exited. Pairs come from the pair graph, pairs of different size are dropped
+    # with compare_file_size, an exact group joins the cluster of its first file. With compare.cap_group_diameter every pair
+    # inside a group is within t_report. Kept while the input doesn't change, comparing re-enters for every
+    # group when auto next group is off.
+    def _alg_comparing_clusters(self, items, t_link, t_report, then):
+        key = (t_link, t_report, self.compare_file_size, self.compare_cap_group_diameter, tuple(map(tuple, self.exact_groups)),
+               tuple(self.compare_verify_thresholds.items()), self.compare_similarity_min, self.compare_similarity_metric,
+               self.compare_rotation)
+        cached = self.compare_clusters_cache
+        if cached and cached[0] == key and cached[1].paths == items.paths and np.array_equal(cached[1].hashes, items.hashes):
+            then(cached[2])
+            return
+
+        def _clustered(graph):
+            max_diameter = t_report if self.compare_cap_group_diameter else None
+            clusters = graph.clusters(t_link, bool(self.compare_file_size), self._alg_comparing_exact(graph.paths), max_diameter,
+                                      self._alg_comparing_verify(graph.paths), self._alg_comparing_similarity_check(graph),
+                                      self._alg_comparing_variants(graph.paths, graph.hashes))
+
+            self.progress.setValue(self.compare_index)
+            self.compare_clusters_cache = (key, items, clusters)
+            then(clusters)
+
+        self._alg_comparing_graph(items, t_link, _clustered)
+
+    # Pair graph of items, then(graph) goes on with it, not called when paused/exited.
+    # The search runs once up to the link distance of compare.graph_max_tolerance (or t_link if higher)
+    # and is saved with the root, later tolerances within that radius reuse it without a search.
+    # A paused search is saved with the rows it has searched and goes on from there.
+    # A graph searched with or without rotation variants is only reused in the same mode.
+    def _alg_comparing_graph(self, items, t_link, then):
+        paths, hashes = items.paths, items.hashes
+        variants = self._alg_comparing_variants(paths, hashes)
+        count = 1 if variants is None else variants.shape[1]
+        if self.compare_graph is None:
+            self.compare_graph = self._db_load_pairs(self.work_folder)
+        if self.compare_graph is not None and self.compare_graph.variants != count:
+            self.compare_graph = None
+        graph = self.compare_graph
+        if graph is not None and graph.complete and graph.radius >= t_link:
+            graph = graph.subset(paths, hashes)
+            if graph is not None:
+                self.compare_graph = graph
+                then(graph)
+                return
+
+        radius = max(t_link, _alg_link_distance(self.compare_graph_max_tolerance, self.compare_cap_group_diameter))
+        if graph is not None and not graph.complete and graph.radius == radius and graph.paths == paths \
+                and np.array_equal(graph.hashes, hashes):
+            searched = graph.searched.copy()
+            found = [(graph.i, graph.j, graph.d)]
+        else:
+            searched = np.zeros(len(paths), dtype=bool)
+            found = []
+
+        def _searched(complete):
+            if found:
+                i, j, d = (np.concatenate(a) for a in zip(*found))
+                if variants is not None:
+                    # Pairs are found from both of their rows
+                    i, j, d = min_pairs(i, j, d)
+            else:
+                i = j = np.empty(0, dtype=np.int64)
+                d = np.empty(0, dtype=np.uint8)
+            sizes = items.sizes
+            self.compare_graph = PairGraph(paths, hashes, i, j, d, sizes[i] == sizes[j], radius,
+                                           None if complete else searched, count)
+            self._db_save_pairs(self.work_folder)
+            if not complete:
+                self._alg_comparing_pause()
+                return
+            then(self.compare_graph)
+
+        self._alg_comparing_search(hashes if variants is None else variants, radius, searched, found, _searched)
+
+    # Run the pair search as a job, then(complete) goes on with complete False when it was paused
+    def _alg_comparing_search(self, hashes, radius, searched, found, then):
+        self.progress.setMaximum(max(1, len(hashes)))
+        job = PairSearchJob(hashes, radius, searched, found, self.compare_workers, self._alg_comparing_search_status)
+        job.progress.connect(lambda cur, _: self.progress.setValue(cur))
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: then(bool(job.result) and not self.paused))
+
+    # Status text of the pair search jobs, built on the job thread
+    def _alg_comparing_search_status(self, cur, total, pairs):
+        return self.i18n.t("status.compare_searching", cur=cur, total=total, pairs=pairs)
+
+    # Compare only the files the stored pair graph doesn't know (added, or hashed again since) in a
+    # RowSearchJob and merge them into the groups. Groups without such a file stay as they are. Return
+    # False when there is no graph to build on, compare.cap_group_diameter needs every group checked again too.
+    def _alg_comparing_incremental(self, items, t_link):
+        if self.compare_cap_group_diameter:
+            return False
+        if self.compare_graph is None:
+            self.compare_graph = self._db_load_pairs(self.work_folder)
+        paths, hashes = items.paths, items.hashes
+        variants = self._alg_comparing_variants(paths, hashes)
+        count = 1 if variants is None else variants.shape[1]
+        if self.compare_graph is None or not self.compare_graph.complete or self.compare_graph.radius < t_link \
+                or self.compare_graph.variants != count:
+            return False
+        graph, added = self.compare_graph.carry(paths, hashes)
+        new_ids = np.flatnonzero(added).tolist()
+        if new_ids:
+            self.progress.setMaximum(len(new_ids))
+        # Pairs of two new files are found from the lower one
+        job = RowSearchJob(hashes if variants is None else variants, new_ids, added, graph.radius,
+                           self._alg_comparing_search_status)
+        job.progress.connect(lambda cur, _: self.progress.setValue(cur))
+        job.status.connect(self.status.setText)
+        self._job_start(job, lambda job: self._alg_comparing_incremental_done(job, items, t_link, graph, added))
+        return True
+
+    def _alg_comparing_incremental_done(self, job, items, t_link, graph, added):
+        if self.paused or job.result is None:
+            self._alg_comparing_pause()
+            return
+        i, j, d = job.result
+        if len(i):
+            graph = graph.add_pairs(i, j, d, items.sizes[i] == items.sizes[j])
+        self.compare_graph = graph
+        self._db_save_pairs(self.work_folder)
+        paths = items.paths
+
+        # Groups keep their files which weren't hashed again, new files join them through their pairs
+        pos = {p: k for k, p in enumerate(paths)}
+        groups = [[pos[p] for p in g if p in pos and not added[pos[p]]] for g in self.groups]
+        keep = (graph.d <= t_link) & (added[graph.i] | added[graph.j])
+        if self.compare_file_size:
+            keep &= graph.same_size
+        verify = self._alg_comparing_verify(paths)
+        if verify:
+            keep[keep] = graph.verified(verify, keep)
+        check = self._alg_comparing_similarity_check(graph)
+        if check is not None and keep.any():
+            keep[keep] = check(np.flatnonzero(keep))
+        # The first file of an exact group is linked for it, new byte-identical copies join its group
+        exact = self._alg_comparing_exact(paths)
+        alias = np.zeros(len(paths), dtype=bool)
+        for g in exact:
+            alias[g[1:]] = True
+        keep &= ~alias[graph.i] & ~alias[graph.j]
+        link_i, link_j = [graph.i[keep]], [graph.j[keep]]
+        for g in exact:
+            if added[g].any():
+                link_i.append(np.full(len(g) - 1, g[0], dtype=np.int64))
+                link_j.append(np.array(g[1:], dtype=np.int64))
+        merged = extend_groups(len(paths), groups, np.concatenate(link_i), np.concatenate(link_j))
+
+        self._group_sort_then_copy([[paths[k] for k in g] for g in merged])
+        self.duplicate_size = self._wokr_folder_count_duplicate_size(self.groups)
+        self.current = min(self.current, max(0, len(self.groups) - 1))
+        self.compare_incremental = False
+        self.compare_clusters_cache = None
+        self.compare_index = len(self.phashes)
+        self.progress.setMaximum(max(1, len(paths)))
+        self.progress.setValue(len(paths))
+        self.stage = "done"
+        self._db_save_progress(self.work_folder, stage="done")
+        self.view_groups_update = True
+        self._overview_show_api()
+
+    # True while the hash table was taken from self.phashes as they are
+    def _alg_comparing_table_current(self):
+        source = self.hash_table_source
+        return self.hash_table is not None and source[0] is self.phashes and source[1] == self.phashes.version
+
+    # Columns of self.phashes (HashEntries.table), taken again only when they changed since
+    def _alg_comparing_table(self):
+        if not isinstance(self.phashes, HashEntries):
+            self.phashes = HashEntries(self.phashes)
+        if not self._alg_comparing_table_current():
+            self.hash_table = self.phashes.table()
+            self.hash_table_source = (self.phashes, self.phashes.version)
+        return self.hash_table
+
+    # Hashed files sorted by compare hash, pHash and sizes come from the hash table columns
+    def _alg_comparing_items(self):
+        table = self._alg_comparing_table()
+        if self.compare_hash == "phash":
+            order = table.hashed_order()
+            hashes = table.hash[order]
+        else:
+            rows, values = [], []
+            for k in np.flatnonzero(table.status == STATUS_HASHED).tolist():
+                value = self._alg_comparing_hash_value(table.paths[k], self.compare_hash)
+                if value is not None:
+                    rows.append(k)
+                    values.append(value)
+            values = np.array(values, dtype=np.uint64)
+            by_hash = np.argsort(values, kind="stable")
+            order, hashes = np.array(rows, dtype=np.int64)[by_hash], values[by_hash]
+        return CompareItems([table.paths[k] for k in order.tolist()], hashes, table.size[order])
+
+    # Exact groups as item indexes of the compared paths, groups of 2+ files. The first file of a group is
+    # linked in the pair graph for all of them, see PairGraph.clusters.
+    def _alg_comparing_exact(self, paths):
+        pos = {p: k for k, p in enumerate(paths)}
+        exact = ([pos[p] for p in g if p in pos] for g in self.exact_groups)
+        return [g for g in exact if len(g) > 1]
+
+    # Exact groups of files which aren't compared (their hash failed), grouped as they are
+    def _alg_comparing_exact_unhashed(self, paths):
+        compared = set(paths)
+        exact = ([p for p in g if p in self.phashes] for g in self.exact_groups if compared.isdisjoint(g))
+        return [g for g in exact if len(g) > 1]
+
+    # Hash of an algorithm stored for a file, None if it has none. Other hashes than pHash are sparse fields.
+    def _alg_comparing_hash_value(self, path, name):
+        if name == "phash":
+            entry = self.phashes.get(path)
+            return entry.get("hash") if isinstance(entry, dict) else entry
+        return self.phashes.extra(path).get("hashes", {}).get(name)
+
+    # Cascade the groups were compared with: pairs are found with the compare hash (cheap recall, e.g. dHash),
+    # then kept only if every verification hash is within its compare.verify_thresholds distance as well
+    # and, with compare.verify_similarity, if their tiles are at least that similar.
+    # With compare.rotation_invariant files match in any rotation or mirror.
+    def _alg_comparing_cascade(self):
+        cascade = {"hash": self.compare_hash,
+                   "verify": dict(self.compare_verify_thresholds)}
+        if self.compare_similarity_min:
+            cascade["similarity"] = {"metric": self.compare_similarity_metric, "min": self.compare_similarity_min}
+        if self.compare_rotation:
+            cascade["rotation"] = True
+        return cascade
+
+    # Verification hashes of the items as [(hashes, max distance, valid)], see PairGraph.verified.
+    # Files without the hash (hashed before it was on, or taken from the hash cache) aren't checked.
+    def _alg_comparing_verify(self, paths):
+        verify = []
+        for name in self.compare_verify_hashes:
+            values = [self._alg_comparing_hash_value(p, name) for p in paths]
+            valid = np.array([v is not None for v in values], dtype=bool)
+            hashes = np.array([0 if v is None else v for v in values], dtype=np.uint64)
+            verify.append((hashes, self.compare_verify_thresholds[name], valid))
+        return verify
+
+    # pHash of every rotation and mirror of the items as (N, 8), column 0 the hashes. None when
+    # compare.rotation_invariant is off. A file hashed without them only matches unrotated.
+    def _alg_comparing_variants(self, paths, hashes):
+        if not self.compare_rotation:
+            return None
+        variants = np.repeat(np.asarray(hashes, dtype=np.uint64)[:, None], DIHEDRAL_VARIANTS, axis=1)
+        for k, p in enumerate(paths):
+            rotations = self.phashes.extra(p).get("variants")
+            if rotations:
+                variants[k, 1:] = rotations
+        return variants
+
+    # Pair check of the graph for PairGraph.clusters, None when compare.verify_similarity is off.
+    # Pairs are kept if their tiles are at least that similar, or a tile is missing (hashed before the check
+    # was on, or taken from the hash cache). Similarities are computed once per pair of the graph.
+    def _alg_comparing_similarity_check(self, graph):
+        if not self.compare_similarity_min:
+            return None
+        def check(pos):
+            memo = self.compare_similarity
+            if memo is None or memo[0] is not graph:
+                tiles, found = self._alg_similarity_tiles().stack(graph.paths)
+                memo = self.compare_similarity = (graph, tiles, found, np.full(len(graph.i), np.nan, dtype=np.float32),
+                                                  np.zeros(len(graph.i), dtype=bool))
+            _, tiles, found, sim, done = memo
+            todo = pos[~done[pos]]
+            if len(todo):
+                sim[todo] = pair_similarity(tiles, found, graph.i[todo], graph.j[todo], self.compare_similarity_metric,
+                                            self.compare_rotation)
+                done[todo] = True
+            return ~(sim[pos] < self.compare_similarity_min)
+        return check
+
+    # Number of groups the stored pair graph gives at a tolerance, None if it can't tell without a search
+    def _alg_comparing_preview_groups(self, tolerance, compare_file_size):
+        graph = self.compare_graph
+        t_link = _alg_link_distance(tolerance, self.compare_cap_group_diameter)
+        if graph is None or not graph.complete or graph.radius < t_link or self.stage not in ("done", "comparing"):
+            return None
+        max_diameter = int(tolerance) if self.compare_cap_group_diameter else None
+        clusters = graph.clusters(t_link, bool(compare_file_size), self._alg_comparing_exact(graph.paths), max_diameter,
+                                  self._alg_comparing_verify(graph.paths), self._alg_comparing_similarity_check(graph),
+                                  self._alg_comparing_variants(graph.paths, graph.hashes))
+        return len(clusters) + len(self._alg_comparing_exact_unhashed(graph.paths))
+
+    # Save comparing progress and return to browser when paused
+    def _alg_comparing_pause(self):
+        self.status.setText(self.i18n.t("status.comparison_pause"))
+        self._db_save_progress(self.work_folder, stage="comparing", extra={"compare_index": self.compare_index})
+        self.constraints.save_constraints()
+        self._db_unlock(self.work_folder)
+        self._work_folder_clear_variable()
+        self._browser_show(self.browser_folder)
+
+    # Run job for the current stage, then(job) goes on with the stage on the GUI thread once it is done.
+    # Not called after exit, the job was cancelled and its results are dropped.
+    def _job_start(self, job, then):
+        self.stage_job = job
+        job.finished.connect(lambda: self._job_done(job, then))
+        self.jobs.submit(job)
+        return job
+
+    def _job_done(self, job, then):
+        if self.stage_job is not job:
+            return
+        self.stage_job = None
+        if self.exit:
+            return
+        then(job)
+        # The stage is done or paused unless it started its next job
+        if self.stage_job is not None:
+            return
+        if self.sync_deferred:
+            ops, self.sync_deferred = self.sync_deferred, []
+            self._browser_sync_batch(ops)
+        if self.settings_deferred:
+            keys, self.settings_deferred = self.settings_deferred, []
+            self._cfg_apply_settings(keys)
+        if self.continue_deferred:
+            self.continue_deferred = False
+            # Only a stage which was paused back to the browser is continued
+            if self.paused and self.work_folder is None:
+                self._btn_action_continue_processing()
+
     def _alg_handler(self):
+        # A running stage job goes on by itself
+        if self.stage_job is not None:
+            return
         #Resume stage
         if self.stage == "done":
             self.compare_index = len(self.phashes)
@@ -4057,6 +5560,8 @@ class MatchImageFinder(QMainWindow):
             label_text = self.i18n.t("label.group_found",
                                     current=self.current + 1,
                                     images=len(grp))
+        if self._group_is_exact(grp):
+            label_text += " " + self.i18n.t("label.group_exact")
         self.group_info.setText(label_text)
         self._btn_controller()
         
@@ -4356,6 +5861,7 @@ class MatchImageFinder(QMainWindow):
         elif self.action == "show_browser" or self.action == "select_folder":
             if self.stage == "collecting":
                 self.paused = True
+                self.jobs.cancel()
             self._btn_action_browser_to_parent(getattr(self, "browser_folder", os.path.expanduser("~")))
         else:
             print(f"[Error] Not Defined Action: {self.action}\n")
@@ -4425,12 +5931,17 @@ class MatchImageFinder(QMainWindow):
             print(f"(Error) Not defined func {func} in chkbox_handler")
 
     def _btn_action_continue_processing(self):
+        # The paused stage still has to return from its job, it goes on once it has (_job_done)
+        if self.stage_job is not None:
+            self.continue_deferred = True
+            self.status.setText(self.i18n.t("status.continue_queued"))
+            return
         self.paused = False
         self.work_folder = self.browser_folder
         self._db_load_filelist(self.work_folder)
         self._db_load_progress(self.work_folder)
         self._db_load_exceptions(self.work_folder)
-        self.constraints = ConstraintsStore(self.work_folder)
+        self.constraints = ConstraintsStore(self.work_folder, index=self._db_index(self.work_folder))
         self._alg_handler()
 
     def _btn_action_delete_unchecked(self):
@@ -4476,7 +5987,7 @@ class MatchImageFinder(QMainWindow):
         self._db_load_filelist(self.work_folder)
         self._db_load_progress(self.work_folder)
         self._db_load_exceptions(self.work_folder)
-        self.constraints = ConstraintsStore(scan_folder = self.work_folder)
+        self.constraints = ConstraintsStore(scan_folder = self.work_folder, index=self._db_index(self.work_folder))
 
         if self.stage == "comparing":
             self._alg_handler()
@@ -4545,154 +6056,492 @@ class MatchImageFinder(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Can't open Explorer: {e}")
 
-    def _db_load_progress(self, path):
+    # SQLite index of a root, None while the JSON files are used. Whichever was written last is copied over
+    # the other when a root is opened the first time: the index starts from existing JSON files and the JSON
+    # files follow the index again after performance.root_index was switched back to json.
+    def _db_index(self, path):
         if path == None:
-            return False
-        progress_file = os.path.join(path, f"{PROGRESS_FILE}")
-
-        if os.path.exists(progress_file):
+            return None
+        root = os.path.abspath(path)
+        if root in self.root_indexes:
+            return self.root_indexes[root]
+        index = None
+        try:
+            index_mtime, json_mtime = self._db_index_mtimes(root)
+            if self.root_index_enabled:
+                index = RootIndex(root)
+                if json_mtime > index_mtime:
+                    self._db_index_import(root, index)
+            elif index_mtime > json_mtime:
+                self._db_index_export(root, RootIndex(root))
+        except (sqlite3.Error, OSError) as e:
+            print(f"[Warning] Root index disabled: {e}")
+            index = None
+        self.root_indexes[root] = index
+        return index
+
+    # Newest modification time of the index and of the JSON files of a root, 0 if there are none
+    def _db_index_mtimes(self, root):
+        self.json_writer.flush()
+        def _mtime(names):
+            return max((os.path.getmtime(f) for f in (os.path.join(root, n) for n in names) if os.path.exists(f)), default=0)
+        index_mtime = _mtime((ROOT_INDEX_FILE, ROOT_INDEX_FILE + "-wal"))
+        json_mtime = _mtime((PROGRESS_FILE, FILELIST_FILE, EXCEPTIONS_FILE, CONSTRAINTS_FILE))
+        return index_mtime, json_mtime
+
+    # One-shot migration of the JSON files into the index
+    def _db_index_import(self, root, index):
+        for name, save in ((PROGRESS_FILE, index.save_progress),
+                           (FILELIST_FILE, index.save_filelist),
+                           (EXCEPTIONS_FILE, index.save_exceptions)):
+            file = os.path.join(root, name)
+            if os.path.exists(file):
+                with open(file, 'r', encoding="utf-8") as f:
+                    save(json.load(f))
+        constraints = ConstraintsStore(root)
+        index.save_constraints(constraints.version, constraints.must_pairs, constraints.cannot_pairs, constraints.ignored_files)
+        print(f"[Message] Root index imported from the JSON files of {root}")
+
+    # Write the JSON files from the index, readable by builds without it
+    def _db_index_export(self, root, index):
+        progress = index.load_progress()
+        filelist = index.load_filelist()
+        exceptions = index.load_exceptions()
+        has_constraints = index.load_constraints() is not None
+        constraints = ConstraintsStore(root, index=index)
+        # Closed first, the JSON files end up newer than the index
+        index.close()
+        if progress is not None:
+            progress["phashes"] = _db_sorted_hashes(progress["phashes"])
+        for name, data in ((PROGRESS_FILE, progress), (FILELIST_FILE, filelist), (EXCEPTIONS_FILE, exceptions)):
+            if data is not None:
+                with open(os.path.join(root, name), 'w', encoding="utf-8") as f:
+                    json.dump(data, f, indent=2)
+        if has_constraints:
+            constraints.save_json()
+        print(f"[Message] JSON files of {root} exported from the root index")
+
+    def _db_index_close(self):
+        for root, index in self.root_indexes.items():
+            self.root_cache.discard(root)
+            if index is None:
+                continue
             try:
-                with open(progress_file, 'r', encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.hash_format = data.get("hash_format","v1")
-                    self.stage = data.get("stage","init")
-                    self.previous_file_counter = data.get("file_counter",0)
-                    self.last_group_index = data.get("current",0)
-                    self.overview_page = data.get("overview_page",0)
-                    self.progress_compare_file_size = data.get("compare_file_size", True)
-                    self.progress_similarity_tolerance = data.get("similarity_tolerance", 5)
-                    self.duplicate_size = data.get("duplicate_size", 0)
-                    self.visited = set(data.get("visited",[]) )
-                    self.groups = data.get("groups",[])
-                    self.phashes = data.get("phashes",{})                    
-                    self.compare_index = data.get("compare_index",0)
-                    return True
-            except Exception as e:
-                print(f"[Error] Read Progress file: {e}")
-                return False
-        else:
-            print(f"[Message] Progress file does not exist") 
-            return False
+                index.close()
+            except sqlite3.Error as e:
+                print(f"[Warning] Root index: {e}")
+        self.root_indexes = {}
 
-    def _db_save_progress(self, path, stage="done", extra=None):
+    def _db_load_progress(self, path):
         if path == None:
             return False
-        progress_file = os.path.join(path, f"{PROGRESS_FILE}")
+        index = self._db_index(path)
+        if self.hash_journal is not None and path == self.work_folder:
+            # Hashed entries not logged yet are replayed like the others, the replay reads the file
+            self._alg_hashing_journal_step(checkpoint=False, sync=True)
 
-        sorted_hashes = {
-            k: self.phashes[k]
-            for k in sorted(self.phashes, key=lambda k: self.phashes[k].get("hash", 0))
-        }
+        try:
+            if index is not None:
+                data = index.load_progress()
+            else:
+                data = self._db_load_progress_json(path)
+            if data is not None:
+                self.hash_format = data.get("hash_format","v1")
+                self.stage = data.get("stage","init")
+                self.previous_file_counter = data.get("file_counter",0)
+                self.last_group_index = data.get("current",0)
+                self.overview_page = data.get("overview_page",0)
+                self.progress_compare_file_size = data.get("compare_file_size", True)
+                self.progress_similarity_tolerance = data.get("similarity_tolerance", 5)
+                self.progress_compare_cascade = data.get("compare_cascade", {"hash": "phash", "verify": {}})
+                self.duplicate_size = data.get("duplicate_size", 0)
+                # Copies, the data may be kept by the root cache
+                self.groups = [list(g) for g in data.get("groups",[])]
+                self.exact_groups = [list(g) for g in data.get("exact_groups",[])]
+                phashes = data.get("phashes",{})
+                if index is not None:
+                    # The index writes the rows of the entries it handed out which changed
+                    self.phashes = phashes
+                else:
+                    # Not the entries of the data, the root cache may keep it. A copy shares the columns until written.
+                    self.phashes = HashEntries(phashes)
+                self.hash_table = self.hash_table_source = None
+                self.compare_index = data.get("compare_index",0)
+                self.compare_incremental = data.get("incremental", False)
+                self._db_drop_stale_hashes(data.get("hash_algos", {"phash": 1}), data.get("hash_decode", "full"))
+                self.progress_journal = data.get("journal", 0)
+                self._db_replay_journal(path)
+                return True
+        except Exception as e:
+            print(f"[Error] Read Progress file: {e}")
+            return False
+        print(f"[Message] Progress file does not exist") 
+        return False
 
-        if progress_file is None:
-            return
-       
-        data = {
+    # Progress values of the loaded root, without the hashes
+    def _db_progress_data(self):
+        return {
             "hash_format": "v2",
             "stage": self.stage,
             "file_counter": len(self.phashes),
             "current": self.current,
             "compare_index": self.compare_index,
+            "incremental": self.compare_incremental,
             "overview_page": self.overview_page,
             "compare_file_size": self.compare_file_size,
             "similarity_tolerance": self.similarity_tolerance,
+            "compare_cascade": self._alg_comparing_cascade(),
+            "hash_algos": {name: algo.version for name, algo in HASH_ALGOS.items()},
+            "hash_decode": "fast" if self.hash_fast_decode else "full",
             "duplicate_size":self.duplicate_size,
-            "visited": list(self.visited),
-            "groups": self.groups,
-            "phashes": sorted_hashes
+            "groups": [list(g) for g in self.groups],
+            "exact_groups": [list(g) for g in self.exact_groups],
+            "journal": self.progress_journal or 0
         }
+
+    # Data of a JSON file of a root, None if there is none. Taken from the root cache while the file is unchanged.
+    def _db_load_json(self, path, name):
+        root, file = os.path.abspath(path), os.path.join(path, name)
+        data = self.root_cache.get(root, name, file)
+        if data is not None:
+            return data
+        # A write still queued would be read back old
+        self.json_writer.flush(file)
+        if not os.path.exists(file):
+            return None
+        stamp = file_stamp(file)
+        with open(file, 'r', encoding="utf-8") as f:
+            data = json.load(f)
+        self.root_cache.put(root, name, data, stamp)
+        return data
+
+    # Progress data of a root kept in the JSON files, from the hash table file if it was written with the progress
+    # file as it is: the entries come from its columns and sparse fields, the file with every entry isn't parsed.
+    # Otherwise (written by a build without the table, or its write failed) from the progress file.
+    def _db_load_progress_json(self, path):
+        root, file = os.path.abspath(path), os.path.join(path, PROGRESS_FILE)
+        data = self.root_cache.get(root, PROGRESS_FILE, file)
+        if data is not None:
+            return data
+        # A write still queued would be read back old
+        self.json_writer.flush(file)
+        table_file = os.path.join(path, HASH_TABLE_FILE)
+        stamp = file_stamp(file)
+        if stamp[1] >= 0 and os.path.exists(table_file):
+            try:
+                table = HashTable.load(table_file)
+            except Exception as e:
+                print(f"[Error] Read hash table file: {e}")
+                table = None
+            if table is not None and table.meta.get("progress_stamp") == list(stamp):
+                data = dict(table.meta["progress"], phashes=HashEntries.from_table(table, table.meta.get("sparse")))
+                self.root_cache.put(root, PROGRESS_FILE, data, stamp)
+                return data
+        return self._db_load_json(path, PROGRESS_FILE)
+
+    # Keep data of a JSON file of a root in the root cache and write it. In a batch of file operations it is
+    # written by _db_flush() instead, unless defer is False. Return the future of the write, None if held back.
+    def _db_save_json(self, path, name, data, defer=True):
+        root = os.path.abspath(path)
+        version = self.root_cache.put(root, name, data, defer=defer)
+        if defer and self.root_cache.deferred:
+            return None
+        return self._db_write_json(root, name, data, version)
+
+    # Queue the write on the JSON writer, the root cache stamps the data once it is on disk
+    def _db_write_json(self, root, name, data, version):
+        file = os.path.join(root, name)
+        # Progress entries are sorted and their hash table built by the writer thread
+        future = self.json_writer.submit(file, data, _db_write_progress if name == PROGRESS_FILE else write_json)
+        future.add_done_callback(lambda f: self.root_cache.written(root, name, version, file, f.result()))
+        return future
+
+    # Write what a batch of file operations saved of a root, one write per file
+    def _db_flush(self, root):
+        root = os.path.abspath(root)
+        for name, (data, version) in self.root_cache.take_dirty(root).items():
+            self._db_write_json(root, name, data, version)
+
+    # Apply the entries the hashing journal logged after the progress data was written (a run which didn't
+    # end, or hashing still running). They count like files added since the root was compared.
+    def _db_replay_journal(self, path):
         try:
-            with open(progress_file, 'w', encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
+            records = HashJournal.replay(path, self.progress_journal)
+        except OSError as e:
+            records = []
+        for rel, entry in records:
+            if entry is None:
+                self.phashes.pop(rel, None)
+            else:
+                self.phashes[rel] = entry
+        if self.hash_journal is not None and path == self.work_folder:
+            self.phashes.journal = self.hash_journal
+        if not records:
+            return
+        if self.hash_journal is None:
+            print(f"[Message] {len(records)} hashes recovered from the hashing journal")
+        if self.stage in ("comparing", "done"):
+            if self.stage == "done" or self.compare_incremental:
+                self.compare_incremental = True
+            else:
+                self.compare_index = 0
+                self.groups = []
+            self.stage = "hashing"
+
+    # Hashes of an algorithm version other than the current one are computed again, so are hashes decoded
+    # in another performance.fast_decode mode than the current one (decode is the mode the root was hashed with,
+    # full for progress files written before the mode was stored).
+    # A stale pHash drops the whole entry, the file is hashed like a new one.
+    # Groups found with stale hashes are compared again from scratch.
+    def _db_drop_stale_hashes(self, versions, decode):
+        stale = {name for name, algo in HASH_ALGOS.items() if versions.get(name) != algo.version}
+        fast, was_fast = self.hash_fast_decode, decode == "fast"
+        if not stale and fast and was_fast:
+            return
+        dropped = 0
+        for rel, entry in list(self.phashes.items()):
+            if not isinstance(entry, dict):
+                continue
+            if entry.get("hash") is not None and ("phash" in stale or _alg_hashing_decode_stale(rel, entry, fast, was_fast)):
+                del self.phashes[rel]
+                dropped += 1
+                continue
+            extra = entry.get("hashes")
+            names = stale.intersection(extra or ())
+            if names:
+                dropped += len(names)
+                # A new entry, the loaded one may be kept by the root cache. The root index writes entries which were set.
+                self.phashes[rel] = dict(entry, hashes={k: v for k, v in extra.items() if k not in names})
+        if dropped and self.stage in ("comparing", "done"):
+            print(f"[Message] {dropped} hashes of an older algorithm version or decode mode are computed again")
+            self.stage = "hashing"
+            self.compare_index = 0
+            self.compare_incremental = False
+            self.groups = []
+            self.duplicate_size = 0
+
+    def _db_save_progress(self, path, stage="done", extra=None):
+        if path == None:
+            return False
+        progress_file = os.path.join(path, f"{PROGRESS_FILE}")
+        index = self._db_index(path)
+        journal = self._alg_hashing_journal_rotate(path)
+
+        if progress_file is None:
+            return
+       
+        data = self._db_progress_data()
+        try:
+            if index is not None:
+                # The index writes the rows of entries set since the last save only
+                data["phashes"] = self.phashes
+                self.phashes = index.save_progress(data)
+                # The log of the last generation is in the saved data now
+                if journal is not None:
+                    journal.drop_prev()
+            else:
+                # A copy of the entries is a snapshot, it shares the columns until they are written
+                data["phashes"] = self.phashes.copy()
+                # The log of the last generation is dropped once the data is written, not held back by a batch
+                future = self._db_save_json(path, PROGRESS_FILE, data, defer=journal is None)
+                if journal is not None:
+                    self.hash_checkpoint = future
         except Exception as e:
             print(f"[Error] saving progress: {e}")
+        # Tiles of the similarity check follow the hashes
+        if self.tile_store is not None and path == self.work_folder:
+            self.tile_store.prune(self.phashes)
+            if self.tile_store.dirty:
+                self._db_save_tiles(path, self.tile_store)
 
     def _db_load_exceptions(self, path):
         if path == None:
             return False
-        exceptions_file = os.path.join(path, f"{EXCEPTIONS_FILE}")
-        if os.path.exists(exceptions_file):
-            try:
-                with open(exceptions_file, 'r', encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.exception_file_version = data.get("version","1")
-                    self.exception_file_updated = data.get("updated","")
-                    self.not_duplicate_pairs = data.get("not_duplicate_pairs",[])
-                    self.exception_groups = data.get("exception_groups",[])
-                    self.exception_folder = data.get("exclude_folder","")
-                    return True
-            except Exception as e:
-                print(f"[Error] Read exception file: {e}")
-                return False
-        else:
-            print(f"[Message] Exception file does not exist") 
+        index = self._db_index(path)
+        try:
+            if index is not None:
+                data = index.load_exceptions()
+            else:
+                data = self._db_load_json(path, EXCEPTIONS_FILE)
+            if data is not None:
+                self.exception_file_version = data.get("version","1")
+                self.exception_file_updated = data.get("updated","")
+                self.not_duplicate_pairs = [list(p) for p in data.get("not_duplicate_pairs",[])]
+                self.exception_groups = [list(g) for g in data.get("exception_groups",[])]
+                self.exception_folder = data.get("exclude_folder","")
+                return True
+        except Exception as e:
+            print(f"[Error] Read exception file: {e}")
             return False
+        print(f"[Message] Exception file does not exist") 
+        return False
 
     def _db_save_exceptions(self, path):
         if path == None:
             return False
-        exceptions_file = os.path.join(path, f"{EXCEPTIONS_FILE}")
         data = {
             "version": self.exception_file_version,
             "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
             "exclude_folder": self.exclude_input.text(),
-            "not_duplicate_pairs": self.not_duplicate_pairs,
-            "exception_groups": self.exception_groups,
+            "not_duplicate_pairs": [list(p) for p in self.not_duplicate_pairs],
+            "exception_groups": [list(g) for g in self.exception_groups],
         }
-
-        if exceptions_file is None:
-            return
         try:
-            with open(exceptions_file, 'w', encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
+            index = self._db_index(path)
+            if index is not None:
+                index.save_exceptions(data)
+            else:
+                self._db_save_json(path, EXCEPTIONS_FILE, data)
         except Exception as e:
             print(f"[Error] saving exception: {e}")
 
+    # Report of the last run: files which could not be hashed and, with performance.verify_fast_decode,
+    # how often the fast decode hash differs from the full decode one. Removed when there is neither.
+    # True once the report is queued on the writer, False when there is no root or it failed
+    def _db_save_quarantine(self, path):
+        if path == None:
+            return False
+        quarantine_file = os.path.join(path, f"{QUARANTINE_FILE}")
+        verify = self.hash_verify_stats if self.hash_verify_stats and self.hash_verify_stats["checked"] else None
+        try:
+            if not self.hash_quarantine and verify is None:
+                self.json_writer.submit(quarantine_file, None, _db_remove_file)
+                return True
+            # Snapshots, the report goes on growing with the next run
+            data = {
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "files": list(self.hash_quarantine)
+            }
+            if verify is not None:
+                data["fast_decode_verify"] = dict(verify)
+            self.json_writer.submit(quarantine_file, data)
+            if self.hash_quarantine:
+                print(f"[Message] {len(self.hash_quarantine)} files could not be hashed, see {quarantine_file}")
+            if verify is not None:
+                print(f"[Message] Fast decode hash differs on {verify['differ']}/{verify['checked']} files, "
+                      f"max distance {verify['max_distance']}, see {quarantine_file}")
+            return True
+        except Exception as e:
+            print(f"[Error] saving quarantine: {e}")
+            return False
+
+    # Pair graph of the last compare, None if there is none
+    def _db_load_pairs(self, path):
+        if path == None:
+            return None
+        pairs_file = os.path.join(path, f"{PAIRS_FILE}")
+        self.json_writer.flush(pairs_file)
+        if not os.path.exists(pairs_file):
+            return None
+        try:
+            return PairGraph.load(pairs_file)
+        except Exception as e:
+            print(f"[Error] Read pairs file: {e}")
+            return None
+
+    # Written by the writer thread, a graph isn't changed once built
+    def _db_save_pairs(self, path):
+        if path == None or self.compare_graph is None:
+            return False
+        pairs_file = os.path.join(path, f"{PAIRS_FILE}")
+        try:
+            self.json_writer.submit(pairs_file, self.compare_graph, lambda file, graph: graph.save(file))
+            return True
+        except Exception as e:
+            print(f"[Error] saving pairs: {e}")
+            return False
+
+    def _db_load_tiles(self, path):
+        if path == None:
+            return None
+        tiles_file = os.path.join(path, f"{TILES_FILE}")
+        self.json_writer.flush(tiles_file)
+        if not os.path.exists(tiles_file):
+            return None
+        try:
+            return TileStore.load(tiles_file)
+        except Exception as e:
+            print(f"[Error] Read tiles file: {e}")
+            return None
+
+    # Written by the writer thread from a copy of the tiles, the store goes on changing
+    def _db_save_tiles(self, path, store):
+        if path == None or store is None:
+            return False
+        tiles_file = os.path.join(path, f"{TILES_FILE}")
+        try:
+            self.json_writer.submit(tiles_file, TileStore(store.tiles), lambda file, tiles: tiles.save(file))
+            store.dirty = False
+            return True
+        except Exception as e:
+            print(f"[Error] saving tiles: {e}")
+            return False
+
     def _db_load_filelist(self, path):
         if path == None:
             return False
-        filelist_file = os.path.join(path, f"{FILELIST_FILE}")
-        if os.path.exists(filelist_file):
-            try:
-                with open(filelist_file, 'r', encoding="utf-8") as f:
-                    filelist_data = json.load(f)
-                    self.image_paths = filelist_data["image_paths"]
-                    self.last_scan_time = filelist_data.get("last_scan_time","None")
-                    return True        
-            except Exception as e:
-                print(f"[Error] Read filelist file: {e}")
-                return False
-        else:
+        index = self._db_index(path)
+        try:
+            if index is not None:
+                filelist_data = index.load_filelist()
+            else:
+                filelist_data = self._db_load_json(path, FILELIST_FILE)
+            if filelist_data is not None:
+                self.image_paths = list(filelist_data["image_paths"])
+                self.last_scan_time = filelist_data.get("last_scan_time","None")
+                return True        
+        except Exception as e:
+            print(f"[Error] Read filelist file: {e}")
             return False
+        return False
 
     def _db_save_filelist(self, path):
         if path == None:
             return False
-        filelist_file = os.path.join(path, f"{FILELIST_FILE}")
+        data = {
+            "last_scan_time": self.last_scan_time,
+            "image_paths": list(self.image_paths)
+        }
         try:
-            with open(filelist_file, 'w', encoding="utf-8") as f:
-                json.dump({
-                    "last_scan_time": self.last_scan_time,
-                    "image_paths": self.image_paths
-                    }, f, indent=2)
+            index = self._db_index(path)
+            if index is not None:
+                index.save_filelist(data)
+            else:
+                self._db_save_json(path, FILELIST_FILE, data)
         except Exception as e:
             print(f"[Error] Write Filelist file: {e}")
     
     def _btn_action_pause_processing(self):
         self.paused = True
+        self.jobs.cancel()
         self.action = "pause"
         self._btn_controller()
 
     def _btn_action_exit_and_save(self):
         self.action = "exit_and_save"
         self.exit = True
+        self.jobs.shutdown()
+        # Hashes the job sent before it stopped are stored with the progress, not hashed again
+        QApplication.processEvents()
+        self.stage_job = None
+        self._alg_hashing_cache_close()
 
-        if self.work_folder:
+        work_folder = self.work_folder
+        if work_folder:
             if self.stage != "collecting":
-                self._db_save_filelist(self.work_folder)
-                self._db_save_progress(self.work_folder, stage=self.stage)
-                self._db_save_exceptions(self.work_folder)
-            self._db_unlock(self.work_folder)
+                self._db_save_filelist(work_folder)
+                self._db_save_progress(work_folder, stage=self.stage)
+                self._db_save_exceptions(work_folder)
+            self._alg_hashing_journal_close()
+        # File operations held back for the stopped job go to the db on top of the saved progress
+        if self.sync_deferred:
+            ops, self.sync_deferred = self.sync_deferred, []
+            self._browser_sync_batch(ops)
+        if work_folder:
+            self._db_unlock(work_folder)
+        # Saves of every root are on disk before the app quits
+        self.json_writer.flush()
+        self._db_index_close()
 
         QApplication.instance().quit()
 
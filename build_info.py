@@ -0,0 +1,2 @@
+VERSION = "dev"
+BUILD_TIME = "2026-10-17 00:00:00"
@@ -84,7 +84,7 @@ def run_pyinstaller(arch, version):
                         f"--add-data 'icons/*.png:icons' " \
                         f"--collect-all pgpy --copy-metadata pgpy --copy-metadata cryptography " \
                         f"--collect-all rawpy --copy-metadata rawpy --collect-all pillow_heif --copy-metadata pillow_heif " \
-                        f"--copy-metadata PyQt5 --copy-metadata Pillow --copy-metadata imagehash --exclude-module torch --exclude-module numba {APP_SOURCE}"
+                        f"--copy-metadata PyQt5 --copy-metadata Pillow --exclude-module torch --exclude-module numba {APP_SOURCE}"
 
         dist_app_name = os.path.splitext(APP_SOURCE)[0] + ".app"
         dist_app_dir = os.path.join("dist", dist_app_name)
@@ -112,7 +112,7 @@ def run_pyinstaller(arch, version):
             "--add-data", r"icons\*.png;icons",
             "--collect-all", "pgpy", "--copy-metadata", "pgpy", "--copy-metadata", "cryptography",
             "--collect-all", "rawpy", "--copy-metadata", "rawpy", "--collect-all", "pillow_heif", "--copy-metadata", "pillow_heif",
-            "--copy-metadata", "PyQt5", "--copy-metadata", "Pillow", "--copy-metadata", "imagehash",
+            "--copy-metadata", "PyQt5", "--copy-metadata", "Pillow",
             "--exclude-module", "torch", "--exclude-module", "numba", APP_SOURCE
         ]
 
@@ -7,9 +7,11 @@ from copy import deepcopy
 
 import pytest
 from PIL import Image
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 from shutil import copyfile
 from Match_Image_Finder import MatchImageFinder, FILELIST_FILE, PROGRESS_FILE
+from utils.json_writer import flush_writes
 
 UI_TEST = SimpleNamespace(
     navigation_browser=True,
@@ -52,6 +54,31 @@ SETT_TEST = SimpleNamespace(
     confirm_delete=True,
     display_same_images=True,
 )
+
+PERF_TEST = SimpleNamespace(
+    worker_autoscaler=True,
+    fast_decode_hash=True,
+    raw_decode=True,
+    numpy_phash=True,
+    hash_registry=True,
+    verify_thresholds=True,
+    hash_cache=True,
+    hash_failures=True,
+    exact_duplicates=True,
+    hamming_index=True,
+    union_find_clusters=True,
+    pair_graph=True,
+    tile_similarity=True,
+    rotation_invariant=True,
+    root_index=True,
+    hash_table=True,
+    hash_journal=True,
+    json_writer=True,
+    root_cache=True,
+    incremental_compare=True,
+    sharded_compare=True,
+    job_runner=True,
+)
 # -------------------------------
 # Helpers
 # -------------------------------
@@ -106,6 +133,8 @@ def _make_big_png(path: Path, min_bytes: int = 60000):
 
 
 def _read_json(path: Path):
+    # 等待背景寫入完成
+    flush_writes()
     if not path.exists():
         return None
     with open(path, "r", encoding="utf-8") as f:
@@ -173,7 +202,11 @@ def qapp():
 
 
 @pytest.fixture
-def window(qapp, qtbot, tmp_path):
+def window(qapp, qtbot, tmp_path, tmp_path_factory, monkeypatch):
+    # 設定檔、全域雜湊快取與 QSettings 都放在每個測試自己的目錄，不共用狀態也不寫入使用者設定
+    config_home = tmp_path_factory.mktemp("config")
+    for name in ("XDG_CONFIG_HOME", "APPDATA", "HOME"):
+        monkeypatch.setenv(name, str(config_home))
     w = MatchImageFinder()
     qtbot.addWidget(w)
 
@@ -212,6 +245,9 @@ def window(qapp, qtbot, tmp_path):
     except Exception:
         pass
     QApplication.processEvents()
+    # 關閉視窗會呼叫 quit()，之後的 event loop 會立刻結束；跑一次 exec() 清掉這個狀態，下個測試才能等待背景工作
+    QTimer.singleShot(0, QApplication.quit)
+    QApplication.exec_()
     try:
         w.cfg._cfg = deepcopy(original_cfg_data)
         w.cfg.save()
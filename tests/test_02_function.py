@@ -100,7 +100,9 @@ def file_assert_filelist_matches(qtbot, window, tmp_path, helpers, src_abs, expe
 
 def file_assert_progress_matches(pr_path: Path, scan_root: Path, expected_rel_set: set[str], expected_stage="done"):
     import json
+    from utils.json_writer import flush_writes
 
+    flush_writes()
     assert pr_path.exists(), f"{pr_path} not exist"
     with pr_path.open("r", encoding="utf-8") as f:
         pr = json.load(f)
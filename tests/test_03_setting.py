@@ -624,6 +624,7 @@ def test_setting_similarity_tolerance(qtbot, window, tmp_path, helpers):
             window.paused = False
             window.action = "collecting"
             window._alg_comparing_pairwise()
+            qtbot.waitUntil(lambda: window.stage_job is None, timeout=5000)
             return [grp[:] for grp in window.groups]
 
         window._overview_show_api = lambda: None
@@ -701,6 +702,7 @@ def test_setting_compare_file_size(qtbot, window, tmp_path, helpers):
 
         _prepare(size_equal=False)
         window._alg_comparing_pairwise()
+        qtbot.waitUntil(lambda: window.stage_job is None, timeout=5000)
         assert not any(len(grp) > 1 for grp in window.groups), "compare_file_size=True should skip size-mismatched files"
 
         cb.setChecked(False)
@@ -711,6 +713,7 @@ def test_setting_compare_file_size(qtbot, window, tmp_path, helpers):
 
         _prepare(size_equal=False)
         window._alg_comparing_pairwise()
+        qtbot.waitUntil(lambda: window.stage_job is None, timeout=5000)
         assert any(len(grp) > 1 for grp in window.groups), "compare_file_size=False should group even when sizes differ"
 
         qtbot.mouseClick(cancel_btn, Qt.LeftButton)
@@ -777,6 +780,7 @@ def test_setting_auto_next_group(qtbot, window, tmp_path, helpers):
             window._group_show_api = _fake_group_show_api
             _prepare()
             window._alg_comparing_pairwise()
+            qtbot.waitUntil(lambda: window.stage_job is None, timeout=5000)
 
             if desired:
                 assert calls["count"] == 0, "auto-next enabled should not open group view"
@@ -0,0 +1,1088 @@
+from conftest import PERF_TEST
+import pytest
+import numpy as np
+from PIL import Image
+import errno
+import io
+import json
+from types import SimpleNamespace
+import os
+import subprocess
+import sys
+import threading
+import time
+import Match_Image_Finder
+from Match_Image_Finder import _alg_hashing_api, _alg_link_distance, _cfg_resolve_verify_thresholds, PAIRS_FILE
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from utils.autoscaler import WorkerAutoscaler, CpuMeter
+from utils.phash import phash_tile, phash_stack, phash_from_tiles, phash_variants_from_tiles
+from utils.image_hash import HASH_ALGOS, hash_tiles, hashes_from_tiles, verify_threshold, WHASH_SCALE, COLORHASH_TILE
+from utils.hash_cache import HashCache
+import utils.hamming_index as hamming_index
+from utils.hamming_index import MultiIndexHash, VariantIndex, popcount64, variant_distance, min_pairs
+from utils.jobs import Job, JobRunner, CancelToken
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QApplication
+from utils.clustering import cluster_pairs, PairGraph
+from utils.tile_store import TileStore, pair_similarity
+from utils.root_index import RootIndex
+from utils.hash_table import HashTable, HashEntries, STATUS_HASHED, STATUS_DEFERRED, STATUS_FAILED
+from utils.hash_journal import HashJournal, JOURNAL_FILE
+from utils.json_writer import JsonWriter, flush_writes, write_pending
+from utils.root_cache import RootCache, file_stamp
+from utils.constraints_store import ConstraintsStore
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def _feed(scaler, clock, rate_of, files):
+    # Feed finished files one by one, time advances according to current worker count
+    for _ in range(files):
+        clock.now += 1.0 / rate_of(scaler.workers)
+        scaler.record(1)
+
+def test_worker_autoscaler_grows_until_no_gain():
+    if not PERF_TEST.worker_autoscaler:
+        pytest.skip()
+    clock = _FakeClock()
+    scaler = WorkerAutoscaler(32, start_workers=4, window_files=10, calibrate_files=300, clock=clock, cpu_fn=lambda: 0.2)
+    # Throughput scales linearly up to 12 workers, then flat
+    _feed(scaler, clock, lambda w: 10.0 * min(w, 12), 300)
+    assert scaler.settled
+    assert 12 <= scaler.workers <= 18, f"should settle near the knee, got {scaler.workers}: {scaler.history}"
+
+def test_worker_autoscaler_stops_when_cpu_saturated():
+    if not PERF_TEST.worker_autoscaler:
+        pytest.skip()
+    clock = _FakeClock()
+    scaler = WorkerAutoscaler(32, start_workers=4, window_files=10, clock=clock, cpu_fn=lambda: 0.99)
+    _feed(scaler, clock, lambda w: 10.0 * w, 50)
+    assert scaler.settled
+    assert scaler.workers == 4
+
+def test_worker_autoscaler_shrinks_when_growth_hurts():
+    if not PERF_TEST.worker_autoscaler:
+        pytest.skip()
+    clock = _FakeClock()
+    scaler = WorkerAutoscaler(32, start_workers=6, window_files=10, clock=clock, cpu_fn=lambda: None)
+    # I/O bound: fewer workers are faster
+    _feed(scaler, clock, lambda w: 100.0 / w, 300)
+    assert scaler.settled
+    assert scaler.workers < 6
+
+def test_cpu_meter_measures_each_window(capsys):
+    if not PERF_TEST.worker_autoscaler:
+        pytest.skip()
+    # Utilisation is the busy share of the CPU time since the previous call, not a moving average
+    times = iter([(0, 0), (50, 100), (250, 300), (250, 400)])
+    meter = CpuMeter(reader=lambda: next(times))
+    assert [meter(), meter(), meter()] == [0.5, 1.0, 0.0]
+    # No measurement is reported once and left to the throughput
+    meter = CpuMeter(reader=lambda: None)
+    assert meter() is None and meter() is None
+    assert capsys.readouterr().out.count("CPU utilisation not available") == 1
+
+def test_fast_decode_hash_matches_full_decode(tmp_path):
+    if not PERF_TEST.fast_decode_hash:
+        pytest.skip()
+    # Large smooth JPEG, draft mode decodes it at 1/8 scale
+    img = Image.linear_gradient("L").resize((3000, 2000)).convert("RGB")
+    img.paste((200, 30, 30), (400, 300, 1400, 1200))
+    path = tmp_path / "big.jpg"
+    img.save(path, format="JPEG", quality=90)
+
+    res = _alg_hashing_api(str(path), True, True)
+    assert res["decode"] == "draft"
+    fast, full = phash_from_tiles(phash_stack([res["tile"], res["verify_tile"]]))
+    # Only bits near the median may flip, far below the default similarity tolerance
+    assert (fast ^ full).bit_count() <= 4
+
+    res_full = _alg_hashing_api(str(path), False)
+    assert res_full["decode"] == "full"
+    assert res_full["tile"] == res["verify_tile"]
+
+    # Hashes decoded in the other mode are computed again, unless the decode doesn't depend on it
+    stale = Match_Image_Finder._alg_hashing_decode_stale
+    assert stale("big.jpg", res, fast=False, was_fast=True)
+    assert not stale("big.jpg", res, fast=True, was_fast=True)
+    assert stale("big.jpg", res_full, fast=True, was_fast=False)
+    assert not stale("big.png", res_full, fast=True, was_fast=False)
+
+def test_progress_without_decode_mode_is_full_decode(window, tmp_path, monkeypatch):
+    if not PERF_TEST.fast_decode_hash:
+        pytest.skip()
+    # Progress files written before the decode mode was stored were hashed with a full decode
+    root = tmp_path / "root"
+    root.mkdir()
+    entries = {"a.jpg": {"hash": 1, "mtime": 1.0, "size": 1}, "b.png": {"hash": 2, "mtime": 1.0, "size": 1}}
+    with open(root / Match_Image_Finder.PROGRESS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"hash_format": "v2", "stage": "done", "groups": [["a.jpg", "b.png"]], "phashes": entries}, f)
+    monkeypatch.setattr(window, "root_index_enabled", False)
+    monkeypatch.setattr(window, "hash_fast_decode", True)
+    window.work_folder = str(root)
+    window.root_cache.discard(str(root))
+    assert window._db_load_progress(str(root))
+    assert "a.jpg" not in window.phashes and window.phashes["b.png"]["hash"] == 2
+    assert window.stage == "hashing" and window.groups == []
+
+class _FakeRaw:
+    # Stand-in for rawpy: the embedded thumbnail of each RAW is picked by file name
+    class ThumbFormat:
+        JPEG, BITMAP = 1, 2
+
+    class LibRawNoThumbnailError(Exception):
+        pass
+
+    class LibRawUnsupportedThumbnailError(Exception):
+        pass
+
+    def __init__(self, images):
+        self.images = images
+        self.postprocessed = []
+
+    def imread(self, fp):
+        return _FakeRawFile(self, os.path.basename(getattr(fp, "name", fp)))
+
+class _FakeRawFile:
+    def __init__(self, rawpy, name):
+        self.rawpy, self.name = rawpy, name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_thumb(self):
+        img = self.rawpy.images[self.name]
+        if self.name.startswith("preview"):
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=90)
+            return SimpleNamespace(format=_FakeRaw.ThumbFormat.JPEG, data=buf.getvalue())
+        if self.name.startswith("bitmap"):
+            return SimpleNamespace(format=_FakeRaw.ThumbFormat.BITMAP, data=np.asarray(img))
+        raise _FakeRaw.LibRawNoThumbnailError(self.name)
+
+    def postprocess(self, **kwargs):
+        assert kwargs.get("half_size")
+        self.rawpy.postprocessed.append(self.name)
+        return np.asarray(self.rawpy.images[self.name])
+
+def test_raw_hash_decode_paths(tmp_path, monkeypatch):
+    if not PERF_TEST.raw_decode:
+        pytest.skip()
+    names = ["preview.nef", "bitmap.cr2", "half.dng"]
+    rng = np.random.default_rng(11)
+    images = {n: Image.fromarray(rng.integers(0, 255, (6, 8, 3)).astype(np.uint8)).resize((640, 480), Image.BICUBIC)
+              for n in names}
+    for n in names:
+        (tmp_path / n).write_bytes(b"raw")
+    fake = _FakeRaw(images)
+    monkeypatch.setattr(Match_Image_Finder, "rawpy", fake)
+
+    results = {n: _alg_hashing_api(str(tmp_path / n), False) for n in names}
+    assert [results[n]["decode"] for n in names] == ["raw_preview", "raw_bitmap", "raw_half"]
+    assert fake.postprocessed == ["half.dng"]
+    hashes = phash_from_tiles(phash_stack([results[n]["tile"] for n in names]))
+    assert all(hashes) and len(set(hashes)) == len(names)
+    # Same hash as decoding the picture itself
+    expected = phash_from_tiles(phash_stack([phash_tile(images[n]).tobytes() for n in names]))
+    assert [(h ^ e).bit_count() <= 4 for h, e in zip(hashes, expected)] == [True] * len(names)
+
+    # Only the JPEG preview can be decoded in draft mode
+    fast = {n: _alg_hashing_api(str(tmp_path / n), True)["decode"] for n in names}
+    assert fast == {"preview.nef": "raw_preview_draft", "bitmap.cr2": "raw_bitmap", "half.dng": "raw_half"}
+
+def _gen_corpus(count=200, seed=7):
+    # Smooth random images of various sizes and modes, some with noise
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        h, w = (int(v) for v in rng.integers(16, 480, 2))
+        small = rng.integers(0, 255, (int(rng.integers(2, 16)), int(rng.integers(2, 16)), 3)).astype(np.uint8)
+        img = Image.fromarray(small).resize((w, h), Image.BICUBIC)
+        if i % 3 == 0:
+            noisy = np.asarray(img).astype(np.int16) + rng.integers(-30, 30, (h, w, 3))
+            img = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+        if i % 5 == 0:
+            img = img.convert("RGBA")
+        if i % 7 == 0:
+            img = img.convert("L")
+        images.append(img)
+    return images
+
+def test_numpy_phash_matches_imagehash():
+    if not PERF_TEST.numpy_phash:
+        pytest.skip()
+    imagehash = pytest.importorskip("imagehash")
+    images = _gen_corpus()
+    expected = [int(str(imagehash.phash(img)), 16) for img in images]
+    got = phash_from_tiles(phash_stack([phash_tile(img).tobytes() for img in images]))
+    mismatched = [i for i, (a, b) in enumerate(zip(expected, got)) if a != b]
+    assert not mismatched, f"hash differs from imagehash.phash on images {mismatched}"
+
+def test_hash_registry_matches_imagehash(tmp_path):
+    if not PERF_TEST.hash_registry:
+        pytest.skip()
+    imagehash = pytest.importorskip("imagehash")
+    images = _gen_corpus(60)
+    reference = {
+        "phash": imagehash.phash,
+        "dhash": imagehash.dhash,
+        "ahash": imagehash.average_hash,
+        "whash": lambda img: imagehash.whash(img, image_scale=WHASH_SCALE),
+        "colorhash": lambda img: imagehash.colorhash(
+            img.convert("RGB").resize((COLORHASH_TILE, COLORHASH_TILE), Image.Resampling.LANCZOS)),
+    }
+    # Every algorithm from one decoded image
+    tiles = [hash_tiles(img, list(HASH_ALGOS)) for img in images]
+    for name, ref in reference.items():
+        expected = [int(str(ref(img)), 16) for img in images]
+        got = hashes_from_tiles(name, [t[name] for t in tiles])
+        mismatched = [k for k, (a, b) in enumerate(zip(expected, got)) if a != b]
+        assert not mismatched, f"{name} differs from imagehash on images {mismatched}"
+
+    # The worker returns the extra tiles of the same decode
+    path = tmp_path / "img.png"
+    images[1].save(path)
+    res = _alg_hashing_api(str(path), True, False, ("dhash", "colorhash"))
+    assert res["tile"] == _alg_hashing_api(str(path))["tile"]
+    assert sorted(res["tiles"]) == ["colorhash", "dhash"]
+
+    # Cascade: pairs found with the compare hash are dropped when a verification hash is too far apart
+    hashes = np.array([0, 1, 3, 7], dtype=np.uint64)
+    i, j = np.array([0, 1, 2]), np.array([1, 2, 3])
+    graph = PairGraph(["a", "b", "c", "d"], hashes, i, j, np.ones(3, dtype=np.uint8), np.ones(3, dtype=bool), 1)
+    assert graph.clusters(1) == [[0, 1, 2, 3]]
+    verify = np.array([0, 0, 0xFF, 0xFF], dtype=np.uint64)
+    assert graph.clusters(1, verify=[(verify, 4, None)]) == [[0, 1], [2, 3]]
+    assert graph.clusters(1, verify=[(verify, 8, None)]) == [[0, 1, 2, 3]]
+    # An item without the verification hash is not split off, hash 0 is no real hash
+    valid = np.array([True, True, False, True])
+    assert graph.clusters(1, verify=[(verify, 4, valid)]) == [[0, 1, 2, 3]]
+
+def test_colorhash_verify_drops_colour_mismatch():
+    if not PERF_TEST.verify_thresholds:
+        pytest.skip()
+    # One structure in red, a slightly different red and blue: close in pHash, apart in colour
+    rng = np.random.default_rng(3)
+    small = rng.integers(0, 255, (6, 6)).astype(np.uint8)
+    gray = 120 + np.asarray(Image.fromarray(small).resize((160, 120), Image.BICUBIC), dtype=np.float64) / 255 * 135
+    images = [Image.fromarray(np.stack([gray * r, gray * g, gray * b], axis=2).clip(0, 255).astype(np.uint8))
+              for r, g, b in ((1, .2, .2), (.95, .22, .18), (.2, .2, 1))]
+    tiles = [hash_tiles(img, ["phash", "colorhash"]) for img in images]
+    phashes = hashes_from_tiles("phash", [t["phash"] for t in tiles])
+    colors = np.array(hashes_from_tiles("colorhash", [t["colorhash"] for t in tiles]), dtype=np.uint64)
+
+    thresholds = _cfg_resolve_verify_thresholds(("dhash", "colorhash"), {"dhash": 6, "colorhash": None})
+    assert thresholds == {"dhash": 6, "colorhash": verify_threshold("colorhash")}
+    i, j = np.array([0, 0, 1]), np.array([1, 2, 2])
+    d = np.array([bin(phashes[a] ^ phashes[b]).count("1") for a, b in zip(i, j)], dtype=np.uint8)
+    graph = PairGraph(["red", "red2", "blue"], np.array(phashes, dtype=np.uint64), i, j, d, np.ones(3, dtype=bool), 8)
+    assert graph.clusters(8) == [[0, 1, 2]]
+    # The blue copy is split off by the colour hash at its own threshold, one shared 12 keeps it
+    assert graph.clusters(8, verify=[(colors, thresholds["colorhash"], None)]) == [[0, 1]]
+    assert graph.clusters(8, verify=[(colors, 12, None)]) == [[0, 1, 2]]
+
+def test_hash_cache_roundtrip_and_eviction(tmp_path):
+    if not PERF_TEST.hash_cache:
+        pytest.skip()
+    files = []
+    for i in range(3):
+        f = tmp_path / f"{i}.bin"
+        f.write_bytes(bytes([i]) * 10)
+        files.append(f)
+    keys = [HashCache.key(f.stat()) for f in files]
+
+    cache = HashCache("phash-test", str(tmp_path / "cache.sqlite3"), max_entries=2)
+    # High bit set, must survive SQLite's signed integers
+    cache.put_many([(keys[0], "d0", 0xF000000000000001, "full"), (keys[1], None, 2, "draft")])
+    assert cache.get(keys[0]) == (0xF000000000000001, "full")
+    # Unknown stat key, same content digest
+    assert cache.get(keys[2], "d0") == (0xF000000000000001, "full")
+    cache.close()
+
+    # Other algorithm tag never matches
+    other = HashCache("phash-other", str(tmp_path / "cache.sqlite3"))
+    assert other.get(keys[0]) is None
+    other.close()
+
+    # Modified file misses
+    cache = HashCache("phash-test", str(tmp_path / "cache.sqlite3"), max_entries=2)
+    files[1].write_bytes(b"changed!")
+    assert cache.get(HashCache.key(files[1].stat())) is None
+
+    # Least recently used entry is evicted
+    cache.db.execute("UPDATE hashes SET last_used=0 WHERE hash=2")
+    cache.put_many([(keys[2], None, 3, "full")])
+    cache.close()
+    cache = HashCache("phash-test", str(tmp_path / "cache.sqlite3"), max_entries=2)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    cache.close()
+
+def test_hashing_failure_is_reported_not_hashed(tmp_path):
+    if not PERF_TEST.hash_failures:
+        pytest.skip()
+    bad = tmp_path / "broken.jpg"
+    bad.write_bytes(b"not an image" * 10000)
+    res = _alg_hashing_api(str(bad))
+    assert res["tile"] is None
+    assert res["transient"] is False and res["attempts"] == 1
+    assert res["stat"].st_size == bad.stat().st_size
+
+def test_hashing_retries_transient_errors(tmp_path, monkeypatch):
+    if not PERF_TEST.hash_failures:
+        pytest.skip()
+    path = tmp_path / "ok.png"
+    Image.linear_gradient("L").save(path)
+    real = Match_Image_Finder._alg_hashing_phash
+    calls = []
+    failures = [Match_Image_Finder.HASH_RETRIES - 1]
+    def flaky(abs_path, fast=True):
+        calls.append(abs_path)
+        if len(calls) <= failures[0]:
+            raise OSError(errno.EIO, "Input/output error")
+        return real(abs_path, fast)
+    monkeypatch.setattr(Match_Image_Finder, "_alg_hashing_phash", flaky)
+    monkeypatch.setattr(Match_Image_Finder.time, "sleep", lambda s: None)
+    res = _alg_hashing_api(str(path))
+    assert res["tile"] is not None
+    assert len(calls) == Match_Image_Finder.HASH_RETRIES
+
+    # Still failing after the last attempt
+    calls.clear()
+    failures[0] = 99
+    res = _alg_hashing_api(str(path))
+    assert res["tile"] is None and res["transient"]
+    assert res["attempts"] == len(calls) == Match_Image_Finder.HASH_RETRIES
+
+def _gen_hashes(count=20000, seed=3):
+    # Random hashes plus near copies with up to 12 flipped bits
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 2**63, count // 2, dtype=np.uint64) * np.uint64(2)
+    flips = np.zeros(count // 2, dtype=np.uint64)
+    for _ in range(12):
+        flips |= np.uint64(1) << rng.integers(0, 64, count // 2).astype(np.uint64)
+    return np.concatenate([base, base ^ flips])
+
+def test_hamming_index_full_recall():
+    if not PERF_TEST.hamming_index:
+        pytest.skip()
+    hashes = _gen_hashes()
+    index = MultiIndexHash(hashes)
+    for radius in (0, 3, 7, 18):
+        for i in range(0, len(hashes), 97):
+            ids, dists = index.query(int(hashes[i]), radius)
+            brute = np.nonzero(popcount64(hashes ^ hashes[i]) <= radius)[0]
+            assert np.array_equal(ids, brute), f"radius {radius}, query {i}"
+            assert np.array_equal(dists, popcount64(hashes[ids] ^ hashes[i]))
+
+@pytest.mark.parametrize("probe_cost", [0, 10**9])
+def test_hamming_pairs_match_all_pairs(monkeypatch, probe_cost):
+    if not PERF_TEST.hamming_index:
+        pytest.skip()
+    # 0 forces the block-wise engine, a huge cost the brute force tiles
+    monkeypatch.setattr(hamming_index, "MIH_PROBE_COST", probe_cost)
+    hashes = _gen_hashes(3000)
+    hashes[100:140] = hashes[99]
+    dist = popcount64(hashes[:, None] ^ hashes[None, :])
+    index = MultiIndexHash(hashes)
+    for radius in (0, 7, 18):
+        got = []
+        for _, i, j, d in index.pairs(radius, tile_rows=333, max_candidates=1000):
+            assert np.array_equal(d, dist[i, j])
+            got.extend(zip(i.tolist(), j.tolist()))
+        ei, ej = np.nonzero(np.triu(dist <= radius, 1))
+        assert len(got) == len(set(got))
+        assert sorted(got) == sorted(zip(ei.tolist(), ej.tolist())), f"radius {radius}"
+
+def test_cluster_pairs_independent_of_edge_order():
+    if not PERF_TEST.union_find_clusters:
+        pytest.skip()
+    # Chain 0~1~2~3 (ends 3 bits apart), pair 5~6, 4 alone
+    hashes = np.array([0b0, 0b1, 0b11, 0b111, 0xF000, 0xFF0000, 0xFF0001], dtype=np.uint64)
+    i = np.array([0, 1, 2, 0, 5])
+    j = np.array([1, 2, 3, 2, 6])
+    d = popcount64(hashes[i] ^ hashes[j])
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        order = rng.permutation(len(i))
+        assert cluster_pairs(7, i[order], j[order], d[order]) == [[0, 1, 2, 3], [5, 6]]
+        # Capped at 2 bits, 3 can't join 0
+        assert cluster_pairs(7, i[order], j[order], d[order], hashes, 2) == [[0, 1, 2], [5, 6]]
+    # Transitive groups link at the tolerance, only the diameter cap allows a looser link
+    assert _alg_link_distance(6) == 6 and _alg_link_distance(6, capped=True) == 9
+
+def test_pair_graph_rethreshold_matches_fresh_search(tmp_path):
+    if not PERF_TEST.pair_graph:
+        pytest.skip()
+    hashes = np.sort(_gen_hashes(4000))
+    paths = [f"img_{k}.jpg" for k in range(len(hashes))]
+    sizes = np.arange(len(hashes)) % 3
+    index = MultiIndexHash(hashes)
+    i, j, d = (np.concatenate(a) for a in zip(*[step[1:] for step in index.pairs(13)]))
+    graph = PairGraph(paths, hashes, i, j, d, sizes[i] == sizes[j], 13)
+    graph.save(str(tmp_path / ".pairs.npz"))
+    graph = PairGraph.load(str(tmp_path / ".pairs.npz"))
+    assert graph.paths == paths and graph.radius == 13
+
+    for t_link in (0, 7, 13):
+        fi, fj, fd = (np.concatenate(a) for a in zip(*[step[1:] for step in index.pairs(t_link)]))
+        assert graph.clusters(t_link) == cluster_pairs(len(hashes), fi, fj, fd)
+        same = sizes[fi] == sizes[fj]
+        assert graph.clusters(t_link, same_size=True) == cluster_pairs(len(hashes), fi[same], fj[same], fd[same])
+
+    # Removed files drop out with their pairs, a changed hash needs a new search
+    keep = np.arange(len(hashes)) % 5 != 0
+    sub = graph.subset([p for p, k in zip(paths, keep) if k], hashes[keep])
+    fi, fj, fd = (np.concatenate(a) for a in zip(*[step[1:] for step in MultiIndexHash(hashes[keep]).pairs(7)]))
+    assert sub.clusters(7) == cluster_pairs(int(keep.sum()), fi, fj, fd)
+    changed = hashes.copy()
+    changed[1] ^= np.uint64(1)
+    assert graph.subset(paths, changed) is None
+
+def test_tile_similarity_drops_false_pairs(tmp_path):
+    if not PERF_TEST.tile_similarity:
+        pytest.skip()
+    images = _gen_corpus(40)
+    store = TileStore()
+    for k, img in enumerate(images):
+        store.put(f"img_{k}.jpg", phash_tile(img).tobytes())
+        # Brighter copy keeps the structure
+        lighter = np.clip(np.asarray(img.convert("L"), dtype=np.int16) + 20, 0, 255).astype(np.uint8)
+        store.put(f"copy_{k}.jpg", phash_tile(Image.fromarray(lighter)).tobytes())
+    store.save(str(tmp_path / ".tiles.npz"))
+    store = TileStore.load(str(tmp_path / ".tiles.npz"))
+    assert len(store) == 2 * len(images) and not store.dirty
+
+    paths = [f"img_{k}.jpg" for k in range(len(images))] + [f"copy_{k}.jpg" for k in range(len(images))] + ["none.jpg"]
+    tiles, found = store.stack(paths)
+    assert found.tolist() == [True] * (2 * len(images)) + [False]
+    n = len(images)
+    i, j = np.arange(n), np.arange(n) + n
+    for metric in ("ssim", "ncc"):
+        same = pair_similarity(tiles, found, i, i, metric)
+        assert np.allclose(same, 1.0, atol=1e-4), metric
+        copies = pair_similarity(tiles, found, i, j, metric)
+        others = pair_similarity(tiles, found, i[:-1], i[1:], metric)
+        assert np.median(copies) > 0.9 > np.median(others), metric
+    # No tile, no judgement
+    assert np.isnan(pair_similarity(tiles, found, np.array([0]), np.array([2 * n]))).all()
+
+    # Renamed and removed files follow the hashes
+    store.rename("img_0.jpg", "moved.jpg")
+    store.prune(set(paths[1:]) | {"moved.jpg"})
+    assert "moved.jpg" in store and "img_0.jpg" not in store and store.dirty
+
+    # Pairs failing the check don't link, the others do
+    graph = PairGraph(["a", "b", "c", "d"], np.zeros(4, dtype=np.uint64), np.array([0, 1, 2]), np.array([1, 2, 3]),
+                      np.ones(3, dtype=np.uint8), np.ones(3, dtype=bool), 1)
+    assert graph.clusters(1, check=lambda pos: pos != 1) == [[0, 1], [2, 3]]
+    assert graph.clusters(1, check=lambda pos: np.ones(len(pos), dtype=bool)) == [[0, 1, 2, 3]]
+
+def test_rotation_variants_match_rotated_images(monkeypatch):
+    if not PERF_TEST.rotation_invariant:
+        pytest.skip()
+    images = _gen_corpus(60)
+    tiles = np.stack([phash_tile(img) for img in images])
+    variants = phash_variants_from_tiles(tiles)
+    # Every column is the pHash of the rotated / mirrored tile
+    for v in range(variants.shape[1]):
+        turned = np.rot90(tiles[:, :, ::-1] if v >= 4 else tiles, v % 4, axes=(1, 2))
+        assert variants[:, v].tolist() == phash_from_tiles(turned), f"variant {v}"
+
+    # Rotated and mirrored copies are close, other images are not
+    rotated = [img.transpose(op) for img, op in zip(images, [Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_180,
+                                                              Image.Transpose.ROTATE_270, Image.Transpose.TRANSPOSE] * 15)]
+    copies = phash_variants_from_tiles(np.stack([phash_tile(img) for img in rotated]))
+    assert popcount64(variants[:, 0] ^ copies[:, 0]).mean() > 20
+    assert variant_distance(variants, copies).diagonal().max() <= 8
+    others = variant_distance(variants, variants)
+    np.fill_diagonal(others, 64)
+    assert others.min() > 8
+
+    # Index of variants finds the same pairs as comparing every pair, with both search strategies and
+    # searched in shards of rows
+    items = np.concatenate([variants, copies])
+    dist = variant_distance(items, items)
+    expected = sorted((a, b, int(dist[a, b])) for a, b in zip(*np.nonzero(np.triu(dist <= 8, 1))))
+    assert len(expected) >= len(images)
+    for probe_cost in (0, 10**9):
+        monkeypatch.setattr(hamming_index, "MIH_PROBE_COST", probe_cost)
+        index = VariantIndex(items)
+        found = [index.pairs_rows(8, start, start + 25) for start in range(0, len(items), 25)]
+        i, j, d = min_pairs(*(np.concatenate(a) for a in zip(*found)))
+        assert list(zip(i.tolist(), j.tolist(), d.tolist())) == expected
+        ids, d = index.query_row(70, 8)
+        assert ids.tolist() == np.flatnonzero(dist[70] <= 8).tolist() and d.tolist() == dist[70, ids].tolist()
+
+def test_root_index_writes_changed_rows_only(tmp_path):
+    if not PERF_TEST.root_index:
+        pytest.skip()
+    paths = [f"d{k // 50}/img_{k}.jpg" for k in range(500)]
+    phashes = {p: {"hash": (k * 0x9E3779B97F4A7C15) % (1 << 64), "mtime": 1.0, "size": k} for k, p in enumerate(paths)}
+    groups = [[paths[k], paths[k + 1]] for k in range(0, 100, 2)]
+    index = RootIndex(str(tmp_path))
+    assert not index.initialized and index.load_progress() is None and index.load_filelist() is None
+    phashes = index.save_progress({"stage": "done", "groups": groups, "exact_groups": [], "phashes": phashes})
+    index.save_filelist({"last_scan_time": "now", "image_paths": paths})
+    assert isinstance(phashes, HashEntries) and index.initialized
+
+    # One deleted file is a handful of rows, not the whole root
+    before = index.db.total_changes
+    del phashes[paths[3]]
+    paths = paths[:3] + paths[4:]
+    groups = groups[:1] + groups[2:]
+    phashes = index.save_progress({"stage": "done", "groups": groups, "exact_groups": [], "phashes": phashes})
+    index.save_filelist({"last_scan_time": "now", "image_paths": paths})
+    assert index.db.total_changes - before < len(groups) + 5
+    # Renamed in place and appended files
+    paths[10], paths = "renamed.jpg", paths + ["new.jpg"]
+    before = index.db.total_changes
+    index.save_filelist({"last_scan_time": "later", "image_paths": paths})
+    assert index.db.total_changes - before <= 3
+    index.close()
+
+    index = RootIndex(str(tmp_path))
+    progress = index.load_progress()
+    assert progress["stage"] == "done" and progress["groups"] == groups
+    assert dict(progress["phashes"]) == dict(phashes) and paths[3] in progress["phashes"] and len(progress["phashes"]) == 499
+    assert index.load_filelist() == {"last_scan_time": "later", "image_paths": paths}
+    # A plain dict replaces all hashes
+    index.save_progress({"stage": "hashing", "groups": [], "exact_groups": [], "phashes": {"a.jpg": {"hash": 1 << 63}}})
+    loaded = index.load_progress()["phashes"]
+    assert dict(loaded) == {"a.jpg": {"hash": 1 << 63}}
+    # Loaded again from memory while unchanged, from the rows after unsaved changes or a write of another connection
+    assert index.load_progress()["phashes"] is loaded
+    loaded["b.jpg"] = {"hash": 2}
+    assert dict(index.load_progress()["phashes"]) == {"a.jpg": {"hash": 1 << 63}}
+    other = RootIndex(str(tmp_path))
+    other.save_progress({"stage": "done", "groups": [["a.jpg"]], "exact_groups": [], "phashes": {"c.jpg": {"hash": 3}}})
+    other.close()
+    progress = index.load_progress()
+    assert dict(progress["phashes"]) == {"c.jpg": {"hash": 3}} and progress["groups"] == [["a.jpg"]]
+
+    # Constraints load and save through the index
+    constraints = ConstraintsStore(str(tmp_path), index=index)
+    constraints.add_must_link(["b.jpg", "a.jpg"])
+    constraints.add_ignore_files(["C.jpg"])
+    constraints.save_constraints()
+    assert not (tmp_path / ".constraints.json").exists()
+    constraints = ConstraintsStore(str(tmp_path), index=index)
+    assert constraints.must_pairs == {("a.jpg", "b.jpg")} and constraints.ignored_files == {"c.jpg"}
+    constraints.remove_ignore_files(["c.jpg"])
+    before = index.db.total_changes
+    constraints.save_constraints()
+    assert index.db.total_changes - before == 1
+    assert ConstraintsStore(str(tmp_path), index=index).ignored_files == set()
+    index.close()
+
+def test_hash_entries_are_columns(tmp_path):
+    if not PERF_TEST.hash_table:
+        pytest.skip()
+    entries = {f"d/img_{k}.jpg": {"hash": (k * 0x9E3779B97F4A7C15) % (1 << 64), "mtime": k / 2, "size": k, "decode": "draft"}
+               for k in range(200)}
+    entries["d/same.jpg"] = dict(entries["d/img_7.jpg"], size=-5, hashes={"dhash": 9}, variants=[1, 2, 3, 4, 5, 6, 7])
+    entries["d/odd.jpg"] = {"hash": 5, "mtime": 1.0, "decode": "other"}
+    entries["v1.jpg"] = 11
+    entries["später.jpg"] = {"hash": None, "mtime": 1.0, "size": 3, "deferred": True}
+    entries["broken.jpg"] = {"hash": None, "mtime": 1.0, "size": 4, "failed": "truncated", "attempts": 2}
+    phashes = HashEntries(entries)
+    assert dict(phashes) == entries and list(phashes) == list(entries) and not phashes.changed
+    # Only the fields the columns can't hold are kept per row
+    assert phashes.extra("d/img_3.jpg") == {} and phashes.extra("d/same.jpg")["hashes"] == {"dhash": 9}
+    assert len(phashes._extra) == 5
+
+    table = phashes.table({"sparse": phashes.sparse()})
+    table.save(str(tmp_path / ".hashes.bin"))
+    mapped = HashTable.load(str(tmp_path / ".hashes.bin"))
+    assert isinstance(mapped.hash, np.memmap) and mapped.paths == list(entries)
+    assert len(mapped.meta["sparse"]) < len(entries) and dict(HashEntries.from_table(mapped, mapped.meta["sparse"])) == entries
+    for name in ("hash", "size", "mtime", "status", "decode"):
+        assert np.array_equal(getattr(mapped, name), getattr(table, name), equal_nan=name == "mtime"), name
+    assert mapped.status[-2:].tolist() == [STATUS_DEFERRED, STATUS_FAILED] and (mapped.status[:-2] == STATUS_HASHED).all()
+    # Loaded from the columns, the entries only give the sparse fields
+    loaded = HashEntries.from_table(mapped, {p: {"hash": 0, **e} if isinstance(e, dict) else e for p, e in entries.items()})
+    assert dict(loaded) == entries
+
+    # Hashed rows by hash like the sorted (path, hash) list compare used
+    hashed = {p: e if isinstance(e, int) else e["hash"] for p, e in entries.items()}
+    items = sorted(((p, h) for p, h in hashed.items() if h is not None), key=lambda x: x[1])
+    order = mapped.hashed_order()
+    assert [mapped.paths[k] for k in order] == [p for p, _ in items]
+    assert mapped.hash[order].tolist() == [h for _, h in items]
+
+    # Writes after the table was taken don't change it, removed rows leave it once taken again
+    phashes["d/img_0.jpg"] = {"hash": 1, "mtime": 2.0, "size": 3}
+    assert table.hash[0] == 0 and phashes.changed == {"d/img_0.jpg"}
+    for k in range(1, 150):
+        del phashes[f"d/img_{k}.jpg"]
+    phashes["new.jpg"] = {"hash": 7, "mtime": 1.0, "size": 1}
+    again = phashes.table()
+    assert again.paths == list(phashes) and again.hash[0] == 1 and again.hash[-1] == 7
+    expected = {p: e for p, e in entries.items() if p not in {f"d/img_{k}.jpg" for k in range(1, 150)}}
+    expected["d/img_0.jpg"] = {"hash": 1, "mtime": 2.0, "size": 3}
+    expected["new.jpg"] = {"hash": 7, "mtime": 1.0, "size": 1}
+    assert dict(phashes) == expected
+
+    # Any change to the entries shows in the version, a copy doesn't see later changes
+    copy = phashes.copy()
+    version = phashes.version
+    phashes.pop("missing.jpg", None)
+    assert phashes.version == version
+    del phashes["broken.jpg"]
+    phashes["new.jpg"] = {"hash": 8, "mtime": 1.0, "size": 1}
+    assert phashes.version > version and "broken.jpg" in copy and copy["new.jpg"]["hash"] == 7
+    with pytest.raises(ValueError):
+        (tmp_path / "bad.bin").write_bytes(b"nope" * 20)
+        HashTable.load(str(tmp_path / "bad.bin"))
+
+def test_progress_loads_hash_columns_from_table(window, tmp_path, monkeypatch):
+    if not PERF_TEST.hash_table:
+        pytest.skip()
+    root = tmp_path / "root"
+    root.mkdir()
+    entries = {f"img_{k}.jpg": {"hash": k * 977, "mtime": 1.5, "size": k, "decode": "draft"} for k in range(50)}
+    entries["img_7.jpg"]["hashes"] = {"dhash": 3}
+    entries["bad.jpg"] = {"hash": None, "mtime": 1.0, "size": 2, "failed": "truncated", "attempts": 1}
+    monkeypatch.setattr(window, "root_index_enabled", False)
+    window.work_folder = str(root)
+    window.phashes = HashEntries(entries)
+    window.stage = "done"
+    window._db_save_progress(str(root))
+    flush_writes()
+    # The JSON file keeps every entry, the table file the columns, the sparse fields and the rest of the same save
+    progress_file = root / Match_Image_Finder.PROGRESS_FILE
+    with open(progress_file, encoding="utf-8") as f:
+        data = json.load(f)
+    table = HashTable.load(str(root / ".hashes.bin"))
+    assert data["phashes"] == entries and table.meta["progress"] == {k: v for k, v in data.items() if k != "phashes"}
+    assert set(table.meta["sparse"]) == {"img_7.jpg", "bad.jpg"}
+
+    # Opening the root reads the table, the JSON file isn't parsed
+    def _parse(*args, **kwargs):
+        raise AssertionError("progress file parsed")
+    window.root_cache.discard(str(root))
+    window.phashes, window.stage = HashEntries(), "init"
+    with monkeypatch.context() as m:
+        m.setattr(json, "load", _parse)
+        assert window._db_load_progress(str(root))
+    assert dict(window.phashes) == entries and window.stage == "done"
+
+    # A progress file written without the table (another build) is read from the JSON file
+    data["phashes"]["new.jpg"] = {"hash": 1, "mtime": 2.0, "size": 3}
+    with open(progress_file, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    window.root_cache.discard(str(root))
+    assert window._db_load_progress(str(root))
+    assert window.phashes["new.jpg"] == {"hash": 1, "mtime": 2.0, "size": 3} and len(window.phashes) == len(entries) + 1
+
+def test_hash_journal_replays_unsaved_hashes(tmp_path):
+    if not PERF_TEST.hash_journal:
+        pytest.skip()
+    root = str(tmp_path)
+    phashes = HashEntries({"old.jpg": {"hash": 1, "size": 1}})
+    journal = HashJournal(root, fsync_interval=0)
+    journal.open(0)
+    phashes.journal = journal
+    phashes["a.jpg"] = {"hash": 2, "size": 2}
+    phashes["b.jpg"] = {"hash": 3, "size": 3}
+    phashes["b.jpg"] = {"hash": 3, "size": 30}   # logged as it is at write time
+    del phashes["old.jpg"]
+    journal.write(phashes)
+    assert dict(HashJournal.replay(root, 0)) == {"a.jpg": {"hash": 2, "size": 2}, "b.jpg": {"hash": 3, "size": 30}, "old.jpg": None}
+    # Only the log of the progress data's generation counts
+    assert HashJournal.replay(root, 1) == []
+
+    # Checkpoint: the new generation's log follows, the old one stays until its progress data is written
+    generation = journal.rotate()
+    phashes["c.jpg"] = {"hash": 4, "size": 4}
+    journal.write(phashes)
+    assert sorted(k for k, _ in HashJournal.replay(root, 0)) == ["a.jpg", "b.jpg", "c.jpg", "old.jpg"]
+    assert HashJournal.replay(root, generation) == [("c.jpg", {"hash": 4, "size": 4})]
+    # A torn line from a crash is skipped
+    journal.close()
+    with open(tmp_path / JOURNAL_FILE, "ab") as f:
+        f.write(b'{"p": "d.jpg", "e": {"ha')
+    assert HashJournal.replay(root, generation) == [("c.jpg", {"hash": 4, "size": 4})]
+
+    # Reopened for the old generation (checkpoint not written), both logs continue as one
+    journal = HashJournal(root, fsync_interval=0)
+    journal.open(0)
+    journal.add("e.jpg")
+    journal.write({"e.jpg": {"hash": 5}}, sync=True)
+    assert HashJournal.replay(root, 0)[-2:] == [("c.jpg", {"hash": 4, "size": 4}), ("e.jpg", {"hash": 5})]
+    journal.rotate()
+    journal.drop_prev()
+    journal.close(remove=True)
+    assert not any(p.name.startswith(JOURNAL_FILE) for p in tmp_path.iterdir())
+
+def test_json_writer_coalesces_saves(tmp_path):
+    if not PERF_TEST.json_writer:
+        pytest.skip()
+    writer = JsonWriter()
+    release = threading.Event()
+    built = []
+
+    def _blocked():
+        release.wait(5)
+        return {"first": True}
+
+    def _data(n):
+        def _build():
+            built.append(n)
+            return {"n": n, "paths": ["a.jpg", "b.jpg"]}
+        return _build
+
+    # The thread is busy with the first file while the other is saved three times
+    first = writer.submit(str(tmp_path / "first.json"), _blocked)
+    futures = [writer.submit(str(tmp_path / "state.json"), _data(n)) for n in range(3)]
+    assert writer.busy and not (tmp_path / "state.json").exists()
+    # A root saved the first time is found while its progress file is queued, nothing waits for the writer
+    (tmp_path / "root").mkdir()
+    progress = writer.submit(str(tmp_path / "root" / Match_Image_Finder.PROGRESS_FILE), {"stage": "init"})
+    assert write_pending(str(tmp_path / "state.json")) and writer.busy
+    assert Match_Image_Finder._path_find_progress_root(str(tmp_path / "root" / "a.jpg")) == str(tmp_path / "root")
+    release.set()
+    writer.flush(str(tmp_path / "state.json"))
+    assert built == [2]
+    assert first.result() and all(f.result() for f in futures) and progress.result()
+    assert not write_pending(str(tmp_path / "state.json"))
+    assert (tmp_path / "state.json").read_text(encoding="utf-8") == '{"n":2,"paths":["a.jpg","b.jpg"]}'
+
+    # A failed write reports False and leaves the old file
+    failed = writer.submit(str(tmp_path / "missing" / "state.json"), {"n": 3})
+    writer.flush()
+    assert failed.result() is False and not writer.busy
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["first.json", "root", "state.json"]
+
+    # Other forms go through a write function, queued after the writes before them
+    removed = writer.submit(str(tmp_path / "first.json"), None, Match_Image_Finder._db_remove_file)
+    writer.flush()
+    assert removed.result() and not (tmp_path / "first.json").exists()
+
+def test_root_cache_serves_unchanged_files(tmp_path):
+    if not PERF_TEST.root_cache:
+        pytest.skip()
+    cache = RootCache(limit=2)
+    root = str(tmp_path)
+    file = tmp_path / "state.json"
+    file.write_text('{"n":1}', encoding="utf-8")
+    cache.put(root, "state", {"n": 1}, file_stamp(file))
+    assert cache.get(root, "state", file) == {"n": 1}
+    # Written by someone else
+    file.write_text('{"n":22}', encoding="utf-8")
+    assert cache.get(root, "state", file) is None
+
+    # Saved data counts while its write runs, an older write doesn't stamp it
+    first = cache.put(root, "state", {"n": 3})
+    second = cache.put(root, "state", {"n": 4})
+    cache.written(root, "state", first, file)
+    assert cache.get(root, "state", file) == {"n": 4}
+    file.write_text('{"n":4}', encoding="utf-8")
+    cache.written(root, "state", second, file)
+    assert cache.get(root, "state", file) == {"n": 4}
+    file.write_text('{"n":5}', encoding="utf-8")
+    assert cache.get(root, "state", file) is None
+
+    # Deferred saves are dirty until taken, once
+    with cache.defer():
+        version = cache.put(root, "state", {"n": 6})
+        assert cache.put("other", "state", {"n": 1}, defer=False) == 1
+    assert cache.take_dirty(root) == {"state": ({"n": 6}, version)}
+    assert cache.take_dirty(root) == {} and cache.take_dirty("other") == {}
+
+    # Clean roots used least recently are dropped, dirty ones stay
+    with cache.defer():
+        cache.put("dirty", "state", {"n": 7})
+    cache.put("a", "state", {}, (0, -1))
+    cache.put("b", "state", {}, (0, -1))
+    assert cache.get("dirty", "state", "missing") == {"n": 7}
+    assert cache.get(root, "state", file) is None and cache.get("other", "state", file) is None
+    assert cache.get("b", "state", "missing") == {}
+
+    # A deleted folder drops the roots inside it, dirty or not
+    cache = RootCache(limit=2)
+    sub = str(tmp_path / "sub")
+    with cache.defer():
+        cache.put(sub, "state", {"n": 8})
+    cache.put(root + "x", "state", {}, (0, -1))
+    cache.discard(root)
+    assert cache.get(sub, "state", "missing") is None and cache.take_dirty(sub) == {}
+    assert cache.get(root + "x", "state", "missing") == {}
+
+def test_incremental_compare_matches_full_compare(window, qtbot, tmp_path, monkeypatch):
+    if not PERF_TEST.incremental_compare:
+        pytest.skip()
+    # 300 files, every other one of the first 200 has a copy 1 bit away
+    rng = np.random.default_rng(5)
+    base = rng.integers(0, 2**63, 200, dtype=np.uint64) * np.uint64(2)
+    hashes = np.concatenate([base, base[::2] ^ np.uint64(1 << 20)])
+    paths = [f"img_{k:03d}.jpg" for k in range(len(hashes))]
+    root = tmp_path / "root"
+    root.mkdir()
+    monkeypatch.setattr(window, "_overview_show_api", lambda: None)
+
+    def _compare():
+        window._alg_comparing_api()
+        qtbot.waitUntil(lambda: window.stage_job is None, timeout=10000)
+        assert window.stage == "done"
+        return [g[:] for g in window.groups]
+
+    window.work_folder = str(root)
+    window.image_paths = list(paths)
+    window.phashes = {p: {"hash": int(h), "mtime": 1.0, "size": 100} for p, h in zip(paths, hashes)}
+    window.constraints = ConstraintsStore(scan_folder=str(root))
+    before = _compare()
+    assert len(before) == 100
+    window.constraints.add_cannot_link(paths[1], paths[3])
+    window.constraints.save_constraints()
+    cannot_pairs = set(window.constraints.cannot_pairs)
+    assert cannot_pairs
+    window.current = 7
+
+    # One file joins the group of img_002, another one matches nothing
+    joined = "img_new.jpg"
+    window._db_update(str(root), [{"act": "add", "new_rel": joined, "new_abs": str(root / joined)},
+                                  {"act": "add", "new_rel": "img_alone.jpg", "new_abs": str(root / "img_alone.jpg")}])
+    assert window.stage == "hashing" and window.compare_incremental
+    window.phashes[joined] = {"hash": int(hashes[2] ^ np.uint64(1 << 40)), "mtime": 1.0, "size": 100}
+    window.phashes["img_alone.jpg"] = {"hash": int(~hashes[2] & np.uint64(2**64 - 1)), "mtime": 1.0, "size": 100}
+    merged = []
+    merge = window._alg_comparing_incremental_done
+    monkeypatch.setattr(window, "_alg_comparing_incremental_done", lambda job, *args: merged.append(len(job.rows)) or merge(job, *args))
+    incremental = _compare()
+    assert merged == [2], "only the added files are searched"
+
+    touched = [g for g in incremental if joined in g]
+    assert len(touched) == 1 and sorted(touched[0]) == sorted(["img_002.jpg", "img_201.jpg", joined])
+    untouched = [g for g in before if "img_002.jpg" not in g]
+    assert [g for g in incremental if joined not in g] == untouched
+    assert window.current == 7
+    assert window.constraints.cannot_pairs == cannot_pairs == ConstraintsStore(scan_folder=str(root)).cannot_pairs
+
+    # Same groups as comparing every file again without the stored pair graph
+    flush_writes()
+    os.remove(root / PAIRS_FILE)
+    window.compare_graph = None
+    window.compare_clusters_cache = None
+    window.compare_incremental = False
+    window.compare_index = 0
+    window.groups = []
+    window.stage = "comparing"
+    full = _compare()
+    assert sorted(map(sorted, incremental)) == sorted(map(sorted, full))
+
+def test_exact_group_joins_perceptual_group(window, qtbot, tmp_path, monkeypatch):
+    if not PERF_TEST.exact_duplicates:
+        pytest.skip()
+    # a.jpg/a_copy.jpg and c.png/c_copy.png are byte-identical, b.jpg a resized copy of a.jpg
+    a, c = 0x0123456789ABCDEF, 0xFEDCBA9876543210
+    hashes = {"a.jpg": a, "a_copy.jpg": a, "b.jpg": a ^ 0b11, "c.png": c, "c_copy.png": c, "d.jpg": a ^ (0xFFFF << 32)}
+    root = tmp_path / "root"
+    root.mkdir()
+    monkeypatch.setattr(window, "_overview_show_api", lambda: None)
+    monkeypatch.setattr(window, "compare_file_size", False)
+
+    def _compare():
+        window._alg_comparing_api()
+        qtbot.waitUntil(lambda: window.stage_job is None, timeout=10000)
+        assert window.stage == "done"
+        return sorted(map(sorted, window.groups))
+
+    window.work_folder = str(root)
+    window.image_paths = list(hashes)
+    window.phashes = {p: {"hash": h, "mtime": 1.0, "size": 100 + len(p)} for p, h in hashes.items()}
+    window.exact_groups = [["a.jpg", "a_copy.jpg"], ["c.png", "c_copy.png"]]
+    window.constraints = ConstraintsStore(scan_folder=str(root))
+    groups = [["a.jpg", "a_copy.jpg", "b.jpg"], ["c.png", "c_copy.png"]]
+    assert _compare() == groups
+    assert window._alg_comparing_preview_groups(window.similarity_tolerance, False) == 2
+
+    # A new resized copy of c.png joins its exact group
+    window._db_update(str(root), [{"act": "add", "new_rel": "c_small.jpg", "new_abs": str(root / "c_small.jpg")}])
+    window.phashes["c_small.jpg"] = {"hash": c ^ 0b1, "mtime": 1.0, "size": 50}
+    assert _compare() == [groups[0], ["c.png", "c_copy.png", "c_small.jpg"]]
+
+    # Capped at the tolerance the exact copies join their first file's cluster as well
+    graph = window.compare_graph
+    exact = window._alg_comparing_exact(graph.paths)
+    clusters = graph.clusters(2, exact=exact, max_diameter=2)
+    assert sorted(sorted(graph.paths[k] for k in g) for g in clusters) == [groups[0], ["c.png", "c_copy.png", "c_small.jpg"]]
+
+def test_sharded_compare_matches_single_search(tmp_path):
+    if not PERF_TEST.sharded_compare:
+        pytest.skip()
+    hashes = np.sort(_gen_hashes(6000))
+    radius = 11
+    expected = MultiIndexHash(hashes).pairs_rows(radius, 0, len(hashes))
+    # Rows 1000-2500 were searched before a pause
+    searched = np.zeros(len(hashes), dtype=bool)
+    searched[1000:2500] = True
+    shards = Match_Image_Finder._alg_comparing_shards(searched, 700)
+    assert shards[0] == (0, 700) and shards[1] == (700, 1000) and shards[2] == (2500, 3200)
+    assert sum(stop - start for start, stop in shards) == len(hashes) - 1500
+
+    shm = shared_memory.SharedMemory(create=True, size=hashes.nbytes)
+    try:
+        np.ndarray(hashes.shape, dtype=np.uint64, buffer=shm.buf)[:] = hashes
+        with ProcessPoolExecutor(2, initializer=Match_Image_Finder._alg_comparing_shard_init,
+                                 initargs=(shm.name, len(hashes))) as exe:
+            found = list(exe.map(Match_Image_Finder._alg_comparing_shard, *zip(*[(radius, *s) for s in shards])))
+    finally:
+        shm.close()
+        shm.unlink()
+    found.append(MultiIndexHash(hashes).pairs_rows(radius, 1000, 2500))
+    got = sorted(zip(*(np.concatenate(a).tolist() for a in zip(*found))))
+    assert got == sorted(zip(*(a.tolist() for a in expected)))
+
+    # A checkpoint keeps the searched rows
+    sizes = np.zeros(len(hashes))
+    i, j, d = expected
+    graph = PairGraph([str(k) for k in range(len(hashes))], hashes, i, j, d, sizes[i] == sizes[j], radius, searched)
+    graph.save(str(tmp_path / ".pairs.npz"))
+    loaded = PairGraph.load(str(tmp_path / ".pairs.npz"))
+    assert not loaded.complete and np.array_equal(loaded.searched, searched)
+
+def test_shard_worker_leaves_segment_to_owner():
+    if not PERF_TEST.sharded_compare:
+        pytest.skip()
+    hashes = np.sort(_gen_hashes(1000))
+    shm = shared_memory.SharedMemory(create=True, size=hashes.nbytes)
+    try:
+        np.ndarray(hashes.shape, dtype=np.uint64, buffer=shm.buf)[:] = hashes
+        # A worker outside this process tree runs its own resource tracker
+        code = ("import Match_Image_Finder as m; "
+                f"m._alg_comparing_shard_init({shm.name!r}, {hashes.shape!r}); "
+                "print(len(m._alg_comparing_shard(11, 0, 1000)[0]))")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        proc = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, timeout=120,
+                              env={**os.environ, "QT_QPA_PLATFORM": "offscreen"})
+        assert proc.returncode == 0, proc.stderr
+        assert "leaked" not in proc.stderr
+        # Still there for the main process
+        again = shared_memory.SharedMemory(name=shm.name)
+        assert np.array_equal(np.ndarray(hashes.shape, dtype=np.uint64, buffer=again.buf), hashes)
+        again.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+class _CountJob(Job):
+    def __init__(self, steps, log):
+        super().__init__()
+        self.steps = steps
+        self.log = log
+
+    def run(self, token):
+        for k in range(self.steps):
+            if token.cancelled:
+                return "cancelled"
+            self.log.append((id(self), k))
+            self.progress.emit(k + 1, self.steps)
+        return "done"
+
+def test_job_runner_queues_and_cancels(qapp, qtbot):
+    if not PERF_TEST.job_runner:
+        pytest.skip()
+    runner = JobRunner()
+    log, seen, finished = [], [], []
+    first = _CountJob(200, log)
+    first.progress.connect(lambda done, total: seen.append(done))
+    first.finished.connect(lambda: finished.append(list(seen)))
+    second = runner.submit(_CountJob(50, log))
+    runner.submit(first)
+    qtbot.waitUntil(lambda: bool(finished), timeout=10000)
+    assert first.result == "done" and second.done
+    # Queued jobs run one after the other, signals arrive on the GUI thread in order, all before finished
+    assert [k for j, k in log if j == id(first)] == list(range(200))
+    assert log.index((id(first), 0)) > log.index((id(second), 49))
+    assert finished == [list(range(1, 201))]
+
+    # Cancel once the long job reports, the job queued behind it never starts
+    third = _CountJob(10**9, [])
+    third.progress.connect(lambda done, total: runner.cancel())
+    runner.submit(third)
+    queued = runner.submit(_CountJob(5, []))
+    qtbot.waitUntil(lambda: not runner.busy, timeout=10000)
+    assert third.result == "cancelled" and queued.result is None
+
+    # A job made from a function, its status text is built from what it reports
+    texts = []
+    def _work(token):
+        for k in range(3):
+            job.report(k + 1, 3, path=f"img_{k}.jpg")
+        return "ok"
+    job = Job(_work, status_text=lambda done, total, path: f"{done}/{total} {path}")
+    job.status.connect(texts.append)
+    runner.submit(job)
+    qtbot.waitUntil(lambda: job.done, timeout=10000)
+    qtbot.waitUntil(lambda: len(texts) == 3, timeout=2000)
+    assert job.result == "ok" and texts[-1] == "3/3 img_2.jpg"
+    # Neither a function nor run() overridden, the job does nothing
+    assert Job().run(CancelToken()) is None
+    runner.shutdown()
+
+def test_stage_settings_wait_for_stage_job(window, monkeypatch):
+    if not PERF_TEST.job_runner:
+        pytest.skip()
+    tolerance = window.similarity_tolerance
+    window.cfg.set("behavior.similarity_tolerance", tolerance + 1, autosave=False)
+    try:
+        job = Job()
+        window.stage_job = job
+        window._cfg_apply_settings(["behavior.similarity_tolerance", "behavior.display_same_images"])
+        assert window.similarity_tolerance == tolerance and window.settings_deferred == ["behavior.similarity_tolerance"]
+        # Applied once the job is done
+        window._job_done(job, lambda job: None)
+        assert window.similarity_tolerance == tolerance + 1 and window.settings_deferred == []
+    finally:
+        window.stage_job = None
+        window.cfg.set("behavior.similarity_tolerance", tolerance, autosave=False)
+        window.similarity_tolerance = tolerance
+
+def test_scan_job_checks_hash_entries(tmp_path):
+    if not PERF_TEST.job_runner:
+        pytest.skip()
+    # Files below 50 kB aren't scanned
+    for name in ("same.jpg", "changed.jpg", "new.jpg"):
+        (tmp_path / name).write_bytes(b"x" * 60000)
+    st = {name: os.stat(tmp_path / name) for name in ("same.jpg", "changed.jpg")}
+    phashes = HashEntries({
+        "same.jpg": {"hash": 1, "mtime": st["same.jpg"].st_mtime, "size": 60000},
+        "changed.jpg": {"hash": 2, "mtime": st["changed.jpg"].st_mtime - 10, "size": 60000},
+        "gone.jpg": {"hash": 3, "mtime": 1.0, "size": 60000},
+    })
+    paths, stats, gone, changed = Match_Image_Finder.ScanJob(str(tmp_path), set(), table=phashes.table()).run(CancelToken())
+    assert sorted(paths) == ["changed.jpg", "new.jpg", "same.jpg"] and set(stats) == set(paths)
+    assert gone == ["gone.jpg"] and changed == ["changed.jpg"]
+    assert Match_Image_Finder.ScanJob(str(tmp_path), set()).run(CancelToken())[2:] == ([], [])
+
+class _BatchJob(Job):
+    batch = pyqtSignal(list)
+
+    def run(self, token):
+        self.batch.emit(["a.jpg", "b.jpg"])
+        return True
+
+def test_exit_keeps_results_sent_before_the_job_stopped(window, monkeypatch):
+    if not PERF_TEST.job_runner:
+        pytest.skip()
+    stored = []
+    job = _BatchJob()
+    job.batch.connect(stored.extend)
+    window._job_start(job, lambda job: None)
+    # The job is done but nothing it sent was delivered yet
+    deadline = time.time() + 10
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    assert job.done and not stored
+    with monkeypatch.context() as m:
+        m.setattr(QApplication, "quit", lambda *args: None)
+        window._btn_action_exit_and_save()
+    assert stored == ["a.jpg", "b.jpg"] and window.stage_job is None
@@ -0,0 +1,126 @@
+import os, sys, time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Cumulative (busy, total) CPU time of the system, None if not available on this platform.
+# I/O wait counts as idle, a worker waiting for the disk leaves the CPU free.
+def system_cpu_times():
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/stat", "r", encoding="ascii") as f:
+                fields = [int(v) for v in f.readline().split()[1:9]]
+            total = sum(fields)
+            return total - fields[3] - fields[4], total
+        if sys.platform == "win32":
+            import ctypes
+            idle, kernel, user = (ctypes.c_ulonglong() for _ in range(3))
+            if not ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            # Kernel time includes idle time
+            total = kernel.value + user.value
+            return total - idle.value, total
+        if psutil is not None:
+            t = psutil.cpu_times()
+            total = sum(t)
+            return total - t.idle - getattr(t, "iowait", 0), total
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+class CpuMeter:
+    # System CPU utilisation in 0..1 over the time since the last call (or since it was created),
+    # so each autoscaler window measures its own run. None when it can't be measured, reported once.
+    def __init__(self, reader=system_cpu_times):
+        self._reader = reader
+        self._last = reader()
+        self._reported = False
+
+    def __call__(self):
+        now = self._reader()
+        last, self._last = self._last, now
+        if now is None or last is None:
+            if not self._reported:
+                self._reported = True
+                print("[Info] CPU utilisation not available, hashing workers are scaled by throughput only")
+            return None
+        total = now[1] - last[1]
+        if total <= 0:
+            return None
+        return max(0.0, min(1.0, (now[0] - last[0]) / total))
+
+class WorkerAutoscaler:
+    # Hill-climb the number of active hashing workers during the first files of a run.
+    # Grow while files/s keeps improving and CPU is not saturated, shrink if growing never helped,
+    # then settle on the best measured count. cpu_fn defaults to a CpuMeter.
+    def __init__(self, max_workers: int, start_workers: int = 4, window_files: int = 32,
+                 calibrate_files: int = 300, min_gain: float = 0.05, cpu_limit: float = 0.9,
+                 clock=time.monotonic, cpu_fn=None):
+        self.max_workers = max(1, int(max_workers))
+        self.workers = min(max(1, int(start_workers)), self.max_workers)
+        self.window_files = max(1, int(window_files))
+        self.calibrate_files = int(calibrate_files)
+        self.min_gain = min_gain
+        self.cpu_limit = cpu_limit
+        self.settled = False
+        self.history = []   # [(workers, files_per_sec, cpu)]
+        self._clock = clock
+        self._cpu_fn = cpu_fn if cpu_fn is not None else CpuMeter()
+        self._start_workers = self.workers
+        self._direction = 1
+        self._best = None   # (files_per_sec, workers)
+        self._seen = 0
+        self._win_count = 0
+        self._win_start = None
+
+    # Record finished files and return the number of workers that should be active
+    def record(self, count: int = 1) -> int:
+        if self.settled or count <= 0:
+            return self.workers
+        now = self._clock()
+        if self._win_start is None:
+            self._win_start = now
+        self._seen += count
+        self._win_count += count
+        if self._win_count < self.window_files:
+            return self.workers
+
+        rate = self._win_count / max(now - self._win_start, 1e-6)
+        cpu = self._cpu_fn() if self._cpu_fn else None
+        self.history.append((self.workers, rate, cpu))
+        self._win_count = 0
+        self._win_start = now
+        self._step(rate, cpu)
+
+        if not self.settled and self._seen >= self.calibrate_files:
+            self.workers = self._best[1]
+            self.settled = True
+        return self.workers
+
+    def _step(self, rate, cpu):
+        improved = self._best is None or rate > self._best[0] * (1 + self.min_gain)
+        saturated = cpu is not None and cpu >= self.cpu_limit
+
+        if improved:
+            self._best = (rate, self.workers)
+            if self._direction > 0:
+                if saturated or self.workers >= self.max_workers:
+                    self.settled = True
+                else:
+                    self.workers = min(self.max_workers, self.workers + max(1, self.workers // 2))
+            else:
+                if self.workers <= 1:
+                    self.settled = True
+                else:
+                    self.workers = max(1, self.workers - max(1, self.workers // 3))
+            return
+
+        # Last move didn't pay off, go back to the best count
+        self.workers = self._best[1]
+        if self._direction > 0 and self._best[1] == self._start_workers and self.workers > 1:
+            self._direction = -1
+            self.workers = max(1, self.workers - max(1, self.workers // 3))
+        else:
+            self.settled = True
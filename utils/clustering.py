@@ -0,0 +1,235 @@
+import os
+import numpy as np
+from utils.hamming_index import popcount64, variant_distance
+from utils.hash_table import pack_paths, unpack_paths
+
+class ArrayDSU:
+    # Union-find over 0..n-1 backed by NumPy int arrays, union by size and path halving
+    def __init__(self, n: int):
+        self.p = np.arange(n, dtype=np.int64)
+        self.sz = np.ones(n, dtype=np.int64)
+    def find(self, x: int) -> int:
+        p = self.p
+        while p[x] != x:
+            p[x] = p[p[x]]
+            x = p[x]
+        return int(x)
+    def union(self, a: int, b: int) -> int:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return ra
+        if self.sz[ra] < self.sz[rb]:
+            ra, rb = rb, ra
+        self.p[rb] = ra
+        self.sz[ra] += self.sz[rb]
+        return ra
+    # Root of every element, paths are compressed on the way
+    def roots(self) -> np.ndarray:
+        p = self.p
+        while True:
+            pp = p[p]
+            if np.array_equal(pp, p):
+                self.p = p
+                return p
+            p = pp
+    # Union every pair (i, j) at once: the roots across a pair are hooked to the smaller one and paths
+    # compressed, until no pair spans two sets. The rounds run over arrays, not per pair.
+    def union_all(self, i, j):
+        while True:
+            p = self.roots()
+            ri, rj = p[i], p[j]
+            split = ri != rj
+            if not split.any():
+                break
+            np.minimum.at(p, np.maximum(ri[split], rj[split]), np.minimum(ri[split], rj[split]))
+        self.sz = np.bincount(self.p, minlength=len(self.p)).astype(np.int64)
+
+# Connected component label of each of 0..n-1 over the edges (i, j)
+def _components(n: int, i, j) -> np.ndarray:
+    dsu = ArrayDSU(n)
+    dsu.union_all(np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64))
+    return dsu.roots()
+
+# Members of the labels they share, members ascending, groups of 2+ ordered by their first member
+def _label_groups(members: np.ndarray, labels: np.ndarray) -> list:
+    groups = {}
+    for x, label in zip(members.tolist(), labels.tolist()):
+        groups.setdefault(label, []).append(x)
+    return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: g[0])
+
+# Cluster 0..n-1 from pairs (i, j) with distance d.
+# Without max_diameter every connected component is a group. With it, edges are merged from the closest
+# pair up and two clusters are only joined if every pair across them is within max_diameter.
+# Hashes given as rows of variants are compared with variant_distance.
+# Return groups of 2+ members, members ascending, groups ordered by their first member.
+def cluster_pairs(n: int, i, j, d, hashes=None, max_diameter=None) -> list:
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    d = np.asarray(d)
+    if len(i) == 0:
+        return []
+    members = np.unique(np.concatenate([i, j]))
+    if max_diameter is None:
+        return _label_groups(members, _components(n, i, j)[members])
+
+    dsu = ArrayDSU(n)
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    clusters = {}
+    order = np.lexsort((j, i, d))
+    for a, b, dist in zip(i[order].tolist(), j[order].tolist(), d[order].tolist()):
+        if dist > max_diameter:
+            break
+        ra, rb = dsu.find(a), dsu.find(b)
+        if ra == rb:
+            continue
+        ma = clusters.get(ra, [ra])
+        mb = clusters.get(rb, [rb])
+        if len(ma) > 1 or len(mb) > 1:
+            if hashes.ndim == 2:
+                dist = variant_distance(hashes[ma], hashes[mb])
+            else:
+                dist = popcount64(hashes[ma][:, None] ^ hashes[mb][None, :])
+            if dist.max() > max_diameter:
+                continue
+        root = dsu.union(ra, rb)
+        clusters[root] = ma + mb
+        clusters.pop(rb if root == ra else ra, None)
+    return _label_groups(members, np.array([dsu.find(x) for x in members.tolist()], dtype=np.int64))
+
+# Merge pairs (i, j) into existing groups of 0..n-1. Groups joined by a pair are merged into the first
+# of them, the other members of a pair are appended. Groups no pair touches are kept as they are,
+# groups of new members only come last ordered by their first member. Groups of 1 are dropped.
+def extend_groups(n: int, groups: list, i, j) -> list:
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    # Each group is linked as a star around its first member
+    link_i = [i] + [np.full(len(g) - 1, g[0], dtype=np.int64) for g in groups if g]
+    link_j = [j] + [np.asarray(g[1:], dtype=np.int64) for g in groups if g]
+    labels = _components(n, np.concatenate(link_i), np.concatenate(link_j))
+    merged = {}
+    placed = set()
+    for grp in groups:
+        if grp:
+            merged.setdefault(int(labels[grp[0]]), []).extend(grp)
+            placed.update(grp)
+    for x in np.unique(np.concatenate([i, j])).tolist():
+        if x not in placed:
+            merged.setdefault(int(labels[x]), []).append(x)
+    return [g for g in merged.values() if len(g) > 1]
+
+# Join exact groups of 0..n-1 to the groups (members ascending) holding their first member, an exact group
+# whose first member is in no group is a group of its own. Members ascending, groups ordered by their first member.
+def join_exact(groups: list, exact: list) -> list:
+    at = {g[0]: g for g in exact if len(g) > 1}
+    joined = [sorted(set(grp).union(*(at.pop(x)[1:] for x in grp if x in at))) for grp in groups]
+    joined.extend(sorted(g) for g in at.values())
+    return sorted(joined, key=lambda g: g[0])
+
+class PairGraph:
+    # Pairs within `radius` of items sorted by hash, with their distance and whether both files have
+    # the same size. Kept per scan root, a tolerance up to the radius only re-thresholds the stored pairs.
+    # A graph still being searched has `searched`, the rows whose pairs (row, later row) are in it.
+    # `variants` is the number of hash variants per item the search used (8 rotations and mirrors, or 1).
+    def __init__(self, paths, hashes, i, j, d, same_size, radius: int, searched=None, variants=1):
+        self.paths = list(paths)
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.i = np.asarray(i, dtype=np.int64)
+        self.j = np.asarray(j, dtype=np.int64)
+        self.d = np.asarray(d, dtype=np.uint8)
+        self.same_size = np.asarray(same_size, dtype=bool)
+        self.radius = int(radius)
+        self.searched = None if searched is None else np.asarray(searched, dtype=bool)
+        self.variants = int(variants)
+
+    @property
+    def complete(self):
+        return self.searched is None
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            searched = data["searched"] if "searched" in data.files else None
+            variants = int(data["variants"]) if "variants" in data.files else 1
+            hashes = data["hashes"]
+            # Graphs saved before the paths were packed hold them as a str array
+            paths = data["paths"].tolist() if data["paths"].dtype.kind == "U" else unpack_paths(data["paths"], len(hashes))
+            return cls(paths, hashes, data["i"], data["j"], data["d"],
+                       data["same_size"], int(data["radius"]), searched, variants)
+
+    # Written to a temp file first, a crash never leaves a half written graph
+    def save(self, file):
+        tmp = file + ".tmp"
+        arrays = dict(paths=pack_paths(self.paths), hashes=self.hashes, i=self.i, j=self.j,
+                      d=self.d, same_size=self.same_size, radius=np.int64(self.radius), variants=np.int64(self.variants))
+        if self.searched is not None:
+            arrays["searched"] = self.searched
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, file)
+
+    # Graph over the given items with the pairs of the items this graph has with the same hash,
+    # and a mask of the items it has no pairs for (new or hashed again since)
+    def carry(self, paths, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if paths == self.paths and np.array_equal(hashes, self.hashes):
+            return self, np.zeros(len(paths), dtype=bool)
+        pos = {p: k for k, p in enumerate(self.paths)}
+        old = np.array([pos.get(p, -1) for p in paths], dtype=np.int64)
+        known = old >= 0
+        known[known] = self.hashes[old[known]] == hashes[known]
+        remap = np.full(len(self.paths), -1, dtype=np.int64)
+        remap[old[known]] = np.flatnonzero(known)
+        i, j = remap[self.i], remap[self.j]
+        keep = (i >= 0) & (j >= 0)
+        i, j = i[keep], j[keep]
+        graph = PairGraph(paths, hashes, np.minimum(i, j), np.maximum(i, j), self.d[keep],
+                          self.same_size[keep], self.radius, variants=self.variants)
+        return graph, ~known
+
+    # Graph for the given items if this graph knows all of them, None otherwise.
+    # Items removed since are dropped with their pairs.
+    def subset(self, paths, hashes):
+        graph, added = self.carry(paths, hashes)
+        return None if added.any() else graph
+
+    def add_pairs(self, i, j, d, same_size, searched=None):
+        return PairGraph(self.paths, self.hashes, np.concatenate([self.i, i]), np.concatenate([self.j, j]),
+                         np.concatenate([self.d, d]), np.concatenate([self.same_size, same_size]), self.radius,
+                         searched, self.variants)
+
+    # Mask of the pairs (of those selected by mask) whose items are within the max distance of every
+    # (hashes, max distance, valid) in verify, hashes of another algorithm in item order. An item without
+    # that hash (valid False) can't be checked, its pairs pass like a missing tile in pair_similarity.
+    def verified(self, verify, mask=None) -> np.ndarray:
+        i, j = (self.i, self.j) if mask is None else (self.i[mask], self.j[mask])
+        keep = np.ones(len(i), dtype=bool)
+        for hashes, max_distance, valid in verify:
+            hashes = np.asarray(hashes, dtype=np.uint64)
+            close = popcount64(hashes[i] ^ hashes[j]) <= max_distance
+            if valid is not None:
+                valid = np.asarray(valid, dtype=bool)
+                close |= ~(valid[i] & valid[j])
+            keep &= close
+        return keep
+
+    # Groups of item indexes at t_link, see cluster_pairs. With verify only pairs passing verified() are linked,
+    # check gets the positions of the pairs left and returns which of them to keep. A graph of variants needs
+    # the (N, variants) hashes for max_diameter. Exact groups (item indexes of byte-identical files) are linked
+    # through their first member only, the others join its group (join_exact).
+    def clusters(self, t_link: int, same_size=False, exact=(), max_diameter=None, verify=(), check=None,
+                 variants=None) -> list:
+        keep = self.d <= t_link
+        if same_size:
+            keep &= self.same_size
+        if exact:
+            alias = np.zeros(len(self.paths), dtype=bool)
+            for g in exact:
+                alias[g[1:]] = True
+            keep &= ~alias[self.i] & ~alias[self.j]
+        if verify:
+            keep[keep] = self.verified(verify, keep)
+        if check is not None and keep.any():
+            keep[keep] = check(np.flatnonzero(keep))
+        hashes = self.hashes if variants is None else variants
+        groups = cluster_pairs(len(self.paths), self.i[keep], self.j[keep], self.d[keep], hashes, max_diameter)
+        return join_exact(groups, exact) if exact else groups
@@ -3,6 +3,8 @@ from copy import deepcopy
 
 APP_NAME = "Duplicate Photo Finder"
 LATEST_VERSION = 1
+# Highest similarity tolerance the settings allow, the pair graph is searched up to it by default
+SIMILARITY_TOLERANCE_MAX = 15
 
 DEFAULTS_COMMON = {
     "config_version": LATEST_VERSION,
@@ -29,8 +31,8 @@ DEFAULTS_COMMON = {
         #"skip_already_decided": True,
         "locale_override_from_os": True
     },
-    "performance": {"max_workers": 4, "heif_enabled": True, "raw_decode_policy": "fast"},
-    "compare": {"hash": "phash", "distance_threshold": 12, "early_stop": True},
+    "performance": {"max_workers": 4, "inflight_per_worker": 2, "compare_workers": "auto", "fast_decode": True, "verify_fast_decode": False, "hash_cache": True, "hash_cache_max_entries": 2000000, "heif_enabled": True, "raw_decode_policy": "fast", "root_index": "json", "journal_fsync_seconds": 1.0, "journal_checkpoint_seconds": 300, "journal_checkpoint_mb": 64, "root_cache_roots": 4},
+    "compare": {"hash": "phash", "verify_hashes": [], "verify_thresholds": {}, "verify_similarity": 0, "verify_metric": "ssim", "rotation_invariant": False, "early_stop": True, "cap_group_diameter": False, "graph_max_tolerance": SIMILARITY_TOLERANCE_MAX},
     "shortcuts": {
         "toggle_1":"1","toggle_2":"2","toggle_3":"3","toggle_all":"0",
         "next_group":"Right","prev_group":"Left","delete_selected":"Del"
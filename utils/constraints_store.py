@@ -3,6 +3,8 @@ from typing import List, Tuple, Dict, Set, Iterable
 
 Pair = Tuple[str, str]
 
+CONSTRAINTS_FILE = ".constraints.json"
+
 class DSU:
     def __init__(self):
         self.p: Dict[str, str] = {}
@@ -23,9 +25,11 @@ class DSU:
         self.sz[ra] += self.sz[rb]
 
 class ConstraintsStore:
-    def __init__(self, scan_folder: str):
-        self.json_path = os.path.join(scan_folder, ".constraints.json")
+    # With a RootIndex the constraints are loaded from and saved to it instead of the JSON file
+    def __init__(self, scan_folder: str, index=None):
+        self.json_path = os.path.join(scan_folder, CONSTRAINTS_FILE)
         self.root = os.path.abspath(scan_folder)
+        self.index = index
         self.version = 1
         self.must_pairs: Set[Tuple[str, str]] = set()
         self.cannot_pairs: Set[Tuple[str, str]] = set()
@@ -34,6 +38,11 @@ class ConstraintsStore:
     
     # Save and load constraints file
     def load_constraints(self):
+        if self.index is not None:
+            data = self.index.load_constraints()
+            if data is not None:
+                self.version, self.must_pairs, self.cannot_pairs, self.ignored_files = data
+            return
         if not os.path.exists(self.json_path):
             return
         with open(self.json_path, "r", encoding="utf-8") as f:
@@ -54,6 +63,12 @@ class ConstraintsStore:
         self.ignored_files = set(p.lower() for p in data.get("ignored_files", []))
 
     def save_constraints(self):
+        if self.index is not None:
+            self.index.save_constraints(self.version, self.must_pairs, self.cannot_pairs, self.ignored_files)
+            return
+        self.save_json()
+
+    def save_json(self):
         os.makedirs(os.path.dirname(self.json_path), exist_ok=True)
         data = {
             "version": self.version,
@@ -0,0 +1,294 @@
+from itertools import combinations
+import numpy as np
+
+# 64 bit hashes are split into 4 blocks of 16 bits
+MIH_BLOCKS = 4
+MIH_BLOCK_BITS = 16
+
+_POPCOUNT16 = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+# Number of set bits of every uint64, np.bitwise_count needs NumPy 2
+def popcount64(x: np.ndarray, out=None) -> np.ndarray:
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x, out=out)
+    count = _POPCOUNT16[(x & np.uint64(0xFFFF)).astype(np.intp)]
+    for shift in (16, 32, 48):
+        count += _POPCOUNT16[((x >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.intp)]
+    if out is None:
+        return count
+    out[...] = count
+    return out
+
+# All 16 bit masks with at most `radius` bits set
+def _flip_masks(radius: int) -> list:
+    return [
+        sum(1 << b for b in bits)
+        for k in range(radius + 1)
+        for bits in combinations(range(MIH_BLOCK_BITS), k)
+    ]
+
+# Rows per pairs() step and max candidate pairs expanded at once, bounds the temporary arrays
+HAMMING_TILE_ROWS = 4096
+HAMMING_MAX_CANDIDATES = 1 << 22
+# Brute force compares a row tile against column tiles of this size, with rows sized so a step
+# takes about HAMMING_BRUTE_PAIRS comparisons
+HAMMING_TILE_COLS = 8192
+HAMMING_BRUTE_PAIRS = 1 << 28
+# A block probe costs about as much as this many brute force comparisons. With large radius the number
+# of probes explodes and comparing every pair is cheaper.
+MIH_PROBE_COST = 600
+
+# A pair within radius is reported from the first block within radius // 4 only, so it comes out once
+def _first_block(x, b, sub):
+    keep = np.ones(len(x), dtype=bool)
+    for e in range(b):
+        keep &= _POPCOUNT16[((x >> np.uint64(e * MIH_BLOCK_BITS)) & np.uint64(0xFFFF)).astype(np.intp)] > sub
+    return keep
+
+class MultiIndexHash:
+    # Hamming radius search over 64 bit hashes (multi-index hashing).
+    # If two hashes are within distance r, by pigeonhole at least one of the 4 16-bit blocks
+    # is within r // 4. Each block has its own table, a query probes every block value within
+    # that radius and checks the full distance of the candidates only.
+    def __init__(self, hashes):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self._keys = []     # block value of every hash
+        self._order = []    # ids sorted by block value
+        self._starts = []   # offset into _order of every block value, 2**16 + 1 entries
+        self._tables = []   # block value -> ids, for single queries
+        for b in range(MIH_BLOCKS):
+            keys = ((self.hashes >> np.uint64(b * MIH_BLOCK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            uniq, starts = np.unique(sorted_keys, return_index=True)
+            ends = np.append(starts[1:], len(sorted_keys))
+            self._keys.append(keys)
+            self._order.append(order)
+            self._starts.append(np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=1 << MIH_BLOCK_BITS))]))
+            self._tables.append({int(k): order[s:e] for k, s, e in zip(uniq, starts, ends)})
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _flip_masks(self, radius):
+        sub = max(0, int(radius)) // MIH_BLOCKS
+        masks = self._masks.get(sub)
+        if masks is None:
+            masks = self._masks[sub] = np.array(_flip_masks(sub), dtype=np.int64)
+        return sub, masks
+
+    # query() of the hash of item k
+    def query_row(self, k: int, radius: int):
+        return self.query(int(self.hashes[k]), radius)
+
+    # Return (ids, distances) of every hash within radius of h, sorted by id
+    def query(self, h: int, radius: int):
+        _, masks = self._flip_masks(radius)
+        found = []
+        for b, table in enumerate(self._tables):
+            key = (h >> (b * MIH_BLOCK_BITS)) & 0xFFFF
+            for m in masks:
+                ids = table.get(key ^ int(m))
+                if ids is not None:
+                    found.append(ids)
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        ids = np.unique(np.concatenate(found))
+        dists = popcount64(self.hashes[ids] ^ np.uint64(h))
+        keep = dists <= radius
+        return ids[keep], dists[keep]
+
+    # All pairs i < j within radius for rows i in start_row..stop_row, computed for a tile of rows at a time.
+    # Each step yields (next_row, i, j, dist) so callers can report progress, pause and resume from next_row.
+    def pairs(self, radius: int, start_row: int = 0, tile_rows: int = HAMMING_TILE_ROWS,
+              max_candidates: int = HAMMING_MAX_CANDIDATES, stop_row: int = None):
+        _, masks = self._flip_masks(radius)
+        stop_row = len(self.hashes) if stop_row is None else min(stop_row, len(self.hashes))
+        if len(masks) * MIH_PROBE_COST >= len(self.hashes):
+            return self._pairs_bruteforce(radius, start_row, stop_row, tile_rows)
+        return self._pairs_blockwise(radius, start_row, stop_row, tile_rows, max_candidates)
+
+    # pairs() of rows start_row..stop_row in one go, (i, j, dist)
+    def pairs_rows(self, radius: int, start_row: int, stop_row: int):
+        found = [step[1:] for step in self.pairs(radius, start_row, stop_row=stop_row)]
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        i, j, d = zip(*found)
+        return np.concatenate(i), np.concatenate(j), np.concatenate(d)
+
+    # Candidates of a tile are expanded from the block tables in bulk and checked with XOR + popcount.
+    # A pair is emitted only from the first block within r // 4, so every pair comes out once.
+    def _pairs_blockwise(self, radius, start_row, stop_row, tile_rows, max_candidates):
+        sub, masks = self._flip_masks(radius)
+        for r0 in range(start_row, stop_row, tile_rows):
+            r1 = min(stop_row, r0 + tile_rows)
+            found_i, found_j, found_d = [], [], []
+            for b in range(MIH_BLOCKS):
+                for i, j in self._candidates(b, self._keys[b][r0:r1], np.arange(r0, r1, dtype=np.int64), masks, max_candidates):
+                    keep = j > i
+                    i, j = i[keep], j[keep]
+                    x = self.hashes[i] ^ self.hashes[j]
+                    d = popcount64(x)
+                    keep = (d <= radius) & _first_block(x, b, sub)
+                    found_i.append(i[keep])
+                    found_j.append(j[keep])
+                    found_d.append(d[keep])
+            if found_i:
+                yield r1, np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d).astype(np.uint8)
+            else:
+                yield r1, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+
+    # Ids of the hashes whose block b is within the flip masks of the query keys, as (query rows, ids) in
+    # chunks of at most max_candidates
+    def _candidates(self, b, keys, rows, masks, max_candidates):
+        query = (keys[:, None] ^ masks[None, :]).ravel()
+        lo = self._starts[b][query]
+        counts = self._starts[b][query + 1] - lo
+        rows = np.repeat(rows, len(masks))
+        hit = counts > 0
+        rows, lo, counts = rows[hit], lo[hit], counts[hit]
+        ends = np.cumsum(counts)
+        start = 0
+        while start < len(counts):
+            base = ends[start - 1] if start else 0
+            stop = max(start + 1, int(np.searchsorted(ends, base + max_candidates, "right")))
+            c = counts[start:stop]
+            first = np.cumsum(c) - c
+            pos = np.repeat(lo[start:stop] - first, c) + np.arange(int(c.sum()))
+            yield np.repeat(rows[start:stop], c), self._order[b][pos]
+            start = stop
+
+    # Every (query, id, dist) with the indexed hash within radius of one of the query hashes, which need not
+    # be indexed themselves. Ordered by query only within the blocks, callers sort if they need to.
+    def search(self, queries, radius: int, max_candidates: int = HAMMING_MAX_CANDIDATES):
+        queries = np.asarray(queries, dtype=np.uint64)
+        sub, masks = self._flip_masks(radius)
+        found_q, found_id, found_d = [], [], []
+        if len(masks) * MIH_PROBE_COST >= len(self.hashes):
+            h = self.hashes
+            n = len(h)
+            tile_rows = max(1, min(HAMMING_TILE_ROWS, HAMMING_BRUTE_PAIRS // max(1, n)))
+            xor = np.empty((tile_rows, HAMMING_TILE_COLS), dtype=np.uint64)
+            dist = np.empty((tile_rows, HAMMING_TILE_COLS), dtype=np.uint8)
+            for r0 in range(0, len(queries), tile_rows):
+                rows = queries[r0:r0 + tile_rows, None]
+                for c0 in range(0, n, HAMMING_TILE_COLS):
+                    c1 = min(n, c0 + HAMMING_TILE_COLS)
+                    x = xor[:len(rows), :c1 - c0]
+                    d = dist[:len(rows), :c1 - c0]
+                    np.bitwise_xor(rows, h[None, c0:c1], out=x)
+                    popcount64(x, out=d)
+                    q, ids = np.nonzero(d <= radius)
+                    found_q.append(q + r0)
+                    found_id.append(ids + c0)
+                    found_d.append(d[q, ids])
+        else:
+            rows = np.arange(len(queries), dtype=np.int64)
+            for b in range(MIH_BLOCKS):
+                keys = ((queries >> np.uint64(b * MIH_BLOCK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+                for q, ids in self._candidates(b, keys, rows, masks, max_candidates):
+                    x = queries[q] ^ self.hashes[ids]
+                    d = popcount64(x)
+                    keep = (d <= radius) & _first_block(x, b, sub)
+                    found_q.append(q[keep])
+                    found_id.append(ids[keep])
+                    found_d.append(d[keep])
+        if not found_q:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return (np.concatenate(found_q).astype(np.int64), np.concatenate(found_id).astype(np.int64),
+                np.concatenate(found_d).astype(np.uint8))
+
+    # XOR + popcount of the row tile against every later hash, in column tiles with reused buffers
+    def _pairs_bruteforce(self, radius, start_row, stop_row, tile_rows):
+        h = self.hashes
+        n = len(h)
+        tile_rows = max(1, min(tile_rows, HAMMING_BRUTE_PAIRS // max(1, n)))
+        xor = np.empty((tile_rows, HAMMING_TILE_COLS), dtype=np.uint64)
+        dist = np.empty((tile_rows, HAMMING_TILE_COLS), dtype=np.uint8)
+        for r0 in range(start_row, stop_row, tile_rows):
+            r1 = min(stop_row, r0 + tile_rows)
+            rows = h[r0:r1, None]
+            found_i, found_j, found_d = [], [], []
+            for c0 in range(r0, n, HAMMING_TILE_COLS):
+                c1 = min(n, c0 + HAMMING_TILE_COLS)
+                x = xor[:r1 - r0, :c1 - c0]
+                d = dist[:r1 - r0, :c1 - c0]
+                np.bitwise_xor(rows, h[None, c0:c1], out=x)
+                popcount64(x, out=d)
+                flat = np.flatnonzero(d <= radius)
+                if not len(flat):
+                    continue
+                ii, jj = np.divmod(flat, c1 - c0)
+                i, j = ii + r0, jj + c0
+                upper = j > i
+                found_i.append(i[upper])
+                found_j.append(j[upper])
+                found_d.append(d[ii[upper], jj[upper]])
+            if found_i:
+                yield r1, np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+            else:
+                yield r1, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+
+# Distance between items given as rows of variant hashes (column 0 the hash itself): the lowest distance of
+# the hash of one item to any variant of the other, in both directions so it doesn't depend on the order.
+def variant_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    ab = popcount64(a[:, None, 0:1] ^ b[None, :, :]).min(axis=2)
+    ba = popcount64(a[:, None, :] ^ b[None, :, 0:1]).min(axis=2)
+    return np.minimum(ab, ba)
+
+# Pairs (i, j) once each with their lowest distance, ordered by i then j
+def min_pairs(i, j, d):
+    order = np.lexsort((d, j, i))
+    i, j, d = i[order], j[order], d[order]
+    first = np.ones(len(i), dtype=bool)
+    first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+    return i[first], j[first], d[first]
+
+class VariantIndex:
+    # Radius search over items with several hashes each, e.g. the pHash of every rotation and mirror.
+    # Items are within r if variant_distance is: the hash of one is within r of a variant of the other.
+    # pairs() queries the hash of each row against a multi-index of all variants, so a pair is found
+    # from both of its rows, once per direction. Callers keep the lowest distance with min_pairs().
+    def __init__(self, variants):
+        self.variants = np.asarray(variants, dtype=np.uint64)
+        self.hashes = self.variants[:, 0]
+        self._count = self.variants.shape[1]
+        self._variant_index = MultiIndexHash(self.variants.ravel())
+        self._index = None
+
+    def __len__(self):
+        return len(self.hashes)
+
+    # Return (ids, distances) of every item within radius of item k (k included), sorted by id.
+    # Both directions are searched, the variants of k against the hashes too.
+    def query_row(self, k: int, radius: int):
+        if self._index is None:
+            self._index = MultiIndexHash(self.hashes)
+        _, ids, d1 = self._variant_index.search(self.hashes[k:k + 1], radius)
+        _, items, d2 = self._index.search(self.variants[k], radius)
+        items = np.concatenate([ids // self._count, items])
+        _, ids, dists = min_pairs(np.zeros(len(items), dtype=np.int64), items, np.concatenate([d1, d2]))
+        return ids, dists
+
+    # Same steps as MultiIndexHash.pairs: (next_row, i, j, dist) with i < j, for pairs found from rows
+    # start_row..stop_row. The other row of a pair may be outside the range.
+    def pairs(self, radius: int, start_row: int = 0, tile_rows: int = HAMMING_TILE_ROWS, stop_row: int = None):
+        stop_row = len(self.hashes) if stop_row is None else min(stop_row, len(self.hashes))
+        for r0 in range(start_row, stop_row, tile_rows):
+            r1 = min(stop_row, r0 + tile_rows)
+            q, ids, d = self._variant_index.search(self.hashes[r0:r1], radius)
+            rows, items = q + r0, ids // self._count
+            keep = rows != items
+            rows, items, d = rows[keep], items[keep], d[keep]
+            yield (r1, *min_pairs(np.minimum(rows, items), np.maximum(rows, items), d))
+
+    def pairs_rows(self, radius: int, start_row: int, stop_row: int):
+        found = [step[1:] for step in self.pairs(radius, start_row, stop_row=stop_row)]
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        i, j, d = zip(*found)
+        return np.concatenate(i), np.concatenate(j), np.concatenate(d)
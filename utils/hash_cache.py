@@ -0,0 +1,105 @@
+import os, sqlite3, time
+from utils.config_manager import _default_config_path
+
+HASH_CACHE_FILE = "hash_cache.sqlite3"
+
+def _default_cache_path():
+    return os.path.join(os.path.dirname(_default_config_path()), HASH_CACHE_FILE)
+
+# SQLite INTEGER is signed 64 bit, hashes are unsigned
+def _to_db(h: int) -> int:
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def _from_db(v: int) -> int:
+    return v + (1 << 64) if v < 0 else v
+
+class HashCache:
+    # Machine-wide hash cache shared by every scan root.
+    # Entries are keyed by (device, inode, size, mtime_ns) and tagged with the hash algorithm,
+    # an optional content digest lets copies on other disks reuse a hash too.
+    # The cache is bounded, least recently used entries are evicted first.
+    def __init__(self, algo: str, path=None, max_entries: int = 2_000_000):
+        self.path = path or _default_cache_path()
+        self.algo = algo
+        self.max_entries = int(max_entries)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " algo TEXT NOT NULL, dev INTEGER NOT NULL, ino INTEGER NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " digest TEXT, hash INTEGER NOT NULL, decode TEXT, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (algo, dev, ino, size, mtime_ns))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS hashes_digest ON hashes (algo, digest)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        self.db.commit()
+        self._touched = []
+
+    # Stat based key, None if the file system has no stable file id
+    @staticmethod
+    def key(st):
+        if not st.st_ino:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    # Return (hash, decode) or None
+    def get(self, key, digest=None):
+        row = None
+        if key is not None:
+            row = self.db.execute(
+                "SELECT hash, decode FROM hashes WHERE algo=? AND dev=? AND ino=? AND size=? AND mtime_ns=?",
+                (self.algo, *key)
+            ).fetchone()
+            if row:
+                self._touched.append((self.algo, *key))
+        if row is None and digest:
+            row = self.db.execute(
+                "SELECT hash, decode FROM hashes WHERE algo=? AND digest=? LIMIT 1",
+                (self.algo, digest)
+            ).fetchone()
+        if row is None:
+            return None
+        return _from_db(row[0]), row[1]
+
+    # rows: [(key, digest, hash, decode)]
+    def put_many(self, rows):
+        now = int(time.time())
+        data = [
+            (self.algo, *key, digest, _to_db(h), decode, now)
+            for key, digest, h, decode in rows
+            if key is not None and h is not None
+        ]
+        if not data:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes (algo, dev, ino, size, mtime_ns, digest, hash, decode, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                data
+            )
+
+    # Write back last-used time of hits and evict the oldest entries over the limit
+    def flush(self):
+        now = int(time.time())
+        with self.db:
+            if self._touched:
+                self.db.executemany(
+                    "UPDATE hashes SET last_used=? WHERE algo=? AND dev=? AND ino=? AND size=? AND mtime_ns=?",
+                    [(now, *k) for k in self._touched]
+                )
+                self._touched = []
+            count = self.db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute(
+                    "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.db.close()
@@ -0,0 +1,146 @@
+import os, json, time, shutil
+
+JOURNAL_FILE = ".hashing.journal"
+JOURNAL_PREV_FILE = ".hashing.journal.prev"
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+# Generation in the first line of a log, None if the file is missing or unreadable
+def _generation(file):
+    try:
+        with open(file, "rb") as f:
+            return json.loads(f.readline())["journal"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+# Open a log for appending, a torn last line stays a line of its own
+def _append(file):
+    f = open(file, "ab+")
+    if f.tell():
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+    return f
+
+# Append the records of src (not its header) to dst and remove src
+def _fold(src, dst):
+    with _append(dst) as out, open(src, "rb") as f:
+        f.readline()
+        shutil.copyfileobj(f, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.remove(src)
+
+class HashJournal:
+    # Append-only log of the hash entries set or removed while hashing, one JSON line per entry and
+    # fsync at most every fsync_interval seconds, a crash loses that much work at most.
+    # The first line holds the generation of the progress data the log continues. A checkpoint moves the
+    # log aside (.prev) and starts the next generation, the old log is removed once progress data of the
+    # new generation is written. Until then a load replays both.
+    def __init__(self, root: str, fsync_interval: float = 1.0):
+        self.path = os.path.join(root, JOURNAL_FILE)
+        self.prev_path = os.path.join(root, JOURNAL_PREV_FILE)
+        self.fsync_interval = fsync_interval
+        self.pending = set()
+        self.generation = None
+        self.f = None
+        self.last_sync = self.last_checkpoint = time.monotonic()
+
+    # Keys whose entry goes to the log with the next write
+    def add(self, key):
+        self.pending.add(key)
+
+    # Bytes in the log since the last checkpoint
+    @property
+    def size(self) -> int:
+        return self.f.tell() if self.f is not None else 0
+
+    # Continue the log of the progress data of generation, records of older generations are dropped
+    def open(self, generation):
+        if os.path.exists(self.prev_path) and _generation(self.prev_path) == generation:
+            if os.path.exists(self.path):
+                _fold(self.path, self.prev_path)
+            os.replace(self.prev_path, self.path)
+        elif os.path.exists(self.prev_path):
+            os.remove(self.prev_path)
+        if os.path.exists(self.path) and _generation(self.path) == generation:
+            self.f = _append(self.path)
+            self.generation = generation
+        else:
+            self._create(generation)
+
+    def _create(self, generation):
+        self.f = open(self.path, "wb")
+        self.f.write((_dumps({"journal": generation}) + "\n").encode("utf-8"))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.generation = generation
+        self.last_sync = self.last_checkpoint = time.monotonic()
+
+    # Append the pending entries as they are in entries now, a key no longer there is a removal
+    def write(self, entries, sync=False):
+        if self.f is None:
+            return
+        if self.pending:
+            lines = [_dumps({"p": key, "e": entries[key]} if key in entries else {"p": key}) for key in self.pending]
+            self.f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            self.pending.clear()
+        if sync or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.last_sync = time.monotonic()
+
+    # Start the next generation, return it. Progress data saved from now on includes every pending entry.
+    def rotate(self) -> int:
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if os.path.exists(self.path):
+            if os.path.exists(self.prev_path):
+                # The last checkpoint wasn't written, its log still counts
+                _fold(self.path, self.prev_path)
+            else:
+                os.replace(self.path, self.prev_path)
+        self.pending.clear()
+        generation = time.time_ns()
+        self._create(generation)
+        return generation
+
+    # Progress data of the current generation is written
+    def drop_prev(self):
+        if os.path.exists(self.prev_path):
+            os.remove(self.prev_path)
+
+    def close(self, remove=False):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if remove:
+            for file in (self.path, self.prev_path):
+                if os.path.exists(file):
+                    os.remove(file)
+
+    # [(key, entry or None for a removal)] logged after the progress data of generation, in order
+    @staticmethod
+    def replay(root: str, generation):
+        path, prev_path = os.path.join(root, JOURNAL_FILE), os.path.join(root, JOURNAL_PREV_FILE)
+        if os.path.exists(prev_path) and _generation(prev_path) == generation:
+            files = [prev_path] + ([path] if os.path.exists(path) else [])
+        elif os.path.exists(path) and _generation(path) == generation:
+            files = [path]
+        else:
+            return []
+        records = []
+        for file in files:
+            with open(file, "rb") as f:
+                f.readline()
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn by a crash
+                        continue
+                    if isinstance(record, dict) and "p" in record:
+                        records.append((record["p"], record.get("e")))
+        return records
@@ -0,0 +1,337 @@
+import os, math, json
+import numpy as np
+from collections.abc import MutableMapping
+
+HASH_TABLE_MAGIC = b"MIFHASH3"
+# magic, rows, bytes of the path blob, bytes of the meta blob
+_HEADER = np.dtype([("magic", "S8"), ("rows", "<u8"), ("blob", "<u8"), ("meta", "<u8")])
+
+# Status of a row
+STATUS_HASHED = 0
+STATUS_DEFERRED = 1   # unique size, not hashed while compare_file_size is on
+STATUS_FAILED = 2     # could not be decoded
+
+# Decode paths of the decode column by code, 0 is an entry without one
+DECODE_PATHS = ("", "full", "draft", "raw_preview", "raw_preview_draft", "raw_bitmap", "raw_half", "exact", "error")
+_DECODE_CODES = {name: code for code, name in enumerate(DECODE_PATHS) if name}
+_COLUMNS = ("hash", "size", "mtime", "decode")
+_COLUMN_DTYPES = (("hash", "<u8"), ("size", "<i8"), ("mtime", "<f8"), ("status", "u1"), ("decode", "u1"))
+
+# Paths as one "\0" joined UTF-8 blob, a few bytes a path instead of the fixed width UTF-32 of a str array
+def pack_paths(paths) -> np.ndarray:
+    return np.frombuffer("\0".join(paths).encode("utf-8"), dtype=np.uint8)
+
+# The n paths of a blob from pack_paths
+def unpack_paths(blob, n: int) -> list:
+    return np.asarray(blob, dtype=np.uint8).tobytes().decode("utf-8").split("\0") if n else []
+
+def _status(entry) -> int:
+    if not isinstance(entry, dict):
+        return STATUS_HASHED
+    if entry.get("hash") is not None and "error" not in entry:
+        return STATUS_HASHED
+    return STATUS_DEFERRED if entry.get("deferred") else STATUS_FAILED
+
+class HashTable:
+    # Columns of the hash entries of a scan root (HashEntries.table): a path table and parallel pHash (uint64),
+    # size (int64), mtime (float64), status (uint8) and decode (uint8, code in DECODE_PATHS), rows in the
+    # order of the entries. The file form is a header and the columns at 8 byte aligned offsets, loaded
+    # memory mapped without parsing the rows. meta is a small JSON dict saved with them (the progress data
+    # and the sparse fields of the entries, see HashEntries.sparse).
+    def __init__(self, paths, hash, size, mtime, status, decode=None, meta=None):
+        self.paths = paths
+        self.hash = hash
+        self.size = size
+        self.mtime = mtime
+        self.status = status
+        self.decode = decode if decode is not None else np.zeros(len(paths), dtype=np.uint8)
+        self.meta = meta if meta is not None else {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def from_entries(cls, phashes: dict, meta=None):
+        return HashEntries(phashes).table(meta)
+
+    # Rows of hashed files sorted by hash, ties in row order
+    def hashed_order(self) -> np.ndarray:
+        rows = np.flatnonzero(self.status == STATUS_HASHED)
+        return rows[np.argsort(self.hash[rows], kind="stable")]
+
+    @staticmethod
+    def _layout(n, blob, meta):
+        offsets, pos = {}, _HEADER.itemsize
+        for name, dtype in _COLUMN_DTYPES:
+            offsets[name] = (pos, np.dtype(dtype))
+            pos += (n * np.dtype(dtype).itemsize + 7) // 8 * 8
+        offsets["blob"] = (pos, np.dtype("u1"))
+        offsets["meta"] = (pos + blob, np.dtype("u1"))
+        return offsets, pos + blob + meta
+
+    # Written to a temp file first, a crash never leaves a half written table
+    def save(self, file):
+        blob = pack_paths(self.paths)
+        meta = json.dumps(self.meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        n = len(self.paths)
+        offsets, total = self._layout(n, len(blob), len(meta))
+        header = np.array([(HASH_TABLE_MAGIC, n, len(blob), len(meta))], dtype=_HEADER)
+        tmp = file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header.tobytes())
+            for name, _ in _COLUMN_DTYPES:
+                pos, dtype = offsets[name]
+                f.seek(pos)
+                f.write(np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes())
+            f.seek(offsets["blob"][0])
+            f.write(blob.tobytes())
+            f.write(meta)
+            f.truncate(total)
+        os.replace(tmp, file)
+
+    # Columns are read only views of the mapped file
+    @classmethod
+    def load(cls, file):
+        header = np.fromfile(file, dtype=_HEADER, count=1)
+        if len(header) != 1 or header["magic"][0] != HASH_TABLE_MAGIC:
+            raise ValueError(f"not a hash table: {file}")
+        n, blob, meta = int(header["rows"][0]), int(header["blob"][0]), int(header["meta"][0])
+        offsets, total = cls._layout(n, blob, meta)
+        if os.path.getsize(file) != total:
+            raise ValueError(f"truncated hash table: {file}")
+        data = np.memmap(file, dtype=np.uint8, mode="r")
+        cols = {name: data[pos:pos + n * dtype.itemsize].view(dtype) for name, (pos, dtype) in offsets.items()
+                if name not in ("blob", "meta")}
+        pos = offsets["blob"][0]
+        paths = unpack_paths(data[pos:pos + blob], n)
+        meta = json.loads(data[pos + blob:pos + blob + meta].tobytes().decode("utf-8")) if meta else {}
+        return cls(paths, cols["hash"], cols["size"], cols["mtime"], cols["status"], cols["decode"], meta)
+
+class _Bare:
+    # Entry of the v1 progress format, a hash without fields
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+# Marks a column field the entry doesn't have
+_ABSENT = object()
+
+# Column values (hash, size, mtime, status, decode) and sparse fields of an entry, the fields are a _Bare
+# for an entry which is a hash only. A field the columns can't hold goes to the sparse fields,
+# _ABSENT there marks a column field the entry doesn't have.
+def _split(entry):
+    if not isinstance(entry, dict):
+        return (entry, -1, np.nan, STATUS_HASHED, 0), _Bare(entry)
+    # Most entries are a hashed file with these fields only
+    h, size, mtime, decode = entry.get("hash"), entry.get("size"), entry.get("mtime"), entry.get("decode")
+    if type(h) is int and type(size) is int and type(mtime) is float and size != -1 and mtime == mtime \
+            and len(entry) == (3 if decode is None else 4) and (decode is None or decode in _DECODE_CODES):
+        return (h, size, mtime, STATUS_HASHED, _DECODE_CODES.get(decode, 0)), None
+    extra = {k: v for k, v in entry.items() if k not in _COLUMNS}
+    status = _status(entry)
+    h = entry.get("hash", _ABSENT)
+    if status != STATUS_HASHED and h is not None:
+        extra["hash"] = h
+    size = entry.get("size", _ABSENT)
+    if not (isinstance(size, int) and not isinstance(size, bool) and size != -1):
+        if size is not _ABSENT:
+            extra["size"] = size
+        size = -1
+    mtime = entry.get("mtime", _ABSENT)
+    if not (isinstance(mtime, (int, float)) and not isinstance(mtime, bool) and not math.isnan(mtime)):
+        if mtime is not _ABSENT:
+            extra["mtime"] = mtime
+        mtime = np.nan
+    decode = entry.get("decode", _ABSENT)
+    code = _DECODE_CODES.get(decode, 0) if isinstance(decode, str) else 0
+    if not code and decode is not _ABSENT:
+        extra["decode"] = decode
+    return (h if status == STATUS_HASHED else 0, size, mtime, status, code), extra
+
+class HashEntries(MutableMapping):
+    # Hash entries of a scan root keyed by relative path, read and written like a dict of
+    # {"hash", "mtime", "size", "decode", ...}. The columns are the store, one row per entry in the order
+    # the entries were added: pHash, size, mtime, status and decode as in HashTable. Fields few entries have
+    # (extra hashes, variants, digests, failure info) are kept in a sparse dict keyed by row.
+    # An entry read is built from its row, changing it in place changes nothing, assign it again.
+    # The keys set and removed since the last save are remembered (changed, removed), so only those rows
+    # are written. version counts every change, data derived from the entries is current while it stays
+    # the same. A journal (HashJournal) is told every key set or removed as well.
+    # Copies and tables taken share the columns until the next write copies them (_shared).
+    _shared = False
+
+    def __init__(self, entries=()):
+        self._rows = {}
+        self._extra = {}
+        self._count = 0
+        self._cols = {name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMN_DTYPES}
+        self.changed = set()
+        self.removed = set()
+        self.version = 0
+        self.journal = None
+        if isinstance(entries, HashEntries):
+            self._rows = dict(entries._rows)
+            self._extra = dict(entries._extra)
+            self._count = entries._count
+            self._cols = dict(entries._cols)
+            entries._shared = self._shared = True
+            return
+        items = dict(entries)
+        n = len(items)
+        self._grow(n)
+        split = [_split(value) for value in items.values()]
+        for k, (name, dtype) in enumerate(_COLUMN_DTYPES):
+            self._cols[name][:n] = np.array([values[k] for values, _ in split], dtype=dtype)
+        self._rows = dict(zip(items, range(n)))
+        self._extra = {row: extra for row, (_, extra) in enumerate(split) if extra}
+        self._count = n
+
+    # Entries of a saved table, extra holds the entries by path. Their column fields are taken from the table.
+    # The columns are read into memory, a mapped file couldn't be replaced by the next save on Windows.
+    @classmethod
+    def from_table(cls, table, extra=None):
+        entries = cls()
+        entries._rows = dict(zip(table.paths, range(len(table))))
+        entries._count = len(table)
+        entries._cols = {name: np.array(getattr(table, name), dtype=dtype) for name, dtype in _COLUMN_DTYPES}
+        if extra:
+            rows = entries._rows
+            for key, entry in extra.items():
+                fields = _split(entry)[1]
+                if fields and key in rows:
+                    entries._extra[rows[key]] = fields
+        return entries
+
+    def copy(self):
+        return HashEntries(self)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __getitem__(self, key):
+        return self._entry(self._rows[key])
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+        self.removed.discard(key)
+        self._touch(key)
+
+    def __delitem__(self, key):
+        row = self._rows.pop(key)
+        self._extra.pop(row, None)
+        self.changed.discard(key)
+        self.removed.add(key)
+        self._touch(key)
+
+    def clear(self):
+        if self.journal is not None:
+            for key in self._rows:
+                self.journal.add(key)
+        self.removed.update(self._rows)
+        self.changed.clear()
+        self._rows, self._extra, self._count = {}, {}, 0
+        self.version += 1
+
+    def _touch(self, key):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.add(key)
+
+    # Sparse fields of an entry, not to be changed
+    def extra(self, key) -> dict:
+        row = self._rows.get(key)
+        extra = self._extra.get(row) if row is not None else None
+        return extra if isinstance(extra, dict) else {}
+
+    def _entry(self, row):
+        extra = self._extra.get(row)
+        if isinstance(extra, _Bare):
+            return extra.value
+        cols = self._cols
+        entry = {"hash": int(cols["hash"][row]) if cols["status"][row] == STATUS_HASHED else None}
+        mtime = float(cols["mtime"][row])
+        if not math.isnan(mtime):
+            entry["mtime"] = mtime
+        size = int(cols["size"][row])
+        if size != -1:
+            entry["size"] = size
+        decode = int(cols["decode"][row])
+        if decode:
+            entry["decode"] = DECODE_PATHS[decode]
+        if extra:
+            for k, v in extra.items():
+                if v is _ABSENT:
+                    entry.pop(k, None)
+                else:
+                    entry[k] = v
+        return entry
+
+    def _grow(self, extra_rows):
+        need = self._count + extra_rows
+        capacity = len(self._cols["hash"])
+        if need <= capacity and not self._shared:
+            return
+        if need > capacity:
+            capacity = max(need, capacity * 2, 1024)
+        for name, dtype in _COLUMN_DTYPES:
+            col = np.zeros(capacity, dtype=dtype)
+            col[:self._count] = self._cols[name][:self._count]
+            self._cols[name] = col
+        self._shared = False
+
+    # Rows of removed entries are dropped once they are most of the columns
+    def _compact(self):
+        rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        cols = {}
+        for name, dtype in _COLUMN_DTYPES:
+            col = np.zeros(max(len(rows) * 2, 1024), dtype=dtype)
+            col[:len(rows)] = self._cols[name][rows]
+            cols[name] = col
+        self._extra = {new: self._extra[old] for new, old in enumerate(rows.tolist()) if old in self._extra}
+        self._rows = dict(zip(self._rows, range(len(rows))))
+        self._cols, self._count, self._shared = cols, len(rows), False
+
+    def _set(self, key, value):
+        row = self._rows.get(key)
+        if row is None:
+            if self._count >= 1024 and self._count >= 2 * len(self._rows):
+                self._compact()
+            self._grow(1)
+            row = self._count
+            self._count += 1
+            self._rows[key] = row
+        else:
+            self._grow(0)
+        values, extra = _split(value)
+        for (name, _), v in zip(_COLUMN_DTYPES, values):
+            self._cols[name][row] = v
+        if extra:
+            self._extra[row] = extra
+        else:
+            self._extra.pop(row, None)
+        self.changed.add(key)
+
+    # Entries with sparse fields by key, with the columns of table() they give every entry (from_table)
+    def sparse(self) -> dict:
+        if not self._extra:
+            return {}
+        keys = dict(zip(self._rows.values(), self._rows))
+        return {keys[row]: self._entry(row) for row in self._extra if row in keys}
+
+    # Columns of the entries as they are now, in their order
+    def table(self, meta=None) -> HashTable:
+        n = len(self._rows)
+        if n == self._count:
+            cols = {name: self._cols[name][:n] for name, _ in _COLUMN_DTYPES}
+        else:
+            rows = np.fromiter(self._rows.values(), dtype=np.int64, count=n)
+            cols = {name: self._cols[name][rows] for name, _ in _COLUMN_DTYPES}
+        self._shared = True
+        return HashTable(list(self._rows), cols["hash"], cols["size"], cols["mtime"], cols["status"], cols["decode"], meta)
@@ -0,0 +1,131 @@
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from utils.phash import PHASH_SIZE, PHASH_TILE, phash_tile, phash_from_tiles
+
+# Tile edge of wHash, same as imagehash.whash(image_scale=64): 3 Haar levels down to 8x8
+WHASH_SCALE = 64
+# Tile edge and bits per value of the colour hash, same as imagehash.colorhash(binbits=3)
+COLORHASH_TILE = 64
+COLORHASH_BINBITS = 3
+
+# Pack rows of 64 bools into ints, first bit is the most significant one
+def _pack_bits(bits: np.ndarray) -> list:
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int(v) for v in packed.view(">u8").ravel()]
+
+# Pack rows of up to 64 bools into ints, first bit is the most significant one
+def _pack_bits_short(bits: np.ndarray) -> list:
+    shifts = np.arange(bits.shape[1] - 1, -1, -1, dtype=np.uint64)
+    return [int(v) for v in (bits.astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)]
+
+def _gray_tile(img: Image.Image, size) -> np.ndarray:
+    return np.asarray(img.convert("L").resize(size, Image.Resampling.LANCZOS), dtype=np.uint8)
+
+# aHash: pixels of an 8x8 tile above their mean, as imagehash.average_hash
+def _ahash_tile(img):
+    return _gray_tile(img, (PHASH_SIZE, PHASH_SIZE))
+
+def _ahash_from_tiles(tiles):
+    flat = tiles.reshape(len(tiles), -1).astype(np.float64)
+    return _pack_bits(flat > flat.mean(axis=1, keepdims=True))
+
+# dHash: horizontal gradient sign of a 9x8 tile, as imagehash.dhash
+def _dhash_tile(img):
+    return _gray_tile(img, (PHASH_SIZE + 1, PHASH_SIZE))
+
+def _dhash_from_tiles(tiles):
+    return _pack_bits(tiles[:, :, 1:] > tiles[:, :, :-1])
+
+# wHash: Haar low band of a 64x64 tile above its median, as imagehash.whash(image_scale=64).
+# Removing the top level LL only shifts every coefficient by the same amount and the low band is
+# proportional to the 8x8 block sums, so the median split is done on the block sums directly.
+def _whash_tile(img):
+    return _gray_tile(img, (WHASH_SCALE, WHASH_SCALE))
+
+def _whash_from_tiles(tiles):
+    block = WHASH_SCALE // PHASH_SIZE
+    sums = tiles.reshape(len(tiles), PHASH_SIZE, block, PHASH_SIZE, block).sum(axis=(2, 4), dtype=np.int64)
+    flat = sums.reshape(len(tiles), -1).astype(np.float64)
+    return _pack_bits(flat > np.median(flat, axis=1, keepdims=True))
+
+# Colour hash: shares of black, gray, faint and bright colour per hue bin of a 64x64 RGB tile,
+# as imagehash.colorhash(binbits=3). The tile keeps the L, H, S and V planes PIL converts to.
+def _colorhash_tile(img):
+    rgb = img.convert("RGB").resize((COLORHASH_TILE, COLORHASH_TILE), Image.Resampling.LANCZOS)
+    planes = [rgb.convert("L"), *rgb.convert("HSV").split()]
+    return np.stack([np.asarray(p, dtype=np.uint8) for p in planes])
+
+def _colorhash_from_tiles(tiles):
+    n = len(tiles)
+    planes = tiles.reshape(n, 4, -1)
+    intensity, h, s = planes[:, 0], planes[:, 1], planes[:, 2]
+    pixels = planes.shape[2]
+    maxvalue = 1 << COLORHASH_BINBITS
+    black = intensity < 256 // 8
+    gray = s < 256 // 3
+    colors = ~black & ~gray
+    faint = colors & (s < 256 * 2 // 3)
+    bright = colors & (s > 256 * 2 // 3)
+    c = np.maximum(1, colors.sum(axis=1))[:, None]
+    # Six equal hue bins over 0..255, the last one includes 255
+    hue_bin = np.minimum(h.astype(np.int64) * 2 // 85, 5)
+    counts = [(mask & (hue_bin == b)).sum(axis=1) for mask in (faint, bright) for b in range(6)]
+    values = np.concatenate([
+        (black.sum(axis=1) / pixels * maxvalue)[:, None],
+        ((~black & gray).sum(axis=1) / pixels * maxvalue)[:, None],
+        np.stack(counts, axis=1) * maxvalue * 1. / c,
+    ], axis=1)
+    values = np.minimum(maxvalue - 1, values.astype(np.int64))
+    bits = np.stack([values // (1 << (COLORHASH_BINBITS - k - 1)) % (1 << (COLORHASH_BINBITS - k)) > 0
+                     for k in range(COLORHASH_BINBITS)], axis=2)
+    return _pack_bits_short(bits.reshape(n, -1))
+
+# Hash algorithm: tile shape, tile from the decoded image (color needs an RGB decode),
+# hash ints of stacked tiles and the number of hash bits.
+# Bump the version when the output changes, stored hashes of another version are computed again.
+HashAlgo = namedtuple("HashAlgo", "name version shape color tile hash bits")
+
+HASH_ALGOS = {a.name: a for a in (
+    HashAlgo("phash", 1, (PHASH_TILE, PHASH_TILE), False, phash_tile, phash_from_tiles, 64),
+    HashAlgo("dhash", 1, (PHASH_SIZE, PHASH_SIZE + 1), False, _dhash_tile, _dhash_from_tiles, 64),
+    HashAlgo("ahash", 1, (PHASH_SIZE, PHASH_SIZE), False, _ahash_tile, _ahash_from_tiles, 64),
+    HashAlgo("whash", 1, (WHASH_SCALE, WHASH_SCALE), False, _whash_tile, _whash_from_tiles, 64),
+    HashAlgo("colorhash", 1, (4, COLORHASH_TILE, COLORHASH_TILE), True, _colorhash_tile, _colorhash_from_tiles,
+             14 * COLORHASH_BINBITS),
+)}
+
+# True if one of the algorithms needs colour, JPEG is then draft decoded as RGB instead of L
+def hash_algos_need_color(names) -> bool:
+    return any(HASH_ALGOS[n].color for n in names)
+
+# Tiles of every algorithm from one decoded image, {name: tile bytes}
+def hash_tiles(img: Image.Image, names) -> dict:
+    gray = None
+    tiles = {}
+    for name in names:
+        algo = HASH_ALGOS[name]
+        if algo.color:
+            src = img
+        else:
+            if gray is None:
+                gray = img.convert("L")
+            src = gray
+        tiles[name] = algo.tile(src).tobytes()
+    return tiles
+
+# Hashes of one algorithm from tile bytes returned by workers
+def hashes_from_tiles(name: str, tiles: list) -> list:
+    if not tiles:
+        return []
+    algo = HASH_ALGOS[name]
+    stack = np.frombuffer(b"".join(tiles), dtype=np.uint8).reshape(len(tiles), *algo.shape)
+    return algo.hash(stack)
+
+# Default verification distance of each algorithm as a share of its bits. Colour hashes of unrelated
+# pictures often differ in only a few of their bits, so colorhash is held tighter than the 64 bit hashes.
+VERIFY_DISTANCE_SHARE = {"phash": 0.1875, "dhash": 0.15, "ahash": 0.125, "whash": 0.125, "colorhash": 0.1}
+
+# Largest distance of an algorithm's hashes at which a pair passes as a verification hash by default
+def verify_threshold(name: str) -> int:
+    return max(1, round(HASH_ALGOS[name].bits * VERIFY_DISTANCE_SHARE[name]))
@@ -0,0 +1,118 @@
+import threading, traceback
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+class CancelToken:
+    # Set from the GUI thread, a running job checks it between steps and stops early
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+class Job(QObject):
+    # One stage of background work. run() executes on the runner thread and returns the result,
+    # it reports through the signals which Qt delivers on the GUI thread. The GUI goes on with the
+    # stage from finished, every signal the job sent before is delivered by then.
+    # A job is either made from fn(token) or a subclass overriding run(), a job with neither does nothing
+    # and has the result None. status_text(done, total, **fields)
+    # builds the status text report() sends, it is called on the runner thread.
+    progress = pyqtSignal(int, int)     # done, total
+    status = pyqtSignal(str)            # status text of the step, see report()
+    group_found = pyqtSignal(list)      # paths of a group, for jobs emitting groups
+    finished = pyqtSignal()
+
+    def __init__(self, fn=None, status_text=None):
+        super().__init__()
+        self.fn = fn
+        self.status_text = status_text
+        self.token = CancelToken()
+        self.result = None
+        self.error = None
+        self.done = False
+
+    # Do the work and return the result, checking token.cancelled between steps
+    def run(self, token: CancelToken):
+        if self.fn is None:
+            return None
+        return self.fn(token)
+
+    # Send progress, and the status text built from it when the job has status_text
+    def report(self, done: int, total: int, **fields):
+        self.progress.emit(done, total)
+        if self.status_text is not None:
+            self.status.emit(self.status_text(done, total, **fields))
+
+    def cancel(self):
+        self.token.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+class _JobThread(QThread):
+    # Runs queued jobs until the queue is empty, the runner starts a new thread for the next submit
+    def __init__(self, runner):
+        super().__init__()
+        self.runner = runner
+
+    def run(self):
+        while True:
+            with self.runner._lock:
+                if not self.runner._pending:
+                    self.runner._active = False
+                    return
+                job = self.runner._pending.pop(0)
+            try:
+                if not job.cancelled:
+                    job.result = job.run(job.token)
+            except Exception as e:
+                job.error = e
+                print(f"[Error] Job {type(job).__name__}: {e}")
+                traceback.print_exc()
+            finally:
+                job.done = True
+                job.finished.emit()
+
+class JobRunner(QObject):
+    # Runs jobs one after the other on a background QThread, a job queued behind another waits for it.
+    # Nothing blocks the GUI thread, callers continue from the finished signal of their job.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._queued = []
+        self._active = False
+        self._thread = None
+
+    def submit(self, job: Job) -> Job:
+        self._queued = [j for j in self._queued if not j.done] + [job]
+        with self._lock:
+            self._pending.append(job)
+            if self._active:
+                return job
+            self._active = True
+        # The previous thread has left its loop, it only has to return
+        if self._thread is not None:
+            self._thread.wait()
+        self._thread = _JobThread(self)
+        self._thread.start()
+        return job
+
+    # Cancel the running job and everything queued
+    def cancel(self):
+        for job in self._queued:
+            job.cancel()
+
+    @property
+    def busy(self) -> bool:
+        return any(not j.done for j in self._queued)
+
+    # Cancel all jobs and wait for the thread, before the app quits
+    def shutdown(self):
+        self.cancel()
+        if self._thread is not None:
+            self._thread.wait()
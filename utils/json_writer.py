@@ -0,0 +1,90 @@
+import os, json, threading, weakref
+from concurrent.futures import Future
+
+_writers = weakref.WeakSet()
+
+# Wait until every writer has written what was submitted so far, before a file is read from disk
+def flush_writes():
+    for writer in list(_writers):
+        writer.flush()
+
+# True while a writer has file still to write
+def write_pending(file) -> bool:
+    return any(writer.pending(file) for writer in list(_writers))
+
+# Write data as compact JSON to a temp file and move it into place
+def write_json(file, data):
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    tmp = file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+
+class JsonWriter:
+    # Writes the db files of the roots on a background thread (JSON, other forms with a write function),
+    # a save on the GUI thread only hands over a snapshot.
+    # A file submitted again before it was written is written once, with the newest data. Files are
+    # written compactly to a temp file and moved into place, a crash leaves the old or the new file.
+    # The thread ends when nothing is left to write, the next submit starts another one.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}      # file -> (data, write, futures), in submit order
+        self._writing = None
+        self._thread = None
+        _writers.add(self)
+
+    # Queue data for file, data is a snapshot the caller doesn't change anymore or a function building
+    # it on the writer thread. write(file, data) writes other forms than JSON, atomically as well.
+    # The future is True once this data (or newer) is written, False if it failed.
+    def submit(self, file, data, write=write_json) -> Future:
+        future = Future()
+        with self._cond:
+            futures = self._pending[file][2] if file in self._pending else []
+            futures.append(future)
+            self._pending[file] = (data, write, futures)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="json-writer")
+                self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                file = next(iter(self._pending))
+                data, write, futures = self._pending.pop(file)
+                self._writing = file
+            try:
+                write(file, data() if callable(data) else data)
+                ok = True
+            except Exception as e:
+                print(f"[Error] Write {os.path.basename(file)}: {e}")
+                ok = False
+            with self._cond:
+                self._writing = None
+                self._cond.notify_all()
+            for future in futures:
+                future.set_result(ok)
+
+    # True until file is written
+    def pending(self, file) -> bool:
+        with self._cond:
+            return file in self._pending or self._writing == file
+
+    # Block until file (every file if None) is written
+    def flush(self, file=None):
+        with self._cond:
+            if file is None:
+                self._cond.wait_for(lambda: self._thread is None)
+            else:
+                self._cond.wait_for(lambda: file not in self._pending and self._writing != file)
+
+    @property
+    def busy(self) -> bool:
+        with self._cond:
+            return self._thread is not None
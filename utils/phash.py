@@ -0,0 +1,71 @@
+import numpy as np
+from PIL import Image
+
+# Same parameters as imagehash.phash(hash_size=8, highfreq_factor=4)
+PHASH_SIZE = 8
+PHASH_TILE = PHASH_SIZE * 4
+
+# Rows of the unnormalized DCT-II matrix (scipy.fftpack.dct type 2) kept for the low frequency block:
+# D[k, n] = 2 * cos(pi * k * (2n + 1) / (2N))
+def _dct_rows(n: int, rows: int) -> np.ndarray:
+    k = np.arange(rows, dtype=np.float64)[:, None]
+    x = np.arange(n, dtype=np.float64)[None, :]
+    return 2.0 * np.cos(np.pi * k * (2.0 * x + 1.0) / (2.0 * n))
+
+_DCT_LOW = _dct_rows(PHASH_TILE, PHASH_SIZE)
+
+# Reduce a PIL image to the 32x32 grayscale tile pHash is computed from
+def phash_tile(img: Image.Image) -> np.ndarray:
+    tile = img.convert("L").resize((PHASH_TILE, PHASH_TILE), Image.Resampling.LANCZOS)
+    return np.asarray(tile, dtype=np.uint8)
+
+# Build (N, 32, 32) stack from tile bytes returned by workers
+def phash_stack(tiles: list) -> np.ndarray:
+    if not tiles:
+        return np.empty((0, PHASH_TILE, PHASH_TILE), dtype=np.uint8)
+    buf = np.frombuffer(b"".join(tiles), dtype=np.uint8)
+    return buf.reshape(len(tiles), PHASH_TILE, PHASH_TILE)
+
+# pHash of stacked tiles, bit-compatible with int(str(imagehash.phash(img)), 16).
+# Only the 8x8 low frequency block of the 2D DCT is needed: D8 @ X @ D8.T for every tile at once.
+def phash_from_tiles(tiles: np.ndarray) -> list:
+    tiles = np.asarray(tiles, dtype=np.float64)
+    if tiles.ndim == 2:
+        tiles = tiles[None]
+    if len(tiles) == 0:
+        return []
+    return [int(v) for v in _phash_bits(_DCT_LOW @ tiles @ _DCT_LOW.T)]
+
+# Coefficients of the 8x8 low block above their median, packed to uint64
+def _phash_bits(low: np.ndarray) -> np.ndarray:
+    flat = low.reshape(len(low), PHASH_SIZE * PHASH_SIZE)
+    med = np.median(flat, axis=1, keepdims=True)
+    bits = flat > med
+    # First coefficient is the most significant bit, same as imagehash's hex string
+    packed = np.packbits(bits, axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+# Mirroring an axis of the tile multiplies its DCT coefficient k by (-1)^k, transposing the tile
+# transposes the block. Every rotation and mirror of the tile is a mix of both.
+_DCT_FLIP = (-1.0) ** np.arange(PHASH_SIZE)
+DIHEDRAL_VARIANTS = 8
+
+# pHash of the 8 rotations and mirrors of stacked tiles from one DCT, (N, 8) uint64.
+# Column v is the pHash of the tile rotated by v % 4 quarter turns (np.rot90), mirrored left-right first
+# for v >= 4. Column 0 is phash_from_tiles.
+def phash_variants_from_tiles(tiles: np.ndarray) -> np.ndarray:
+    tiles = np.asarray(tiles, dtype=np.float64)
+    if tiles.ndim == 2:
+        tiles = tiles[None]
+    if len(tiles) == 0:
+        return np.empty((0, DIHEDRAL_VARIANTS), dtype=np.uint64)
+    low = _DCT_LOW @ tiles @ _DCT_LOW.T
+    rows, cols = _DCT_FLIP[:, None], _DCT_FLIP[None, :]
+    low_t = low.transpose(0, 2, 1)
+    mirrored = low * cols
+    mirrored_t = mirrored.transpose(0, 2, 1)
+    variants = [
+        low, low_t * rows, low * rows * cols, low_t * cols,
+        mirrored, mirrored_t * rows, mirrored * rows * cols, mirrored_t * cols,
+    ]
+    return np.stack([_phash_bits(v) for v in variants], axis=1)
@@ -0,0 +1,122 @@
+import os, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Modification time and size of a file, (0, -1) if there is none
+def file_stamp(file):
+    try:
+        st = os.stat(file)
+    except OSError:
+        return (0, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+class _CachedRoot:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}          # name -> data as loaded or saved
+        self.stamps = {}        # name -> file stamp the data matches, None until its write is done
+        self.versions = {}      # name -> count of puts, a write only stamps the data it wrote
+        self.dirty = set()      # names saved while deferred, not written yet
+
+class RootCache:
+    # Data of the db files (file list, progress, exceptions) of the roots used lately, kept in memory as
+    # it was loaded or saved. A load takes it while the file still has the stamp it had, a save replaces
+    # it and stamps it once the write is done. While deferred, saves only mark the data dirty and each
+    # dirty root is written once by the caller. Every root has a lock, the thread writing a file takes
+    # it to stamp the data. Clean roots used least recently are dropped beyond limit.
+    def __init__(self, limit=4):
+        self.limit = max(1, int(limit))
+        self._lock = threading.Lock()
+        self._roots = OrderedDict()
+        self._deferred = 0
+
+    def _root(self, root) -> _CachedRoot:
+        with self._lock:
+            entry = self._roots.get(root)
+            if entry is None:
+                entry = self._roots[root] = _CachedRoot()
+            self._roots.move_to_end(root)
+            self._evict()
+            return entry
+
+    def _evict(self):
+        for root in list(self._roots):
+            if len(self._roots) <= self.limit:
+                return
+            if not self._roots[root].dirty:
+                del self._roots[root]
+
+    # Cached data of name, None unless file still has the stamp it had when the data was loaded or written
+    def get(self, root, name, file):
+        with self._lock:
+            entry = self._roots.get(root)
+            if entry is None:
+                return None
+            self._roots.move_to_end(root)
+        with entry.lock:
+            if name not in entry.data:
+                return None
+            stamp = entry.stamps[name]
+            if stamp is not None and stamp != file_stamp(file):
+                del entry.data[name]
+                return None
+            return entry.data[name]
+
+    # Keep data of name, stamp is the one of the file it was read from or None for data about to be written.
+    # Data about to be written is dirty while deferred, unless defer is False. Return the version to hand to written().
+    def put(self, root, name, data, stamp=None, defer=True) -> int:
+        entry = self._root(root)
+        with entry.lock:
+            entry.data[name] = data
+            entry.stamps[name] = stamp
+            entry.versions[name] = entry.versions.get(name, 0) + 1
+            if stamp is None and defer and self._deferred:
+                entry.dirty.add(name)
+            else:
+                entry.dirty.discard(name)
+            return entry.versions[name]
+
+    # The write of version of name is done (ok) or failed, from any thread
+    def written(self, root, name, version, file, ok=True):
+        with self._lock:
+            entry = self._roots.get(root)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.versions.get(name) != version:
+                return
+            if ok:
+                entry.stamps[name] = file_stamp(file)
+            else:
+                entry.data.pop(name, None)
+
+    @property
+    def deferred(self) -> bool:
+        return self._deferred > 0
+
+    # Saves in the block only mark data dirty, write it with take_dirty() before the block ends
+    @contextmanager
+    def defer(self):
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+
+    # {name: (data, version)} of root saved while deferred, the caller writes them now
+    def take_dirty(self, root) -> dict:
+        with self._lock:
+            entry = self._roots.get(root)
+        if entry is None:
+            return {}
+        with entry.lock:
+            dirty = {name: (entry.data[name], entry.versions[name]) for name in sorted(entry.dirty)}
+            entry.dirty.clear()
+            return dirty
+
+    # Forget the roots at or inside path, deleted, moved away or closed. Data not written yet is dropped.
+    def discard(self, path):
+        inside = os.path.join(path, "")
+        with self._lock:
+            for root in [r for r in self._roots if r == path or r.startswith(inside)]:
+                del self._roots[root]
@@ -0,0 +1,271 @@
+import os, json, sqlite3
+from utils.hash_table import HashEntries
+
+ROOT_INDEX_FILE = ".index.sqlite3"
+ROOT_INDEX_SCHEMA = 1
+
+# SQLite INTEGER is signed 64 bit, hashes are unsigned
+def _to_db(h):
+    if h is None:
+        return None
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+# Length of the common head of two lists, the window is halved with slice compares which run in C
+def _common_prefix(a, b) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# Length of the common tail of two lists, at most limit
+def _common_suffix(a, b, limit) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+class RootIndex:
+    # Per scan root SQLite database (WAL) holding what the JSON files hold: progress values, file list,
+    # hashes, groups, exceptions and constraints. Saves write the rows which changed since the last
+    # save only, one mark or one deleted file is a few row upserts instead of rewriting every file.
+    # Values are JSON documents, data returned by the load_* methods has the shape of the JSON files.
+    # What was last loaded or saved is kept in memory and handed out again while no other connection
+    # wrote the database, loading a root again doesn't read every row.
+    def __init__(self, root: str):
+        self.path = os.path.join(root, ROOT_INDEX_FILE)
+        self.db = sqlite3.connect(self.path, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Rowid keeps the order of the file list
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (seq INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, hash INTEGER, entry TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS groups ("
+            " kind TEXT NOT NULL, idx INTEGER NOT NULL, members TEXT NOT NULL, PRIMARY KEY (kind, idx))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS constraints ("
+            " kind TEXT NOT NULL, a TEXT NOT NULL, b TEXT NOT NULL, PRIMARY KEY (kind, a, b))"
+        )
+        self.db.commit()
+        # Last written state, saves are diffed against it
+        self._data_version = None
+        self._refresh()
+
+    # Drop the state kept in memory when another connection committed since it was read
+    def _refresh(self):
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        self._meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        self._files = None
+        self._groups = {}
+        self._constraints = None
+        self._phashes = None
+
+    # False until data was imported or saved the first time
+    @property
+    def initialized(self) -> bool:
+        return self.db.execute("PRAGMA user_version").fetchone()[0] >= ROOT_INDEX_SCHEMA
+
+    def _mark_initialized(self):
+        self.db.execute(f"PRAGMA user_version={ROOT_INDEX_SCHEMA}")
+
+    def close(self):
+        self.db.close()
+
+    # ---- meta values ----
+    def _get(self, key, default=None):
+        value = self._meta.get(key)
+        return default if value is None else json.loads(value)
+
+    def _put(self, key, value):
+        text = _dumps(value)
+        if self._meta.get(key) != text:
+            self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                            "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, text))
+            self._meta[key] = text
+
+    # ---- progress ----
+    # Progress data like .progress.json, None if none was saved. phashes are HashEntries, the ones handed
+    # out last time while they have no unsaved changes.
+    def load_progress(self):
+        self._refresh()
+        progress = self._get("progress")
+        if progress is None:
+            return None
+        phashes = self._phashes
+        if phashes is None or phashes.changed or phashes.removed:
+            self._phashes = HashEntries((path, json.loads(entry)) for path, entry in self.db.execute("SELECT path, entry FROM hashes"))
+        progress["groups"] = self._copy_groups("groups")
+        progress["exact_groups"] = self._copy_groups("exact")
+        progress["phashes"] = self._phashes
+        return progress
+
+    # Save progress data like .progress.json. Hashes handed out by load_progress (or returned by an earlier
+    # save) write their changed rows only, any other dict rewrites the table. Return the HashEntries to
+    # keep using, HashEntries passed in are kept.
+    def save_progress(self, data: dict):
+        self._refresh()
+        data = dict(data)
+        phashes = data.pop("phashes", {})
+        groups = data.pop("groups", [])
+        exact_groups = data.pop("exact_groups", [])
+        with self.db:
+            self._put("progress", data)
+            self._save_groups("groups", groups)
+            self._save_groups("exact", exact_groups)
+            if phashes is self._phashes:
+                changed, removed = phashes.changed, phashes.removed
+                if removed:
+                    self.db.executemany("DELETE FROM hashes WHERE path=?", [(p,) for p in removed])
+            else:
+                self.db.execute("DELETE FROM hashes")
+                if not isinstance(phashes, HashEntries):
+                    phashes = HashEntries(phashes)
+                changed = phashes.keys()
+            if changed:
+                self.db.executemany(
+                    "INSERT INTO hashes (path, hash, entry) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET hash=excluded.hash, entry=excluded.entry",
+                    [(p, _to_db(e.get("hash") if isinstance(e, dict) else e), _dumps(e))
+                     for p, e in ((p, phashes[p]) for p in changed)]
+                )
+            self._mark_initialized()
+        phashes.changed = set()
+        phashes.removed = set()
+        self._phashes = phashes
+        return phashes
+
+    def _copy_groups(self, kind):
+        if kind not in self._groups:
+            return self._load_groups(kind)
+        return [list(g) for g in self._groups[kind]]
+
+    def _load_groups(self, kind):
+        groups = [json.loads(m) for m, in self.db.execute("SELECT members FROM groups WHERE kind=? ORDER BY idx", (kind,))]
+        self._groups[kind] = [list(g) for g in groups]
+        return groups
+
+    # Upsert the groups from the first changed one on (up to the last changed one while the count stays)
+    # and drop the ones past the end
+    def _save_groups(self, kind, groups):
+        old = self._groups.get(kind)
+        if old is None:
+            old = self._load_groups(kind)
+        head = _common_prefix(old, groups)
+        end = len(groups)
+        if len(groups) == len(old):
+            end -= _common_suffix(old, groups, end - head)
+        if head < end:
+            self.db.executemany("INSERT INTO groups (kind, idx, members) VALUES (?, ?, ?) "
+                                "ON CONFLICT(kind, idx) DO UPDATE SET members=excluded.members",
+                                [(kind, k, _dumps(groups[k])) for k in range(head, end)])
+        if len(groups) < len(old):
+            self.db.execute("DELETE FROM groups WHERE kind=? AND idx>=?", (kind, len(groups)))
+        self._groups[kind] = old[:head] + [list(g) for g in groups[head:]]
+
+    # ---- file list ----
+    # File list data like .filelist.json, None if none was saved
+    def load_filelist(self):
+        self._refresh()
+        if "last_scan_time" not in self._meta:
+            return None
+        if self._files is None:
+            self._files = [p for p, in self.db.execute("SELECT path FROM files ORDER BY seq")]
+        return {"last_scan_time": self._get("last_scan_time"), "image_paths": list(self._files)}
+
+    # Only the window between the common head and tail of the lists is written: removed files are deleted,
+    # renames in place updated and new files at the end appended, other changes rewrite the list
+    def save_filelist(self, data: dict):
+        self._refresh()
+        new = list(data["image_paths"])
+        with self.db:
+            self._put("last_scan_time", data.get("last_scan_time"))
+            old = self._files
+            if old is None:
+                old = [p for p, in self.db.execute("SELECT path FROM files ORDER BY seq")]
+            if new != old:
+                self._save_files(old, new)
+            self._mark_initialized()
+        self._files = new
+
+    def _save_files(self, old, new):
+        head = _common_prefix(old, new)
+        tail = _common_suffix(old, new, min(len(old), len(new)) - head)
+        gone, came = old[head:len(old) - tail], new[head:len(new) - tail]
+        came_set = set(came)
+        if len(gone) == len(came) and came_set.isdisjoint(gone):
+            self.db.executemany("UPDATE OR IGNORE files SET path=? WHERE path=?", zip(came, gone))
+            return
+        # Rowids keep the order, new files can only go after the last one
+        kept = [p for p in gone if p in came_set]
+        if came[:len(kept)] == kept and (tail == 0 or len(kept) == len(came)):
+            self.db.executemany("DELETE FROM files WHERE path=?", [(p,) for p in gone if p not in came_set])
+            self.db.executemany("INSERT OR IGNORE INTO files (path) VALUES (?)", [(p,) for p in came[len(kept):]])
+        else:
+            self.db.execute("DELETE FROM files")
+            self.db.executemany("INSERT OR IGNORE INTO files (path) VALUES (?)", [(p,) for p in new])
+
+    # ---- exceptions ----
+    def load_exceptions(self):
+        self._refresh()
+        return self._get("exceptions")
+
+    def save_exceptions(self, data: dict):
+        self._refresh()
+        with self.db:
+            self._put("exceptions", data)
+            self._mark_initialized()
+
+    # ---- constraints ----
+    # (version, must pairs, cannot pairs, ignored files), None if none were saved
+    def load_constraints(self):
+        self._refresh()
+        if "constraints_version" not in self._meta:
+            return None
+        must, cannot, ignored = set(), set(), set()
+        for kind, a, b in self.db.execute("SELECT kind, a, b FROM constraints"):
+            if kind == "must":
+                must.add((a, b))
+            elif kind == "cannot":
+                cannot.add((a, b))
+            else:
+                ignored.add(a)
+        self._constraints = (set(must), set(cannot), set(ignored))
+        return self._get("constraints_version"), must, cannot, ignored
+
+    def save_constraints(self, version, must_pairs, cannot_pairs, ignored_files):
+        self._refresh()
+        new = (set(must_pairs), set(cannot_pairs), set(ignored_files))
+        old = self._constraints
+        with self.db:
+            self._put("constraints_version", version)
+            if old is None:
+                self.db.execute("DELETE FROM constraints")
+                old = (set(), set(), set())
+            rows_add, rows_del = [], []
+            for kind, o, n in (("must", old[0], new[0]), ("cannot", old[1], new[1])):
+                rows_add += [(kind, a, b) for a, b in n - o]
+                rows_del += [(kind, a, b) for a, b in o - n]
+            rows_add += [("ignored", p, "") for p in new[2] - old[2]]
+            rows_del += [("ignored", p, "") for p in old[2] - new[2]]
+            if rows_del:
+                self.db.executemany("DELETE FROM constraints WHERE kind=? AND a=? AND b=?", rows_del)
+            if rows_add:
+                self.db.executemany("INSERT OR IGNORE INTO constraints (kind, a, b) VALUES (?, ?, ?)", rows_add)
+            self._mark_initialized()
+        self._constraints = new
@@ -4,7 +4,11 @@ from PyQt5.QtWidgets import (
     QLineEdit, QDialogButtonBox, QWidget, QFormLayout, QMessageBox, QSpinBox, QToolButton
 )
 from PyQt5.QtGui import QPainter, QPen, QFontMetrics, QFont
-from PyQt5.QtCore import Qt, pyqtSignal, QRect
+from PyQt5.QtCore import Qt, pyqtSignal, QRect, QTimer
+from utils.config_manager import SIMILARITY_TOLERANCE_MAX
+
+# The group count preview is only computed once the slider rests this long (ms)
+GROUP_COUNT_PREVIEW_DELAY_MS = 200
 
 class LabeledLine(QWidget):
     def __init__(self, label="UI", line_height=2, size=None, gap=12, parent=None):
@@ -77,11 +81,20 @@ class SettingsDialog(QDialog):
     # Emits the list of changed configuration keys so the app can hot‑apply changes when the user presses Apply or OK.
     settings_applied = pyqtSignal(list)
 
-    def __init__(self, cfg, i18n, binder, parent=None):
+    # group_count_preview(tolerance, compare_file_size) returns the number of groups a setting would give,
+    # or None when it isn't known without comparing again
+    def __init__(self, cfg, i18n, binder, parent=None, group_count_preview=None):
         super().__init__(parent)
         self.cfg = cfg
         self.i18n = i18n
         self.binder = binder
+        self.group_count_preview = group_count_preview
+        # Counts already computed, by (tolerance, compare_file_size)
+        self.group_counts = {}
+        self.group_count_timer = QTimer(self)
+        self.group_count_timer.setSingleShot(True)
+        self.group_count_timer.setInterval(GROUP_COUNT_PREVIEW_DELAY_MS)
+        self.group_count_timer.timeout.connect(self._update_group_count_preview)
 
         self._build_ui()
         self._load_from_config()
@@ -212,11 +225,13 @@ class SettingsDialog(QDialog):
         similarity_tolerance_h = QHBoxLayout(similarity_tolerance_row)
         self.similarity_tolerance_slider = QSlider(Qt.Horizontal)
         self.similarity_tolerance_slider.setMinimum(0)
-        self.similarity_tolerance_slider.setMaximum(15)
+        self.similarity_tolerance_slider.setMaximum(SIMILARITY_TOLERANCE_MAX)
         self.similarity_tolerance_slider.setSingleStep(1)
         self.similarity_tolerance_value_label = QLabel("--")
+        self.similarity_tolerance_preview_label = QLabel("")
         similarity_tolerance_h.addWidget(self.similarity_tolerance_slider, 1)
         similarity_tolerance_h.addWidget(self.similarity_tolerance_value_label)
+        similarity_tolerance_h.addWidget(self.similarity_tolerance_preview_label)
         self.lbl_similarity_tolerance = QLabel()
         self.binder.bind(self.lbl_similarity_tolerance, "setText", "dlg.settings.similarity_tolerance")
         form.addRow(self.lbl_similarity_tolerance, similarity_tolerance_row)
@@ -314,6 +329,24 @@ class SettingsDialog(QDialog):
         self.similarity_tolerance_slider.valueChanged.connect(
             lambda val: self.similarity_tolerance_value_label.setText(str(val))
         )
+
+        # Preview how many groups the tolerance gives
+        self.similarity_tolerance_slider.valueChanged.connect(lambda _: self.group_count_timer.start())
+        self.cb_compare_file_size.toggled.connect(lambda _: self.group_count_timer.start())
+
+    def _update_group_count_preview(self, *_):
+        self.group_count_timer.stop()
+        groups = None
+        if self.group_count_preview is not None:
+            key = (int(self.similarity_tolerance_slider.value()), self.cb_compare_file_size.isChecked())
+            if key not in self.group_counts:
+                self.group_counts[key] = self.group_count_preview(*key)
+            groups = self.group_counts[key]
+        if groups is None:
+            self.similarity_tolerance_preview_label.setText("")
+        else:
+            self.similarity_tolerance_preview_label.setText(self.i18n.t("dlg.settings.similarity_tolerance_preview", groups=groups))
+
     # -------- data flow --------
     def _load_from_config(self):
         #self.theme.setCurrentText(self.cfg.get("ui.theme", "system"))
@@ -352,6 +385,7 @@ class SettingsDialog(QDialog):
         self.cb_compare_file_size.setChecked(bool(self.cfg.get("behavior.compare_file_size", True)))
         #self.delete_to_trash.setChecked(bool(self.cfg.get("behavior.delete_to_trash", True)))
         self.font_size_spin.setValue(int(self.cfg.get("ui.font_size", 12)))
+        self._update_group_count_preview()
 
     def _collect_changes(self):
         # Compare the current UI values against the config and return ({key_path: value}, changed_keys list)
@@ -398,6 +432,7 @@ class SettingsDialog(QDialog):
             self.cfg.set(k, v, autosave=False)
         self.cfg.save()
         self.settings_applied.emit(keys)
+        self.group_counts.clear()
 
         # Show success message
         box = QMessageBox(self)
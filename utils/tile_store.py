@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from utils.phash import PHASH_TILE
+from utils.hash_table import pack_paths, unpack_paths
+
+# Pairs compared per step, bounds the temporary float arrays
+SIMILARITY_CHUNK = 8192
+# SSIM is averaged over windows of this edge, constants of the usual 8 bit definition
+SSIM_WINDOW = 8
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+class TileStore:
+    # 32x32 grayscale tiles kept from hashing (the pHash input) per file of a scan root, so candidate
+    # pairs can be checked pixel by pixel without reading the files again. Saved next to the progress file.
+    def __init__(self, tiles=None):
+        self.tiles = dict(tiles or {})
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, rel):
+        return rel in self.tiles
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            tiles = data["tiles"]
+            # Stores saved before the paths were packed hold them as a str array
+            paths = data["paths"].tolist() if data["paths"].dtype.kind == "U" else unpack_paths(data["paths"], len(tiles))
+            return cls(zip(paths, (t.tobytes() for t in tiles)))
+
+    # Written to a temp file first, a crash never leaves a half written store
+    def save(self, file):
+        tmp = file + ".tmp"
+        paths = list(self.tiles)
+        tiles = np.frombuffer(b"".join(self.tiles[p] for p in paths), dtype=np.uint8)
+        with open(tmp, "wb") as f:
+            np.savez(f, paths=pack_paths(paths), tiles=tiles.reshape(len(paths), PHASH_TILE, PHASH_TILE))
+        os.replace(tmp, file)
+        self.dirty = False
+
+    def put(self, rel, tile: bytes):
+        self.tiles[rel] = tile
+        self.dirty = True
+
+    def copy(self, src, dst):
+        if src in self.tiles:
+            self.put(dst, self.tiles[src])
+
+    def rename(self, old, new):
+        if old in self.tiles:
+            self.put(new, self.tiles.pop(old))
+
+    # Drop tiles of files no longer in keep
+    def prune(self, keep):
+        gone = [rel for rel in self.tiles if rel not in keep]
+        for rel in gone:
+            del self.tiles[rel]
+        self.dirty |= bool(gone)
+
+    # (N, 32, 32) tiles of the paths and a mask of the paths having one, missing tiles are zero
+    def stack(self, paths):
+        found = np.array([p in self.tiles for p in paths], dtype=bool)
+        out = np.zeros((len(paths), PHASH_TILE, PHASH_TILE), dtype=np.uint8)
+        if found.any():
+            buf = b"".join(self.tiles[p] for p, f in zip(paths, found) if f)
+            out[found] = np.frombuffer(buf, dtype=np.uint8).reshape(-1, PHASH_TILE, PHASH_TILE)
+        return out, found
+
+# Mean SSIM over SSIM_WINDOW windows of tile pairs a, b (M, T, T)
+def _ssim(a, b):
+    n = len(a)
+    k = a.shape[1] // SSIM_WINDOW
+    a = a.reshape(n, k, SSIM_WINDOW, k, SSIM_WINDOW)
+    b = b.reshape(n, k, SSIM_WINDOW, k, SSIM_WINDOW)
+    mu_a, mu_b = a.mean(axis=(2, 4)), b.mean(axis=(2, 4))
+    var_a = (a * a).mean(axis=(2, 4)) - mu_a * mu_a
+    var_b = (b * b).mean(axis=(2, 4)) - mu_b * mu_b
+    cov = (a * b).mean(axis=(2, 4)) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + _SSIM_C1) * (2 * cov + _SSIM_C2)) / \
+           ((mu_a * mu_a + mu_b * mu_b + _SSIM_C1) * (var_a + var_b + _SSIM_C2))
+    return ssim.mean(axis=(1, 2))
+
+# Normalized cross-correlation of tile pairs, 1 for two flat tiles, 0 for one flat tile
+def _ncc(a, b):
+    a = a.reshape(len(a), -1)
+    b = b.reshape(len(b), -1)
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    na, nb = (a * a).sum(axis=1), (b * b).sum(axis=1)
+    den = np.sqrt(na * nb)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ncc = (a * b).sum(axis=1) / den
+    return np.where(den > 0, ncc, np.where((na == 0) & (nb == 0), 1.0, 0.0))
+
+SIMILARITY_METRICS = {"ssim": _ssim, "ncc": _ncc}
+
+# The 8 rotations and mirrors of tiles (M, T, T), in the order of phash_variants_from_tiles
+def _dihedral(tiles):
+    mirrored = tiles[:, :, ::-1]
+    return [np.rot90(t, k, axes=(1, 2)) for t in (tiles, mirrored) for k in range(4)]
+
+# Similarity of the tiles of item pairs (i, j), NaN where an item has no tile.
+# With dihedral the best of every rotation and mirror of tile j counts.
+def pair_similarity(tiles, found, i, j, metric="ssim", dihedral=False) -> np.ndarray:
+    fn = SIMILARITY_METRICS[metric]
+    sim = np.full(len(i), np.nan, dtype=np.float32)
+    ok = np.flatnonzero(found[i] & found[j])
+    for s in range(0, len(ok), SIMILARITY_CHUNK):
+        k = ok[s:s + SIMILARITY_CHUNK]
+        a, b = tiles[i[k]].astype(np.float32), tiles[j[k]].astype(np.float32)
+        if dihedral:
+            sim[k] = np.max([fn(a, v) for v in _dihedral(b)], axis=0)
+        else:
+            sim[k] = fn(a, b)
+    return sim